@@ -2,7 +2,9 @@ import streamlit as st
 import pandas as pd
 from datetime import date
 
-from modules import login, clientes, renovaciones, cartera, trazabilidad, dashboard
+from modules import login, clientes, renovaciones, cartera, campanas, trazabilidad, dashboard
+from modules.kpis import version_dataset, cubo_kpis
+from modules.contactos import validar_contactos
 
 DATA_PATH = "sabana_cartera_renovaciones_200cols.csv"  # ajusta en tu proyecto
 BASE_PAGOS = "https://optimoconsultores.com/pagos/"    # placeholder MVP
@@ -14,7 +16,7 @@ st.set_page_config(
 )
 
 @st.cache_data(show_spinner=False)
-def load_data(path: str) -> pd.DataFrame:
+def load_data(path: str, version: str = "") -> pd.DataFrame:
     df = pd.read_csv(path)
 
     # Normalizaciones mínimas (fechas)
@@ -23,6 +25,9 @@ def load_data(path: str) -> pd.DataFrame:
         if c in df.columns:
             df[c] = pd.to_datetime(df[c], errors="coerce")
 
+    # Contactos: teléfonos en E.164 y emails validados (los inválidos no se envían)
+    df = validar_contactos(df)
+
     # Derivado: link de pago (si no existe)
     if "link_pago" not in df.columns and {"id_cliente", "id_poliza", "valor_en_mora"}.issubset(df.columns):
         df["link_pago"] = (
@@ -40,9 +45,13 @@ def init_session():
     st.session_state.setdefault("role", None)
     st.session_state.setdefault("page", "login")
 
-    # dataset compartido
+    # dataset compartido (la versión invalida la caché si el archivo cambia)
     if "df" not in st.session_state:
-        st.session_state["df"] = load_data(DATA_PATH)
+        version = version_dataset(DATA_PATH)
+        st.session_state["df_version"] = version
+        st.session_state["df"] = load_data(DATA_PATH, version)
+        # Agregados del tablero materializados una sola vez por versión
+        st.session_state["kpis"] = cubo_kpis(version, st.session_state["df"])
 
 def logout():
     st.session_state["auth"] = False
@@ -63,7 +72,8 @@ def sidebar():
             "2. Tablero de Visualización",
             "3. Renovaciones",
             "4. Cartera",
-            "5. Trazabilidad"
+            "5. Plan de Campañas",
+            "6. Trazabilidad"
         ])
         # Mapear nombres en español a claves internas
         page_map = {
@@ -71,7 +81,8 @@ def sidebar():
             "2. Tablero de Visualización": "dashboard",
             "3. Renovaciones": "renovaciones",
             "4. Cartera": "cartera",
-            "5. Trazabilidad": "trazabilidad"
+            "5. Plan de Campañas": "campanas",
+            "6. Trazabilidad": "trazabilidad"
         }
         st.session_state["page"] = page_map.get(page, page.lower())
 
@@ -92,6 +103,8 @@ def router():
         renovaciones.render(df)
     elif st.session_state["page"] == "cartera":
         cartera.render(df)
+    elif st.session_state["page"] == "campanas":
+        campanas.render(df)
     elif st.session_state["page"] == "trazabilidad":
         trazabilidad.render(df)
     else:
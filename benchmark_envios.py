@@ -0,0 +1,218 @@
+"""
+Benchmark de throughput del envío masivo contra proveedores locales
+
+Levanta un sumidero SMTP y un endpoint local de la API de Twilio, genera campañas sintéticas
+de cartera y renovaciones y las envía con enviar_notificaciones_*_masivo en modo producción
+(pool SMTP, cliente HTTP, despacho, reintentos, idempotencia y log reales). Reporta mensajes
+por segundo, latencia p50/p99 por mensaje y el costo de escribir el log de trazabilidad.
+
+Uso:
+    python benchmark_envios.py                                 # 1.000 y 10.000 filas, ambos tipos y canales
+    python benchmark_envios.py --filas 1000 100000 --canal email
+    python benchmark_envios.py --guardar base.json             # Guarda los resultados como línea base
+    python benchmark_envios.py --comparar base.json            # Falla (código 1) si hay una regresión
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List
+import numpy as np
+
+from benchmarks.datos_sinteticos import CAMPANAS
+from benchmarks.servidores_locales import SumideroSMTP, TwilioLocal
+
+FILAS_POR_DEFECTO = [1000, 10000]
+TOLERANCIA_POR_DEFECTO = 0.2  # Caída de throughput (o aumento de p99) aceptada frente a la línea base
+
+def configurar_entorno(smtp: SumideroSMTP, twilio: TwilioLocal, args: argparse.Namespace):
+    """Apunta la configuración de producción a los servidores locales (variables de entorno)"""
+    os.environ.update({
+        "NOTIFICACIONES_MODO": "produccion",
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": str(smtp.puerto),
+        "SMTP_STARTTLS": "false",
+        "EMAIL_FROM": "benchmark@benchmark.local",
+        "EMAIL_PASSWORD": "benchmark",
+        "TWILIO_ACCOUNT_SID": "ACbenchmark",
+        "TWILIO_AUTH_TOKEN": "benchmark",
+        "WHATSAPP_FROM": "whatsapp:+14155238886",
+        "TWILIO_API_BASE": twilio.api_base,
+        "DESPACHO_TASA_EMAIL": str(args.tasa),
+        "DESPACHO_TASA_WHATSAPP": str(args.tasa),
+    })
+    if args.workers:
+        os.environ["DESPACHO_WORKERS"] = str(args.workers)
+
+class Mediciones:
+    """Latencias por mensaje y tiempo acumulado de escritura del log (thread-safe)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencias: List[float] = []
+        self.escrituras_log = 0
+        self.segundos_log = 0.0
+
+    def registrar_envio(self, segundos: float):
+        with self._lock:
+            self.latencias.append(segundos)
+
+    def registrar_log(self, segundos: float):
+        with self._lock:
+            self.escrituras_log += 1
+            self.segundos_log += segundos
+
+@contextmanager
+def instrumentar(notificaciones, tipo: str, mediciones: Mediciones):
+    """
+    Mide cada envío por fila (validación, envío al proveedor con reintentos y log) y cada
+    escritura del log, envolviendo las funciones del módulo durante la corrida
+    """
+    nombre_fila = f"enviar_notificacion_{tipo}"
+    enviar_fila = getattr(notificaciones, nombre_fila)
+    log_notificacion = notificaciones.log_notificacion
+
+    def enviar_medido(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return enviar_fila(*args, **kwargs)
+        finally:
+            mediciones.registrar_envio(time.perf_counter() - inicio)
+
+    def log_medido(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return log_notificacion(*args, **kwargs)
+        finally:
+            mediciones.registrar_log(time.perf_counter() - inicio)
+
+    setattr(notificaciones, nombre_fila, enviar_medido)
+    notificaciones.log_notificacion = log_medido
+    try:
+        yield
+    finally:
+        setattr(notificaciones, nombre_fila, enviar_fila)
+        notificaciones.log_notificacion = log_notificacion
+
+def ejecutar_escenario(notificaciones, tipo: str, canal: str, filas: int, directorio: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """Envía una campaña sintética y resume sus métricas"""
+    df = CAMPANAS[tipo](filas, semilla=args.semilla)
+    # Log propio por escenario: el índice de idempotencia empieza vacío y no se toca el log real
+    notificaciones.NOTIFICACIONES_LOG = os.path.join(directorio, f"{tipo}_{canal}_{filas}.jsonl")
+    enviar_masivo = {
+        "cartera": notificaciones.enviar_notificaciones_cartera_masivo,
+        "renovacion": notificaciones.enviar_notificaciones_renovacion_masivo,
+    }[tipo]
+
+    mediciones = Mediciones()
+    with instrumentar(notificaciones, tipo, mediciones):
+        inicio = time.perf_counter()
+        resultados = enviar_masivo(df, canal=canal, max_workers=args.workers or None, usuario="benchmark")
+        duracion = time.perf_counter() - inicio
+
+    latencias = np.array(mediciones.latencias) * 1000
+    tiempo_envio = latencias.sum() / 1000
+    return {
+        "tipo": tipo,
+        "canal": canal,
+        "filas": filas,
+        "enviados": resultados["enviados"],
+        "fallidos": resultados["fallidos"] + resultados["reencolados"],
+        "segundos": round(duracion, 3),
+        "mensajes_por_segundo": round(resultados["enviados"] / duracion, 1) if duracion else 0.0,
+        "p50_ms": round(float(np.percentile(latencias, 50)), 3) if len(latencias) else 0.0,
+        "p99_ms": round(float(np.percentile(latencias, 99)), 3) if len(latencias) else 0.0,
+        "log_us_por_mensaje": round(mediciones.segundos_log / mediciones.escrituras_log * 1e6, 1) if mediciones.escrituras_log else 0.0,
+        "log_pct_envio": round(100 * mediciones.segundos_log / tiempo_envio, 1) if tiempo_envio else 0.0,
+    }
+
+def imprimir_tabla(resultados: List[Dict[str, Any]]):
+    encabezado = f"{'tipo':<11}{'canal':<10}{'filas':>8}{'enviados':>10}{'fallidos':>10}{'seg':>9}{'msg/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'log µs':>9}{'log %':>7}"
+    print(encabezado)
+    print("-" * len(encabezado))
+    for r in resultados:
+        print(
+            f"{r['tipo']:<11}{r['canal']:<10}{r['filas']:>8}{r['enviados']:>10}{r['fallidos']:>10}"
+            f"{r['segundos']:>9.2f}{r['mensajes_por_segundo']:>10.1f}{r['p50_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+            f"{r['log_us_por_mensaje']:>9.1f}{r['log_pct_envio']:>7.1f}"
+        )
+
+def comparar(resultados: List[Dict[str, Any]], path: str, tolerancia: float) -> List[str]:
+    """
+    Compara contra una línea base guardada con --guardar
+
+    Returns:
+        Descripción de cada regresión (throughput menor o p99 mayor que la tolerancia)
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        base = {(r["tipo"], r["canal"], r["filas"]): r for r in json.load(f)["resultados"]}
+    regresiones = []
+    for r in resultados:
+        anterior = base.get((r["tipo"], r["canal"], r["filas"]))
+        if anterior is None:
+            continue
+        escenario = f"{r['tipo']}/{r['canal']}/{r['filas']}"
+        if r["mensajes_por_segundo"] < anterior["mensajes_por_segundo"] * (1 - tolerancia):
+            regresiones.append(f"{escenario}: {r['mensajes_por_segundo']} msg/s (base {anterior['mensajes_por_segundo']})")
+        if r["p99_ms"] > anterior["p99_ms"] * (1 + tolerancia):
+            regresiones.append(f"{escenario}: p99 {r['p99_ms']} ms (base {anterior['p99_ms']})")
+    return regresiones
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de throughput del envío masivo")
+    parser.add_argument("--filas", type=int, nargs="+", default=FILAS_POR_DEFECTO, help="Tamaños de campaña a medir")
+    parser.add_argument("--tipo", choices=["cartera", "renovacion", "todos"], default="todos")
+    parser.add_argument("--canal", choices=["email", "whatsapp", "todos"], default="todos")
+    parser.add_argument("--workers", type=int, default=0, help="Envíos concurrentes (por defecto el configurado en [despacho])")
+    parser.add_argument("--tasa", type=float, default=0, help="Límite de mensajes/segundo por canal (0 = sin límite)")
+    parser.add_argument("--latencia-proveedor", type=float, default=0.0, help="Milisegundos que tardan los servidores locales en aceptar cada mensaje")
+    parser.add_argument("--semilla", type=int, default=0, help="Semilla de las campañas sintéticas")
+    parser.add_argument("--guardar", metavar="JSON", help="Guarda los resultados (línea base)")
+    parser.add_argument("--comparar", metavar="JSON", help="Compara contra una línea base y termina con código 1 si hay regresión")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA_POR_DEFECTO, help="Variación aceptada frente a la línea base (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    latencia = args.latencia_proveedor / 1000
+    smtp = SumideroSMTP(latencia=latencia).iniciar()
+    twilio = TwilioLocal(latencia=latencia).iniciar()
+    configurar_entorno(smtp, twilio, args)
+    # Se importa después de configurar el entorno para que ningún valor por defecto quede en caché
+    from modules import notificaciones
+    from modules.smtp_pool import cerrar_pools_smtp
+
+    tipos = list(CAMPANAS) if args.tipo == "todos" else [args.tipo]
+    canales = ["email", "whatsapp"] if args.canal == "todos" else [args.canal]
+    directorio = tempfile.mkdtemp(prefix="benchmark_envios_")
+    resultados = []
+    try:
+        for filas in args.filas:
+            for tipo in tipos:
+                for canal in canales:
+                    resultados.append(ejecutar_escenario(notificaciones, tipo, canal, filas, directorio, args))
+    finally:
+        cerrar_pools_smtp()
+        smtp.detener()
+        twilio.detener()
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    imprimir_tabla(resultados)
+    print(f"\nSMTP: {smtp.contadores.resumen()} | Twilio: {twilio.contadores.resumen()}")
+
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "resultados": resultados}, f, ensure_ascii=False, indent=2)
+    if args.comparar:
+        regresiones = comparar(resultados, args.comparar, args.tolerancia)
+        for regresion in regresiones:
+            print(f"❌ Regresión: {regresion}")
+        if regresiones:
+            sys.exit(1)
+        print("✅ Sin regresiones frente a la línea base")
+
+if __name__ == "__main__":
+    main()
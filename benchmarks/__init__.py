@@ -0,0 +1,4 @@
+"""
+Utilidades del benchmark de envíos: servidores locales que reemplazan a los proveedores
+(SMTP / Twilio) y generación de campañas sintéticas
+"""
@@ -0,0 +1,61 @@
+"""
+Campañas sintéticas de cartera y renovaciones para el benchmark
+Genera DataFrames con las columnas de la sábana que usan las plantillas y el envío masivo,
+con contactos únicos y consentimiento en todas las filas para que todas lleguen al proveedor
+"""
+from datetime import datetime
+from typing import Optional
+import numpy as np
+import pandas as pd
+
+PRODUCTOS = ["Autos", "Hogar", "Vida", "Salud", "PYME"]
+PLANES = ["A", "B", "C"]
+SEGMENTOS = ["Personas", "Pymes", "Corporativo"]
+IDIOMAS = ["es", "es", "es", "en"]  # ~25% en inglés, para ejercitar las variantes de plantilla
+
+def _base(filas: int, azar: np.random.Generator, prefijo: str) -> pd.DataFrame:
+    """Columnas comunes: identificadores, contacto, consentimientos y atributos de plantilla"""
+    consecutivo = np.arange(filas)
+    ids = pd.Series(consecutivo).astype(str).str.zfill(7)
+    return pd.DataFrame({
+        "id_cliente": "CLIBENCH" + ids,
+        "id_poliza": "POLBENCH" + ids,
+        "numero_poliza": f"{prefijo}-" + ids,
+        "nombre_cliente": "Cliente Benchmark " + ids,
+        "email_cliente": "cliente" + ids + "@benchmark.local",
+        "telefono_cliente": "+57300" + ids,
+        "consentimiento_email": "sí",
+        "consentimiento_whatsapp": "sí",
+        "producto": azar.choice(PRODUCTOS, filas),
+        "plan": azar.choice(PLANES, filas),
+        "segmento": azar.choice(SEGMENTOS, filas),
+        "idioma_preferido": azar.choice(IDIOMAS, filas),
+    })
+
+def campana_cartera(filas: int, semilla: Optional[int] = 0, prefijo: str = "BENCH") -> pd.DataFrame:
+    """Pólizas en mora con valores, días de mora y fechas límite aleatorias"""
+    azar = np.random.default_rng(semilla)
+    df = _base(filas, azar, prefijo)
+    hoy = pd.Timestamp(datetime.now().date())
+    df["dias_mora"] = azar.integers(1, 120, filas)
+    df["valor_en_mora"] = azar.uniform(50_000, 5_000_000, filas).round()
+    df["fecha_venc_factura"] = hoy + pd.to_timedelta(azar.integers(1, 30, filas), unit="D")
+    df["link_pago"] = "https://pagos.benchmark.local/" + df["numero_poliza"]
+    return df
+
+def campana_renovacion(filas: int, semilla: Optional[int] = 0, prefijo: str = "BENCH") -> pd.DataFrame:
+    """Pólizas próximas a vencer (o recién vencidas) con fecha de fin de vigencia coherente"""
+    azar = np.random.default_rng(semilla)
+    df = _base(filas, azar, prefijo)
+    hoy = pd.Timestamp(datetime.now().date())
+    dias = azar.integers(-15, 60, filas)
+    df["dias_para_vencimiento"] = dias
+    df["fecha_fin_vigencia"] = hoy + pd.to_timedelta(dias, unit="D")
+    df["valor_en_mora"] = 0.0
+    df["dias_mora"] = 0
+    return df
+
+CAMPANAS = {
+    "cartera": campana_cartera,
+    "renovacion": campana_renovacion,
+}
@@ -0,0 +1,158 @@
+"""
+Servidores locales que reemplazan a los proveedores reales durante el benchmark
+- SumideroSMTP: acepta EHLO, AUTH, MAIL, RCPT y DATA y descarta los mensajes
+- TwilioLocal: responde la API de mensajes de Twilio (POST .../Messages.json) con keep-alive
+Ambos cuentan conexiones y mensajes para verificar la reutilización de sesiones
+"""
+import json
+import socket
+import socketserver
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict
+
+class _Contadores:
+    """Contadores thread-safe de conexiones y mensajes recibidos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.conexiones = 0
+        self.mensajes = 0
+
+    def sumar(self, clave: str) -> int:
+        with self._lock:
+            valor = getattr(self, clave) + 1
+            setattr(self, clave, valor)
+            return valor
+
+    def resumen(self) -> Dict[str, int]:
+        with self._lock:
+            return {"conexiones": self.conexiones, "mensajes": self.mensajes}
+
+def _sin_retardo(conexion: socket.socket):
+    """Desactiva Nagle: las respuestas cortas no esperan el ACK retrasado del cliente (~40 ms)"""
+    conexion.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+class _SesionSMTP(socketserver.StreamRequestHandler):
+    """Una sesión SMTP mínima (sin STARTTLS): suficiente para smtplib y el pool de conexiones"""
+
+    def setup(self):
+        super().setup()
+        _sin_retardo(self.request)
+
+    def responder(self, linea: str):
+        self.wfile.write((linea + "\r\n").encode("ascii"))
+
+    def handle(self):
+        servidor: "SumideroSMTP" = self.server
+        servidor.contadores.sumar("conexiones")
+        self.responder("220 sumidero-smtp listo")
+        en_datos = False
+        while True:
+            linea = self.rfile.readline()
+            if not linea:
+                return
+            if en_datos:
+                if linea.rstrip(b"\r\n") == b".":
+                    en_datos = False
+                    if servidor.latencia:
+                        time.sleep(servidor.latencia)
+                    servidor.contadores.sumar("mensajes")
+                    self.responder("250 2.0.0 mensaje aceptado")
+                continue
+            comando = linea.decode("ascii", errors="replace").strip().upper()
+            if comando.startswith("EHLO"):
+                self.responder("250-sumidero-smtp")
+                self.responder("250 AUTH PLAIN LOGIN")
+            elif comando.startswith("AUTH"):
+                self.responder("235 2.7.0 autenticado")
+            elif comando.startswith("DATA"):
+                en_datos = True
+                self.responder("354 fin con <CRLF>.<CRLF>")
+            elif comando.startswith("QUIT"):
+                self.responder("221 2.0.0 adios")
+                return
+            else:  # HELO, MAIL, RCPT, RSET, NOOP
+                self.responder("250 2.0.0 ok")
+
+class SumideroSMTP(socketserver.ThreadingTCPServer):
+    """
+    Servidor SMTP local que acepta y descarta todos los mensajes
+
+    Args:
+        latencia: Segundos que tarda en aceptar cada mensaje (simula la red del proveedor)
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", puerto: int = 0, latencia: float = 0.0):
+        super().__init__((host, puerto), _SesionSMTP)
+        self.latencia = latencia
+        self.contadores = _Contadores()
+
+    @property
+    def puerto(self) -> int:
+        return self.server_address[1]
+
+    def iniciar(self) -> "SumideroSMTP":
+        threading.Thread(target=self.serve_forever, name="sumidero-smtp", daemon=True).start()
+        return self
+
+    def detener(self):
+        self.shutdown()
+        self.server_close()
+
+class _PeticionTwilio(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, como la API real
+
+    def setup(self):
+        super().setup()
+        _sin_retardo(self.request)
+        self.server.contadores.sumar("conexiones")
+
+    def log_message(self, formato, *args):
+        pass
+
+    def do_POST(self):
+        servidor: "TwilioLocal" = self.server
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if servidor.latencia:
+            time.sleep(servidor.latencia)
+        if not self.path.endswith("/Messages.json"):
+            estado, cuerpo = 404, {"code": 20404, "message": "The requested resource was not found"}
+        else:
+            numero = servidor.contadores.sumar("mensajes")
+            estado, cuerpo = 201, {"sid": f"SM{numero:032x}", "status": "queued"}
+        datos = json.dumps(cuerpo).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+class TwilioLocal(ThreadingHTTPServer):
+    """
+    Endpoint HTTP local compatible con la API de mensajes de Twilio (TWILIO_API_BASE)
+
+    Args:
+        latencia: Segundos que tarda en responder cada mensaje (simula la red del proveedor)
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", puerto: int = 0, latencia: float = 0.0):
+        super().__init__((host, puerto), _PeticionTwilio)
+        self.latencia = latencia
+        self.contadores = _Contadores()
+
+    @property
+    def api_base(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def iniciar(self) -> "TwilioLocal":
+        threading.Thread(target=self.serve_forever, name="twilio-local", daemon=True).start()
+        return self
+
+    def detener(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,75 @@
+"""
+Caché LRU de figuras Plotly serializadas, compartida entre sesiones
+Evita reconstruir las gráficas del tablero (mapas de color, layout) en cada rerun de Streamlit
+"""
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+import plotly.graph_objects as go
+import plotly.io as pio
+import streamlit as st
+
+# Máximo de figuras serializadas que se conservan en memoria
+MAX_FIGURAS = 128
+
+class CacheFiguras:
+    """
+    Caché LRU thread-safe de figuras serializadas a JSON
+
+    Las llaves deben incluir la versión del dataset para que una nueva carga de datos
+    no reutilice figuras viejas; las entradas antiguas salen por desalojo LRU.
+    """
+
+    def __init__(self, max_figuras: int = MAX_FIGURAS):
+        self.max_figuras = max_figuras
+        self._figuras: "OrderedDict[Hashable, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def _get(self, clave: Hashable) -> Optional[str]:
+        with self._lock:
+            serializada = self._figuras.get(clave)
+            if serializada is None:
+                self.fallos += 1
+                return None
+            self._figuras.move_to_end(clave)
+            self.aciertos += 1
+            return serializada
+
+    def _put(self, clave: Hashable, serializada: str):
+        with self._lock:
+            self._figuras[clave] = serializada
+            self._figuras.move_to_end(clave)
+            while len(self._figuras) > self.max_figuras:
+                self._figuras.popitem(last=False)
+
+    def obtener(self, clave: Hashable, construir: Callable[[], go.Figure]) -> go.Figure:
+        """
+        Retorna la figura cacheada para la llave o la construye y la guarda
+
+        Args:
+            clave: Llave hashable, ej: ("renovaciones", version, ventana)
+            construir: Función sin argumentos que construye la figura si no está en caché
+
+        Returns:
+            Figura Plotly
+        """
+        serializada = self._get(clave)
+        if serializada is None:
+            serializada = construir().to_json()
+            self._put(clave, serializada)
+        return pio.from_json(serializada)
+
+    def limpiar(self):
+        """Elimina todas las figuras cacheadas"""
+        with self._lock:
+            self._figuras.clear()
+
+    def __len__(self) -> int:
+        return len(self._figuras)
+
+@st.cache_resource(show_spinner=False)
+def obtener_cache_figuras() -> CacheFiguras:
+    """Instancia única de la caché para todo el servidor (compartida entre usuarios)"""
+    return CacheFiguras()
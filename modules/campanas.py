@@ -0,0 +1,90 @@
+import streamlit as st
+import pandas as pd
+from modules.enrutamiento import CANAL_AUTOMATICO
+from modules.outbox import estado_campana
+from modules.planificador import REGLAS, REGLAS_POR_DEFECTO, planificar_campanas, resumen_plan, encolar_plan
+from modules.ventanas import resumen_ventanas
+
+def render(df: pd.DataFrame):
+    st.title("🗓️ Plan de Campañas")
+    st.caption(
+        "Cartera y renovaciones en un solo plan: cada cliente recibe un único mensaje por canal "
+        "aunque tenga varias pólizas o esté en mora y próximo a renovar."
+    )
+
+    col1, col2 = st.columns([3, 2])
+    with col1:
+        reglas = st.multiselect("Reglas de campaña (en orden de prioridad)", list(REGLAS), default=REGLAS_POR_DEFECTO)
+    with col2:
+        canales = st.multiselect("Canales", ["Email", "WhatsApp", "Automático"], default=["Email"])
+
+    if not reglas or not canales:
+        st.info("Selecciona al menos una regla y un canal.")
+        return
+
+    # Automático: cada cliente por su canal preferido o, si no está habilitado, el de respaldo
+    if "Automático" in canales:
+        st.caption("🔀 Enrutamiento automático: un mensaje por cliente en su mejor canal permitido.")
+        canales = [CANAL_AUTOMATICO]
+    else:
+        canales = [c.lower() for c in canales]
+
+    plan = planificar_campanas(df, canales, reglas)
+
+    # Estadísticas del plan
+    objetivos = int(plan["objetivos"].sum())
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Objetivos (por separado)", objetivos)
+    col2.metric("Mensajes planificados", len(plan))
+    col3.metric("Fusionados", objetivos - len(plan))
+    col4.metric("Clientes", plan["cliente"].nunique())
+
+    if len(plan) == 0:
+        st.warning("⚠️ Ningún cliente con consentimiento y contacto cumple las reglas seleccionadas.")
+        return
+
+    st.subheader("📌 Atribución por regla")
+    st.caption("Atribuidos: mensajes a los que la regla aporta pólizas. Principal: mensajes cuyo contenido define.")
+    st.dataframe(resumen_plan(plan, reglas), use_container_width=True, hide_index=True)
+
+    st.subheader("📋 Plan de envío")
+    st.dataframe(
+        plan[["nombre_cliente", "canal", "tipo", "numero_poliza", "regla", "reglas", "polizas", "destinatario"]],
+        use_container_width=True,
+        height=420,
+        hide_index=True
+    )
+
+    st.divider()
+
+    # Ventanas de envío: cada mensaje se libera en la franja del horario preferido del cliente
+    respetar_horario = st.checkbox("🕒 Respetar horario preferido de contacto", value=True)
+    if respetar_horario:
+        st.dataframe(resumen_ventanas(df.loc[plan["fila"]]), use_container_width=True, hide_index=True)
+
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        if st.button("📤 Encolar plan", type="primary", use_container_width=True):
+            # Una campaña del outbox por tipo y canal; el worker realiza el envío en segundo plano
+            st.session_state["campanas_plan"] = encolar_plan(
+                df, plan, usuario=st.session_state.get("user"), respetar_horario=respetar_horario
+            )
+            st.success(f"✅ Plan encolado ({len(plan)} notificaciones)")
+    with col2:
+        if st.button("🔄 Recargar", use_container_width=True):
+            st.rerun()
+
+    # Estado de las campañas del último plan encolado en esta sesión
+    for campana_id in st.session_state.get("campanas_plan", []):
+        estado = estado_campana(campana_id)
+        if estado is None:
+            continue
+        st.caption(
+            f"📬 Campaña {campana_id} · {estado['tipo']} · {estado['canal'].title()}: "
+            f"{estado['procesados']} de {estado['total']} procesadas"
+            + (" ✅" if estado["terminada"] else "")
+            + (f" · {estado['tasa']:.1f}/s, faltan ~{estado['eta']:.0f} s" if estado["eta"] is not None else "")
+            + (f" · 🕒 {estado['programados']} programadas (próxima {estado['proxima_liberacion']:%Y-%m-%d %H:%M})"
+               if estado["programados"] else "")
+        )
+        st.progress(estado["procesados"] / estado["total"] if estado["total"] > 0 else 1.0)
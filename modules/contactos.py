@@ -0,0 +1,137 @@
+"""
+Validación y normalización de datos de contacto
+Normaliza los teléfonos a E.164 y valida la sintaxis de los emails de toda la sábana con
+operaciones vectorizadas, para que los contactos mal formados se excluyan y reporten antes
+del despacho en lugar de fallar contra el proveedor
+"""
+import os
+import re
+from typing import Any, Dict, Optional
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# Valores por defecto (se pueden sobrescribir en [contactos] de secrets.toml o por variables de entorno)
+CODIGO_PAIS_POR_DEFECTO = "57"          # Colombia
+LONGITUD_NACIONAL_POR_DEFECTO = 10      # Dígitos de un número nacional (celular colombiano: 3XX XXX XXXX)
+
+# E.164: '+' y de 8 a 15 dígitos, sin cero inicial en el código de país
+PATRON_E164 = re.compile(r"\+[1-9]\d{7,14}")
+
+# Sintaxis práctica de email: parte local, dominio con etiquetas válidas y TLD alfabético
+PATRON_EMAIL = re.compile(
+    r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+)*"
+    r"@(?:[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+[A-Za-z]{2,63}"
+)
+
+# Columnas que agrega validar_contactos
+COLUMNAS_VALIDACION = ["email_valido", "telefono_valido"]
+
+def get_config_contactos() -> Dict[str, Any]:
+    """
+    Obtiene el código de país y la longitud de los números nacionales desde variables de
+    entorno (CONTACTOS_CODIGO_PAIS, CONTACTOS_LONGITUD_NACIONAL) o de [contactos] en secrets
+    """
+    try:
+        contactos_secrets = st.secrets.get("contactos", {})
+    except (AttributeError, FileNotFoundError, KeyError):
+        contactos_secrets = {}
+
+    return {
+        "codigo_pais": str(os.getenv("CONTACTOS_CODIGO_PAIS", contactos_secrets.get("codigo_pais", CODIGO_PAIS_POR_DEFECTO))).lstrip("+"),
+        "longitud_nacional": int(os.getenv("CONTACTOS_LONGITUD_NACIONAL", contactos_secrets.get("longitud_nacional", LONGITUD_NACIONAL_POR_DEFECTO))),
+    }
+
+def _texto_contacto(valores: pd.Series) -> pd.Series:
+    """Contacto como texto sin espacios; los números leídos como float pierden el '.0'"""
+    texto = valores.astype(str).str.strip().str.replace(r"\.0$", "", regex=True)
+    return texto.where(valores.notna(), "")
+
+def normalizar_telefonos(valores: pd.Series, config: Optional[Dict[str, Any]] = None) -> pd.Series:
+    """
+    Normaliza teléfonos a E.164 ('+573001234567')
+
+    Acepta números con separadores (espacios, guiones, puntos, paréntesis), con prefijo
+    internacional '+' o '00', con el código de país sin '+' o solo el número nacional.
+
+    Args:
+        valores: Columna de teléfonos (texto o numérica)
+        config: Código de país y longitud nacional (por defecto la configurada)
+
+    Returns:
+        Serie alineada con valores con el número en E.164 (nulo si no es un teléfono válido)
+    """
+    config = config or get_config_contactos()
+    codigo, longitud = config["codigo_pais"], config["longitud_nacional"]
+    texto = _texto_contacto(valores)
+
+    # Solo dígitos y separadores habituales; cualquier letra invalida el número
+    permitido = texto.str.fullmatch(r"\+?[\d\s().-]+")
+    internacional = texto.str.startswith("+") | texto.str.startswith("00")
+    digitos = texto.str.replace(r"\D", "", regex=True)
+    digitos = digitos.where(~texto.str.startswith("00"), digitos.str[2:])
+    cantidad = digitos.str.len()
+
+    con_codigo = ~internacional & (cantidad == len(codigo) + longitud) & digitos.str.startswith(codigo)
+    nacional = ~internacional & (cantidad == longitud)
+    e164 = pd.Series(
+        np.select([internacional | con_codigo, nacional], ["+" + digitos, "+" + codigo + digitos], ""),
+        index=valores.index
+    )
+    return e164.where(permitido & e164.str.fullmatch(PATRON_E164), None)
+
+def normalizar_emails(valores: pd.Series) -> pd.Series:
+    """Emails sin espacios y en minúsculas ('' si falta)"""
+    return _texto_contacto(valores).str.lower()
+
+def validar_emails(valores: pd.Series) -> pd.Series:
+    """Indica qué emails tienen una sintaxis válida"""
+    return normalizar_emails(valores).str.fullmatch(PATRON_EMAIL)
+
+def normalizar_telefono(valor: Any) -> Optional[str]:
+    """Un teléfono en E.164, o None si no es válido (los que ya están en E.164 no pasan por pandas)"""
+    if isinstance(valor, str) and PATRON_E164.fullmatch(valor.strip()):
+        return valor.strip()
+    e164 = normalizar_telefonos(pd.Series([valor], dtype=object)).iloc[0]
+    return e164 if isinstance(e164, str) else None
+
+def email_valido(valor: Any) -> bool:
+    """Indica si un email tiene una sintaxis válida"""
+    return isinstance(valor, str) and PATRON_EMAIL.fullmatch(valor.strip().lower()) is not None
+
+def validar_contactos(df: pd.DataFrame, config: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+    """
+    Normaliza y valida los contactos de la sábana
+
+    Los teléfonos válidos quedan en E.164 y los emails en minúsculas; los contactos inválidos
+    se conservan tal cual para poder reportarlos. Es idempotente: se puede aplicar al cargar
+    la sábana y de nuevo sobre las filas de una campaña.
+
+    Returns:
+        Copia de df con columnas email_valido y telefono_valido
+    """
+    df = df.copy()
+    if "email_cliente" in df.columns:
+        email = normalizar_emails(df["email_cliente"])
+        df["email_valido"] = email.str.fullmatch(PATRON_EMAIL).to_numpy(dtype=bool)
+        df["email_cliente"] = email.where(df["email_valido"], df["email_cliente"])
+    else:
+        df["email_valido"] = False
+    if "telefono_cliente" in df.columns:
+        e164 = normalizar_telefonos(df["telefono_cliente"], config)
+        df["telefono_valido"] = e164.notna().to_numpy(dtype=bool)
+        df["telefono_cliente"] = e164.where(df["telefono_valido"], df["telefono_cliente"]).astype(object)
+    else:
+        df["telefono_valido"] = False
+    return df
+
+def contacto_valido(df: pd.DataFrame, col_contacto: str) -> pd.Series:
+    """
+    Filas con contacto bien formado en la columna (usa las columnas de validar_contactos
+    si ya existen y si no valida en el momento)
+    """
+    if col_contacto not in df.columns:
+        return pd.Series(False, index=df.index)
+    if col_contacto == "email_cliente":
+        return df["email_valido"] if "email_valido" in df.columns else validar_emails(df[col_contacto])
+    return df["telefono_valido"] if "telefono_valido" in df.columns else normalizar_telefonos(df[col_contacto]).notna()
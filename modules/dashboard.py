@@ -3,7 +3,165 @@ Módulo ejecutivo: Dashboard consolidado de Cartera y Renovaciones
 """
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
+import plotly.graph_objects as go
+from modules.kpis import VENTANAS_RENOVACION, obtener_cubo_kpis
+from modules.cache_figuras import obtener_cache_figuras
+from modules.geo import RESOLUCIONES_HEX, METRICAS_GEO, COLUMNAS_GEO, celdas_hexagonales
+
+def figura_histograma(hist: dict, escala_log: bool, titulo: str) -> go.Figure:
+    """
+    Construye el histograma a partir de bins precalculados (tamaño constante sin importar el volumen)
+    
+    Args:
+        hist: Dict con 'bordes' y 'conteos' (ver kpis.histograma_servidor)
+        escala_log: Si los bordes están espaciados logarítmicamente
+        titulo: Título de la gráfica
+    """
+    bordes = np.asarray(hist["bordes"], dtype=float)
+    conteos = hist["conteos"]
+    rangos_txt = [f"${a:,.0f} - ${b:,.0f}" for a, b in zip(bordes[:-1], bordes[1:])]
+    
+    # En escala log se grafica sobre log10 del valor para que los anchos de barra sean correctos
+    ejes = np.log10(bordes) if escala_log else bordes
+    fig = go.Figure(go.Bar(
+        x=(ejes[:-1] + ejes[1:]) / 2,
+        y=conteos,
+        width=np.diff(ejes),
+        customdata=rangos_txt,
+        hovertemplate="%{customdata}<br>Clientes: %{y}<extra></extra>",
+        marker_color="#EF4444",
+        marker_line_width=0
+    ))
+    xaxis = dict(title="Valor en Mora ($)")
+    if escala_log and len(ejes) > 0:
+        ticks = np.arange(np.floor(ejes[0]), np.ceil(ejes[-1]) + 1)
+        xaxis.update(tickvals=ticks.tolist(), ticktext=[f"${10 ** t:,.0f}" for t in ticks])
+    fig.update_layout(
+        title=titulo,
+        xaxis=xaxis,
+        yaxis=dict(title="Clientes"),
+        bargap=0,
+        height=350,
+        showlegend=False,
+        margin=dict(t=50, b=50, l=50, r=50)  # Márgenes para que no se corte
+    )
+    return fig
+
+def figura_semaforos(df_semaforo: pd.DataFrame, ventana: str) -> go.Figure:
+    """Barras horizontales de renovaciones por semáforo de vencimiento"""
+    color_map = {}
+    for sem in df_semaforo["Semáforo"]:
+        sem_lower = str(sem).lower()
+        if "rojo" in sem_lower or "🔴" in str(sem):
+            color_map[sem] = "#EF4444"
+        elif "amarillo" in sem_lower or "🟡" in str(sem):
+            color_map[sem] = "#F59E0B"
+        elif "verde" in sem_lower or "🟢" in str(sem):
+            color_map[sem] = "#10B981"
+        else:
+            color_map[sem] = "#6B7280"
+
+    fig_renov = px.bar(
+        df_semaforo,
+        x="Cantidad",
+        y="Semáforo",
+        orientation='h',
+        title=f"Renovaciones por Urgencia ({ventana})",
+        color="Semáforo",
+        color_discrete_map=color_map,
+        text="Cantidad"
+    )
+    # Calcular altura dinámica basada en número de categorías
+    altura_renov = max(250, len(df_semaforo) * 80)
+    fig_renov.update_layout(
+        showlegend=False,
+        height=altura_renov,
+        yaxis={'categoryorder': 'array', 'categoryarray': df_semaforo["Semáforo"].tolist()},
+        margin=dict(t=50, b=50, l=50, r=50)  # Márgenes para que no se corte
+    )
+    fig_renov.update_traces(textposition='outside')
+    return fig_renov
+
+def figura_rangos(df_rangos: pd.DataFrame, seg: str) -> go.Figure:
+    """Barras de clientes por rango de valor en mora"""
+    fig_rangos = px.bar(
+        df_rangos,
+        x="Rango",
+        y="Cantidad",
+        title=f"Clientes por Rango ({seg})",
+        text="Cantidad"
+    )
+    # Calcular escala Y dinámica
+    max_valor = df_rangos["Cantidad"].max() if len(df_rangos) > 0 else 1
+    # Determinar incremento apropiado basado en el máximo
+    if max_valor <= 10:
+        dtick_val = 1
+    elif max_valor <= 50:
+        dtick_val = 5
+    elif max_valor <= 100:
+        dtick_val = 10
+    elif max_valor <= 500:
+        dtick_val = 50
+    else:
+        dtick_val = max(1, int(max_valor / 20))  # Aproximadamente 20 ticks
+
+    fig_rangos.update_traces(
+        marker_color="#EF4444",
+        textposition='outside'
+    )
+    fig_rangos.update_layout(
+        height=350,  # Mismo tamaño que el histograma
+        showlegend=False,
+        margin=dict(t=50, b=80, l=50, r=50),  # Márgenes para que no se corte, más espacio abajo para labels
+        yaxis=dict(
+            tickmode='linear',
+            dtick=dtick_val,
+            tickformat='d',
+            range=[0, max_valor * 1.15]  # Agregar 15% de espacio arriba para que las barras no se corten
+        )
+    )
+    return fig_rangos
+
+def figura_mapa_riesgo(celdas_geo: dict, metrica: str) -> go.Figure:
+    """Mapa de celdas hexagonales coloreadas por la métrica seleccionada"""
+    celdas = celdas_geo["celdas"]
+    columna = METRICAS_GEO[metrica]
+    fig = go.Figure(go.Choropleth(
+        geojson=celdas_geo["geojson"],
+        locations=celdas["id_celda"],
+        z=celdas[columna],
+        colorscale="YlOrRd",
+        marker_line_width=0.3,
+        marker_line_color="#FFFFFF",
+        colorbar_title=metrica,
+        customdata=np.column_stack([
+            celdas["polizas"], celdas["polizas_en_mora"], celdas["valor_en_mora"],
+            celdas["prima_total"], celdas["indice_climatico"].fillna(0), celdas["pct_riesgo_alto"]
+        ]),
+        hovertemplate=(
+            "Pólizas: %{customdata[0]:,}<br>"
+            "En mora: %{customdata[1]:,}<br>"
+            "Valor en mora: $%{customdata[2]:,.0f}<br>"
+            "Prima total: $%{customdata[3]:,.0f}<br>"
+            "Índice climático: %{customdata[4]:.2f}<br>"
+            "Zona de riesgo alta: %{customdata[5]:.0f}%<extra></extra>"
+        )
+    ))
+    fig.update_geos(
+        fitbounds="locations",
+        showcountries=True,
+        showland=True,
+        landcolor="#F3F4F6",
+        resolution=50
+    )
+    fig.update_layout(
+        title=f"{metrica} por zona",
+        height=500,
+        margin=dict(t=50, b=10, l=10, r=10)
+    )
+    return fig
 
 def render(df: pd.DataFrame):
     st.title("📊 Tablero de Visualización")
@@ -14,102 +172,37 @@ def render(df: pd.DataFrame):
     
     # Selector de ventana
     ventana = st.selectbox("Ventana de Renovación", ["<= 30 días", "<= 15 días", "<= 7 días"], key="ventana_renov")
-    limite = 30 if ventana == "<= 30 días" else 15 if ventana == "<= 15 días" else 7
-    
-    # Filtrar renovaciones (dentro de la ventana)
-    view_renov = df.copy()
-    view_renov = view_renov[
-        (view_renov["dias_para_vencimiento"].fillna(9999) <= limite) &
-        (view_renov["renovable"].astype(str).str.lower().isin(["true","1","si","sí","yes"]) | view_renov["renovable"].isna())
-    ]
-    
-    # Contar registros excluidos de la ventana (para agregar como "verde")
-    view_excluidos = df.copy()
-    view_excluidos = view_excluidos[
-        (view_excluidos["dias_para_vencimiento"].fillna(9999) > limite) &
-        (view_excluidos["renovable"].astype(str).str.lower().isin(["true","1","si","sí","yes"]) | view_excluidos["renovable"].isna())
-    ]
-    cantidad_excluidos = len(view_excluidos)
+    limite = VENTANAS_RENOVACION[ventana]
+    
+    # Agregados precalculados para la ventana (cubo materializado por versión del dataset)
+    cubo = obtener_cubo_kpis(df)
+    renov = cubo["renovaciones"][limite]
+    
+    # Figuras serializadas compartidas entre reruns y usuarios (llave: versión + selección)
+    cache = obtener_cache_figuras()
+    version = cubo["version"]
     
     # Visualización: Funnel por Semáforo
-    if "semáforo_vencimiento" in view_renov.columns:
-        semaforo_counts = view_renov["semáforo_vencimiento"].value_counts().sort_index()
-        
+    if renov["tiene_semaforo"]:
         df_semaforo = None
-        if len(semaforo_counts) > 0 or cantidad_excluidos > 0:
-            # Crear DataFrame con los semáforos de la ventana
-            if len(semaforo_counts) > 0:
-                df_semaforo = pd.DataFrame({
-                    "Semáforo": semaforo_counts.index,
-                    "Cantidad": semaforo_counts.values
-                })
-            else:
-                df_semaforo = pd.DataFrame(columns=["Semáforo", "Cantidad"])
-            
-            # Agregar categoría "verde" con los excluidos
-            if cantidad_excluidos > 0:
-                nueva_fila = pd.DataFrame({
-                    "Semáforo": ["Verde"],
-                    "Cantidad": [cantidad_excluidos]
-                })
-                df_semaforo = pd.concat([df_semaforo, nueva_fila], ignore_index=True)
-            
-            def orden_urgencia(sem):
-                sem_str = str(sem).lower()
-                if "rojo" in sem_str or "🔴" in str(sem) or "red" in sem_str:
-                    return 1
-                elif "amarillo" in sem_str or "🟡" in str(sem) or "yellow" in sem_str:
-                    return 2
-                elif "verde" in sem_str or "🟢" in str(sem) or "green" in sem_str:
-                    return 3
-                else:
-                    return 4
-            
-            df_semaforo["orden"] = df_semaforo["Semáforo"].apply(orden_urgencia)
-            df_semaforo = df_semaforo.sort_values(["orden", "Cantidad"], ascending=[True, False])
+        if renov["semaforos"]:
+            df_semaforo = pd.DataFrame(renov["semaforos"], columns=["Semáforo", "Cantidad"])
         
         col1, col2 = st.columns([2, 1])
         
         with col1:
             if df_semaforo is not None and len(df_semaforo) > 0:
-                color_map = {}
-                for sem in df_semaforo["Semáforo"]:
-                    sem_lower = str(sem).lower()
-                    if "rojo" in sem_lower or "🔴" in str(sem):
-                        color_map[sem] = "#EF4444"
-                    elif "amarillo" in sem_lower or "🟡" in str(sem):
-                        color_map[sem] = "#F59E0B"
-                    elif "verde" in sem_lower or "🟢" in str(sem):
-                        color_map[sem] = "#10B981"
-                    else:
-                        color_map[sem] = "#6B7280"
-                
-                fig_renov = px.bar(
-                    df_semaforo,
-                    x="Cantidad",
-                    y="Semáforo",
-                    orientation='h',
-                    title=f"Renovaciones por Urgencia ({ventana})",
-                    color="Semáforo",
-                    color_discrete_map=color_map,
-                    text="Cantidad"
+                fig_renov = cache.obtener(
+                    ("renovaciones", version, ventana),
+                    lambda: figura_semaforos(df_semaforo, ventana)
                 )
-                # Calcular altura dinámica basada en número de categorías
-                altura_renov = max(250, len(df_semaforo) * 80)
-                fig_renov.update_layout(
-                    showlegend=False,
-                    height=altura_renov,
-                    yaxis={'categoryorder': 'array', 'categoryarray': df_semaforo["Semáforo"].tolist()},
-                    margin=dict(t=50, b=50, l=50, r=50)  # Márgenes para que no se corte
-                )
-                fig_renov.update_traces(textposition='outside')
                 st.plotly_chart(fig_renov, use_container_width=True)
             else:
                 st.info("No hay datos de semáforo disponibles")
         
         with col2:
             # Total incluye tanto los de la ventana como los excluidos
-            total_renov = len(view_renov) + cantidad_excluidos
+            total_renov = renov["total"]
             st.metric("Total a Renovar", total_renov)
             
             if df_semaforo is not None and len(df_semaforo) > 0:
@@ -130,29 +223,11 @@ def render(df: pd.DataFrame):
     # Selector de segmento
     seg = st.selectbox("Segmento de Mora", ["1–15 días", "16–45 días", ">45 días"], key="seg_cartera")
     
-    # Filtrar cartera
-    if seg == "1–15 días":
-        view_cartera = df[
-            (df["dias_mora"].fillna(0) >= 1) & 
-            (df["dias_mora"].fillna(0) <= 15) &
-            (df["valor_en_mora"].fillna(0) > 0)
-        ]
-    elif seg == "16–45 días":
-        view_cartera = df[
-            (df["dias_mora"].fillna(0) >= 16) & 
-            (df["dias_mora"].fillna(0) <= 45) &
-            (df["valor_en_mora"].fillna(0) > 0)
-        ]
-    else:
-        view_cartera = df[
-            (df["dias_mora"].fillna(0) > 45) &
-            (df["valor_en_mora"].fillna(0) > 0)
-        ]
-    
-    # Métricas principales
-    total_clientes = len(view_cartera)
-    monto_total_mora = view_cartera["valor_en_mora"].fillna(0).sum()
-    monto_promedio_mora = view_cartera["valor_en_mora"].fillna(0).mean() if total_clientes > 0 else 0
+    # Métricas principales (precalculadas)
+    cartera = cubo["cartera"][seg]
+    total_clientes = cartera["clientes"]
+    monto_total_mora = cartera["monto_total"]
+    monto_promedio_mora = cartera["promedio"]
     
     col1, col2, col3 = st.columns(3)
     col1.metric("Total Clientes", f"{total_clientes:,}")
@@ -164,70 +239,49 @@ def render(df: pd.DataFrame):
         col1, col2 = st.columns(2)
         
         with col1:
-            # Histograma
-            valores_mora = view_cartera["valor_en_mora"].fillna(0)
-            fig_hist = px.histogram(
-                valores_mora,
-                nbins=20,
-                title=f"Distribución de Valores ({seg})",
-                labels={"value": "Valor en Mora ($)", "count": "Clientes"},
-                color_discrete_sequence=["#EF4444"]
-            )
-            fig_hist.update_layout(
-                height=350,
-                showlegend=False,
-                margin=dict(t=50, b=50, l=50, r=50)  # Márgenes para que no se corte
+            # Histograma (bins calculados en el servidor, solo bordes y conteos)
+            escala_log = st.checkbox("Bins en escala logarítmica", key="hist_log_cartera")
+            hist = cartera["histograma"]["log" if escala_log else "lineal"]
+            fig_hist = cache.obtener(
+                ("histograma", version, seg, escala_log),
+                lambda: figura_histograma(hist, escala_log, f"Distribución de Valores ({seg})")
             )
             st.plotly_chart(fig_hist, use_container_width=True)
         
         with col2:
-            # Gráfica por rangos
-            bins = [0, 100000, 500000, 1000000, 5000000, float('inf')]
-            labels = ["$0-$100K", "$100K-$500K", "$500K-$1M", "$1M-$5M", ">$5M"]
-            view_copy = view_cartera.copy()
-            view_copy["rango_mora"] = pd.cut(valores_mora, bins=bins, labels=labels, right=False)
-            rango_counts = view_copy["rango_mora"].value_counts().sort_index()
-            
-            df_rangos = pd.DataFrame({
-                "Rango": rango_counts.index,
-                "Cantidad": rango_counts.values.astype(int)
-            })
-            fig_rangos = px.bar(
-                df_rangos,
-                x="Rango",
-                y="Cantidad",
-                title=f"Clientes por Rango ({seg})",
-                text="Cantidad"
-            )
-            # Calcular escala Y dinámica
-            max_valor = df_rangos["Cantidad"].max() if len(df_rangos) > 0 else 1
-            # Determinar incremento apropiado basado en el máximo
-            if max_valor <= 10:
-                dtick_val = 1
-            elif max_valor <= 50:
-                dtick_val = 5
-            elif max_valor <= 100:
-                dtick_val = 10
-            elif max_valor <= 500:
-                dtick_val = 50
-            else:
-                dtick_val = max(1, int(max_valor / 20))  # Aproximadamente 20 ticks
-            
-            fig_rangos.update_traces(
-                marker_color="#EF4444",
-                textposition='outside'
-            )
-            fig_rangos.update_layout(
-                height=350,  # Mismo tamaño que el histograma
-                showlegend=False,
-                margin=dict(t=50, b=80, l=50, r=50),  # Márgenes para que no se corte, más espacio abajo para labels
-                yaxis=dict(
-                    tickmode='linear',
-                    dtick=dtick_val,
-                    tickformat='d',
-                    range=[0, max_valor * 1.15]  # Agregar 15% de espacio arriba para que las barras no se corten
-                )
+            # Gráfica por rangos (conteos precalculados)
+            df_rangos = pd.DataFrame(cartera["rangos"])
+            fig_rangos = cache.obtener(
+                ("rangos", version, seg),
+                lambda: figura_rangos(df_rangos, seg)
             )
             st.plotly_chart(fig_rangos, use_container_width=True)
     else:
         st.info("No hay datos de cartera para el segmento seleccionado")
+    
+    st.divider()
+    
+    # ========== SECCIÓN MAPA DE RIESGO ==========
+    st.header("🗺️ Mapa de Riesgo Geográfico")
+    
+    if not set(COLUMNAS_GEO).issubset(df.columns):
+        st.info("El dataset no tiene columnas de geolocalización")
+        return
+    
+    col1, col2 = st.columns(2)
+    metrica_geo = col1.selectbox("Métrica", list(METRICAS_GEO.keys()), key="metrica_geo")
+    resolucion = col2.selectbox("Tamaño de celda", list(RESOLUCIONES_HEX.keys()), index=1, key="resolucion_geo")
+    
+    # Celdas agregadas en el servidor, precalculadas por versión del dataset
+    celdas_geo = celdas_hexagonales(version, resolucion, df)
+    if len(celdas_geo["celdas"]) == 0:
+        st.info("No hay pólizas con geolocalización")
+        return
+    
+    fig_mapa = cache.obtener(
+        ("mapa", version, resolucion, metrica_geo),
+        lambda: figura_mapa_riesgo(celdas_geo, metrica_geo)
+    )
+    st.plotly_chart(fig_mapa, use_container_width=True)
+    st.caption(f"{len(celdas_geo['celdas']):,} celdas agregadas a partir de "
+               f"{int(celdas_geo['celdas']['polizas'].sum()):,} pólizas geolocalizadas")
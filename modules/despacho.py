@@ -0,0 +1,153 @@
+"""
+Motor de despacho concurrente para los envíos masivos
+Ejecuta los envíos en un pool de hilos respetando un límite de tasa por canal (cuotas SMTP / Twilio)
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from typing import Callable, Dict, Iterable, Iterator, Tuple, Any, Optional, TYPE_CHECKING
+import streamlit as st
+
+if TYPE_CHECKING:
+    from modules.reintentos import Circuito
+
+# Valores por defecto (se pueden sobrescribir en [despacho] de secrets.toml o por variables de entorno)
+WORKERS_POR_DEFECTO = 8
+TASA_POR_DEFECTO = {
+    "email": 10.0,      # mensajes/segundo
+    "whatsapp": 20.0,   # mensajes/segundo (cuota por número de Twilio)
+}
+# Una póliza recibe como máximo una notificación por tipo y canal en este periodo ('dia', 'semana', 'mes')
+PERIODO_IDEMPOTENCIA_POR_DEFECTO = "dia"
+# Reintentos de errores transitorios y circuit breaker por canal
+REINTENTOS_POR_DEFECTO = 3
+UMBRAL_CIRCUITO_POR_DEFECTO = 5        # Fallos transitorios seguidos que abren el circuito
+ENFRIAMIENTO_CIRCUITO_POR_DEFECTO = 60  # Segundos que el canal queda en pausa
+
+def get_config_despacho() -> Dict[str, Any]:
+    """
+    Obtiene la configuración del despacho desde variables de entorno o secrets de Streamlit
+    """
+    try:
+        despacho_secrets = st.secrets.get("despacho", {})
+    except (AttributeError, FileNotFoundError, KeyError):
+        despacho_secrets = {}
+
+    return {
+        "workers": int(os.getenv("DESPACHO_WORKERS", despacho_secrets.get("workers", WORKERS_POR_DEFECTO))),
+        "tasa_email": float(os.getenv("DESPACHO_TASA_EMAIL", despacho_secrets.get("tasa_email", TASA_POR_DEFECTO["email"]))),
+        "tasa_whatsapp": float(os.getenv("DESPACHO_TASA_WHATSAPP", despacho_secrets.get("tasa_whatsapp", TASA_POR_DEFECTO["whatsapp"]))),
+        "periodo_idempotencia": str(os.getenv("DESPACHO_PERIODO_IDEMPOTENCIA", despacho_secrets.get("periodo_idempotencia", PERIODO_IDEMPOTENCIA_POR_DEFECTO))).lower(),
+        "reintentos": int(os.getenv("DESPACHO_REINTENTOS", despacho_secrets.get("reintentos", REINTENTOS_POR_DEFECTO))),
+        "umbral_circuito": int(os.getenv("DESPACHO_UMBRAL_CIRCUITO", despacho_secrets.get("umbral_circuito", UMBRAL_CIRCUITO_POR_DEFECTO))),
+        "enfriamiento_circuito": float(os.getenv("DESPACHO_ENFRIAMIENTO_CIRCUITO", despacho_secrets.get("enfriamiento_circuito", ENFRIAMIENTO_CIRCUITO_POR_DEFECTO))),
+    }
+
+class LimitadorTasa:
+    """
+    Token bucket thread-safe: permite 'tasa' operaciones por segundo con ráfagas de hasta 'rafaga'
+
+    Una tasa <= 0 desactiva el límite.
+    """
+
+    def __init__(self, tasa: float, rafaga: float = None):
+        self.tasa = tasa
+        self.rafaga = rafaga if rafaga is not None else max(1.0, tasa)
+        self._tokens = self.rafaga
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _tomar(self) -> float:
+        """Toma un token si hay uno disponible; retorna 0 o los segundos que faltan para el próximo"""
+        with self._lock:
+            ahora = time.monotonic()
+            self._tokens = min(self.rafaga, self._tokens + (ahora - self._ultimo) * self.tasa)
+            self._ultimo = ahora
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.tasa
+
+    def adquirir(self):
+        """Bloquea hasta que haya un token disponible"""
+        if self.tasa <= 0:
+            return
+        while True:
+            espera = self._tomar()
+            if espera == 0:
+                return
+            time.sleep(espera)
+
+    def intentar(self) -> bool:
+        """Toma un token sin esperar; retorna False si la tasa está excedida"""
+        return self.tasa <= 0 or self._tomar() == 0
+
+# Un limitador por canal y por proceso, compartido entre campañas simultáneas
+_limitadores: Dict[str, LimitadorTasa] = {}
+_limitadores_lock = threading.Lock()
+
+def obtener_limitador(canal: str) -> LimitadorTasa:
+    """
+    Limitador de tasa compartido del canal ('email' o 'whatsapp')
+    """
+    tasa = get_config_despacho().get(f"tasa_{canal}", 0)
+    with _limitadores_lock:
+        limitador = _limitadores.get(canal)
+        if limitador is None or limitador.tasa != tasa:
+            limitador = LimitadorTasa(tasa)
+            _limitadores[canal] = limitador
+        return limitador
+
+def despachar_por_canal(
+    colas: Dict[str, Iterable[Any]],
+    enviar: Callable[[Any], Tuple[bool, Any]],
+    max_workers: int = None,
+    circuitos: Optional[Dict[str, "Circuito"]] = None
+) -> Iterator[Tuple[Any, Tuple[bool, Any]]]:
+    """
+    Despacha en un solo lote varias colas, una por canal
+
+    Cada canal tiene su propio pool de hilos, límite de tasa y circuito, de modo que un
+    canal con cuota baja o en pausa no ocupa los hilos de los demás. Los resultados de
+    todas las colas se entregan en orden de finalización y en el hilo que itera, de modo
+    que el llamador puede actualizar la UI o acumular estadísticas sin bloqueos.
+
+    Args:
+        colas: Elementos a enviar por canal ('email', 'whatsapp')
+        enviar: Función que recibe un item y retorna (éxito, error)
+        max_workers: Hilos concurrentes por canal (por defecto el configurado)
+        circuitos: Circuit breaker de cada canal; mientras está abierto los envíos no
+            esperan turno en el límite de tasa (fallan de inmediato para reencolarse)
+
+    Yields:
+        Tuple (item, (éxito, error))
+    """
+    colas = {canal: list(items) for canal, items in colas.items()}
+    colas = {canal: items for canal, items in colas.items() if items}
+    if not colas:
+        return
+    if max_workers is None:
+        max_workers = get_config_despacho()["workers"]
+    circuitos = circuitos or {}
+
+    def tarea(limitador, circuito, item):
+        if circuito is None or not circuito.abierto():
+            limitador.adquirir()
+        try:
+            return enviar(item)
+        except Exception as e:
+            return False, str(e)
+
+    with ExitStack() as pools:
+        futuros = {}
+        for canal, items in colas.items():
+            pool = pools.enter_context(ThreadPoolExecutor(
+                max_workers=max(1, min(max_workers, len(items))), thread_name_prefix=f"despacho-{canal}"
+            ))
+            limitador, circuito = obtener_limitador(canal), circuitos.get(canal)
+            for item in items:
+                futuros[pool.submit(tarea, limitador, circuito, item)] = item
+        for futuro in as_completed(futuros):
+            yield futuros[futuro], futuro.result()
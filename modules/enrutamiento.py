@@ -0,0 +1,72 @@
+"""
+Enrutamiento de destinatarios por canal
+Asigna a cada fila el mejor canal permitido (el preferido del cliente y, si no está habilitado,
+el siguiente canal con consentimiento y contacto) con lógica booleana vectorizada, para que
+una campaña con varios canales se despache en un solo lote
+"""
+from typing import List, Optional
+import numpy as np
+import pandas as pd
+
+from modules.contactos import contacto_valido
+
+# Canales de mensajería en orden de respaldo
+CANALES = ["email", "whatsapp"]
+
+# Canal especial: cada destinatario va por su mejor canal permitido
+CANAL_AUTOMATICO = "auto"
+
+# Columnas de contacto y consentimiento por canal
+CONTACTO_CANAL = {
+    "email": ("email_cliente", "consentimiento_email"),
+    "whatsapp": ("telefono_cliente", "consentimiento_whatsapp"),
+}
+
+# Valores de la sábana que cuentan como consentimiento otorgado
+VALORES_CONSENTIMIENTO = ["sí", "si", "yes", "true", "1", "1.0", "s", "y"]
+
+def mascara_consentimiento(valores: pd.Series) -> pd.Series:
+    """Columna de consentimiento de la sábana (sí/no, true/false, 1/0) como booleano"""
+    return valores.notna() & valores.astype(str).str.lower().str.strip().isin(VALORES_CONSENTIMIENTO)
+
+def contacto_habilitado(df: pd.DataFrame, canal: str) -> pd.Series:
+    """Filas con consentimiento y dato de contacto bien formado para el canal"""
+    col_contacto, col_consentimiento = CONTACTO_CANAL[canal]
+    if col_contacto not in df.columns or col_consentimiento not in df.columns:
+        return pd.Series(False, index=df.index)
+    return mascara_consentimiento(df[col_consentimiento]) & contacto_valido(df, col_contacto)
+
+def contacto_invalido(df: pd.DataFrame, canal: str) -> pd.Series:
+    """Filas con consentimiento y dato de contacto para el canal, pero mal formado"""
+    col_contacto, col_consentimiento = CONTACTO_CANAL[canal]
+    if col_contacto not in df.columns or col_consentimiento not in df.columns:
+        return pd.Series(False, index=df.index)
+    contacto = df[col_contacto]
+    presente = contacto.notna() & (contacto.astype(str).str.strip() != "")
+    return mascara_consentimiento(df[col_consentimiento]) & presente & ~contacto_valido(df, col_contacto)
+
+def canal_preferido(df: pd.DataFrame) -> pd.Series:
+    """Canal preferido de contacto normalizado ('' si no hay o no es un canal de mensajería)"""
+    if "canal_preferido_contacto" not in df.columns:
+        return pd.Series("", index=df.index)
+    preferido = df["canal_preferido_contacto"].astype(str).str.strip().str.lower()
+    return preferido.where(preferido.isin(CANALES) & df["canal_preferido_contacto"].notna(), "")
+
+def asignar_canal(df: pd.DataFrame, canales: Optional[List[str]] = None) -> pd.Series:
+    """
+    Mejor canal permitido de cada fila: el preferido si está habilitado y si no el primero
+    habilitado en el orden de respaldo
+
+    Args:
+        df: Filas de clientes/pólizas
+        canales: Canales permitidos en orden de respaldo (por defecto CANALES)
+
+    Returns:
+        Serie alineada con df con el canal asignado ('' si ningún canal está habilitado)
+    """
+    canales = canales or CANALES
+    habilitado = {canal: contacto_habilitado(df, canal).to_numpy() for canal in canales}
+    preferido = canal_preferido(df).to_numpy()
+    condiciones = [(preferido == canal) & habilitado[canal] for canal in canales]
+    condiciones += [habilitado[canal] for canal in canales]
+    return pd.Series(np.select(condiciones, canales + canales, ""), index=df.index)
@@ -0,0 +1,119 @@
+"""
+Agregación geoespacial del portafolio en celdas hexagonales (binning en el servidor)
+Solo las celdas agregadas llegan al mapa, sin importar cuántas pólizas tenga la sábana
+"""
+import numpy as np
+import pandas as pd
+from typing import Dict, Any
+import streamlit as st
+
+COLUMNAS_GEO = ["geoloc_lat", "geoloc_lon"]
+
+# Resoluciones disponibles (etiqueta -> radio del hexágono en grados de latitud)
+RESOLUCIONES_HEX = {
+    "Alta (~10 km)": 0.09,
+    "Media (~25 km)": 0.225,
+    "Baja (~50 km)": 0.45,
+}
+
+# Métricas del mapa (etiqueta -> columna agregada)
+METRICAS_GEO = {
+    "Pólizas": "polizas",
+    "Valor en mora": "valor_en_mora",
+    "Prima total": "prima_total",
+    "Índice climático promedio": "indice_climatico",
+}
+
+SQRT3 = np.sqrt(3.0)
+
+def _redondeo_cubico(q: np.ndarray, r: np.ndarray):
+    """Redondea coordenadas axiales fraccionarias al hexágono más cercano (vectorizado)"""
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    ajustar_q = (dq > dr) & (dq > ds)
+    ajustar_r = ~ajustar_q & (dr > ds)
+    rq = np.where(ajustar_q, -rr - rs, rq)
+    rr = np.where(ajustar_r, -rq - rs, rr)
+    return rq.astype(np.int64), rr.astype(np.int64)
+
+def binning_hexagonal(df: pd.DataFrame, radio: float) -> Dict[str, Any]:
+    """
+    Agrupa las pólizas en hexágonos y calcula los agregados por celda
+
+    La longitud se escala por cos(latitud media) para que los hexágonos sean
+    aproximadamente regulares sobre el terreno.
+
+    Args:
+        df: DataFrame con geoloc_lat / geoloc_lon
+        radio: Radio del hexágono en grados de latitud
+
+    Returns:
+        Dict con 'celdas' (DataFrame agregado por hexágono) y 'geojson' (polígonos de las celdas)
+    """
+    if not set(COLUMNAS_GEO).issubset(df.columns):
+        return {"celdas": pd.DataFrame(), "geojson": {"type": "FeatureCollection", "features": []}}
+
+    datos = df[df["geoloc_lat"].notna() & df["geoloc_lon"].notna()]
+    if len(datos) == 0:
+        return {"celdas": pd.DataFrame(), "geojson": {"type": "FeatureCollection", "features": []}}
+
+    lat = datos["geoloc_lat"].to_numpy(dtype=float)
+    lon = datos["geoloc_lon"].to_numpy(dtype=float)
+    escala_lon = np.cos(np.radians(lat.mean()))
+    x, y = lon * escala_lon, lat
+
+    # Coordenadas axiales (hexágonos "pointy-top")
+    q_frac = (SQRT3 / 3 * x - y / 3) / radio
+    r_frac = (2 / 3 * y) / radio
+    q, r = _redondeo_cubico(q_frac, r_frac)
+
+    agregados = pd.DataFrame({
+        "q": q,
+        "r": r,
+        "valor_en_mora": datos["valor_en_mora"].fillna(0).to_numpy() if "valor_en_mora" in datos.columns else 0.0,
+        "en_mora": (datos["dias_mora"].fillna(0) > 0).to_numpy() if "dias_mora" in datos.columns else False,
+        "prima_total": datos["prima_total"].fillna(0).to_numpy() if "prima_total" in datos.columns else 0.0,
+        "indice_climatico": datos["indice_climatico_zona"].to_numpy() if "indice_climatico_zona" in datos.columns else np.nan,
+        "riesgo_alto": (datos["zona_riesgo_geo"].astype(str).str.lower() == "alta").to_numpy() if "zona_riesgo_geo" in datos.columns else False,
+    })
+    celdas = agregados.groupby(["q", "r"], sort=False).agg(
+        polizas=("valor_en_mora", "size"),
+        polizas_en_mora=("en_mora", "sum"),
+        valor_en_mora=("valor_en_mora", "sum"),
+        prima_total=("prima_total", "sum"),
+        indice_climatico=("indice_climatico", "mean"),
+        pct_riesgo_alto=("riesgo_alto", "mean"),
+    ).reset_index()
+    celdas["pct_riesgo_alto"] = celdas["pct_riesgo_alto"] * 100
+    celdas["id_celda"] = celdas["q"].astype(str) + "_" + celdas["r"].astype(str)
+
+    # Centros de las celdas de vuelta a lat/lon
+    cx = radio * SQRT3 * (celdas["q"].to_numpy() + celdas["r"].to_numpy() / 2)
+    cy = radio * 1.5 * celdas["r"].to_numpy()
+    celdas["lat"] = cy
+    celdas["lon"] = cx / escala_lon
+
+    # Vértices en sentido horario (requerido por el renderizado geo de Plotly)
+    angulos = np.radians(30 - 60 * np.arange(7))
+    vx = cx[:, None] + radio * np.cos(angulos)[None, :]
+    vy = cy[:, None] + radio * np.sin(angulos)[None, :]
+    vlon = np.round(vx / escala_lon, 5)
+    vlat = np.round(vy, 5)
+    features = [
+        {
+            "type": "Feature",
+            "id": id_celda,
+            "geometry": {"type": "Polygon", "coordinates": [np.column_stack([vlon[i], vlat[i]]).tolist()]},
+        }
+        for i, id_celda in enumerate(celdas["id_celda"])
+    ]
+
+    return {"celdas": celdas, "geojson": {"type": "FeatureCollection", "features": features}}
+
+@st.cache_data(show_spinner=False)
+def celdas_hexagonales(version: str, resolucion: str, _df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Celdas hexagonales cacheadas por versión del dataset y resolución (compartidas entre sesiones)
+    """
+    return binning_hexagonal(_df, RESOLUCIONES_HEX[resolucion])
@@ -0,0 +1,177 @@
+"""
+Índice de idempotencia de envíos
+Recuerda qué (póliza, tipo, canal) ya recibieron una notificación en el periodo actual para
+no reenviarla al repetir una campaña (doble clic, reintento tras una caída del worker)
+"""
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional, Set, Tuple
+
+from modules.despacho import get_config_despacho
+from modules.log_incremental import LectorIncremental, cargar_con_lector
+from modules.log_segmentos import leer_log
+
+# Periodos soportados: formato de la clave del periodo a partir de una fecha
+PERIODOS = {
+    "dia": lambda fecha: fecha.strftime("%Y-%m-%d"),
+    "semana": lambda fecha: "{0}-W{1:02d}".format(*fecha.isocalendar()[:2]),
+    "mes": lambda fecha: fecha.strftime("%Y-%m"),
+}
+# Primer día de cada periodo (para cargar del histórico solo las particiones del periodo)
+INICIOS_PERIODO = {
+    "dia": lambda fecha: fecha.date(),
+    "semana": lambda fecha: fecha.date() - timedelta(days=fecha.weekday()),
+    "mes": lambda fecha: fecha.date().replace(day=1),
+}
+PERIODO_POR_DEFECTO = "dia"
+
+# Estados del log que cuentan como notificación: 'cubierto' marca las pólizas que un mensaje
+# del planificador incluyó al fusionar varios objetivos del cliente
+ESTADOS_NOTIFICADOS = ["enviado", "cubierto"]
+
+Clave = Tuple[str, str, str]
+
+def clave_periodo(fecha: datetime, periodo: str) -> str:
+    """Identificador del periodo al que pertenece la fecha (ej: '2026-10-19', '2026-W42', '2026-10')"""
+    return PERIODOS[periodo](fecha)
+
+def inicio_periodo(fecha: datetime, periodo: str) -> date:
+    """Primer día del periodo al que pertenece la fecha"""
+    return INICIOS_PERIODO[periodo](fecha)
+
+class IndiceEnvios:
+    """
+    Conjunto de (id_poliza, tipo, canal) ya notificados en el periodo vigente
+
+    Se alimenta de forma incremental del log de notificaciones (entradas 'enviado' y 'cubierto')
+    y de las reservas que hace el despacho antes de enviar, de modo que dos envíos
+    simultáneos de la misma póliza tampoco se duplican. La consulta es O(1) por destinatario.
+    Al cambiar de periodo (y en la primera actualización) los envíos se reconstruyen desde el
+    log: los segmentos rotados o compactados desde el inicio del periodo y el segmento vivo
+    desde el principio, quedándose solo con las claves del nuevo periodo. Las reservas de
+    envíos en curso se mantienen hasta confirmarlas. Las filas sin póliza no tienen clave:
+    no se reservan ni se marcan, así no chocan entre sí como duplicados.
+    """
+
+    def __init__(self, path: str, periodo: str = PERIODO_POR_DEFECTO):
+        if periodo not in PERIODOS:
+            raise ValueError(f"Periodo de idempotencia no soportado: {periodo}")
+        self.path = path
+        self.periodo = periodo
+        self.lector = LectorIncremental(path)
+        self.periodo_actual = ""
+        self.enviados: Set[Clave] = set()
+        self.reservados: Set[Clave] = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def clave(id_poliza, tipo: str, canal: str) -> Optional[Clave]:
+        """Clave de idempotencia, o None si la fila no tiene póliza (vacía, None o NaN)"""
+        if id_poliza is None or id_poliza != id_poliza:
+            return None
+        id_poliza = str(id_poliza).strip()
+        if id_poliza.lower() in ("", "nan", "none"):
+            return None
+        return (id_poliza, str(tipo).lower(), str(canal).lower())
+
+    def actualizar(self, ahora: Optional[datetime] = None) -> int:
+        """
+        Incorpora los envíos nuevos del log
+
+        Returns:
+            Número de entradas leídas
+        """
+        ahora = ahora or datetime.now()
+        periodo_actual = clave_periodo(ahora, self.periodo)
+        with self._lock:
+            desde = inicio_periodo(ahora, self.periodo)
+            if periodo_actual != self.periodo_actual:
+                # Las entradas del nuevo periodo que el lector ya consumió se recuperan releyendo
+                # el log; las reservas son envíos en curso y se cierran con confirmar()
+                self.periodo_actual = periodo_actual
+                self._recargar(desde)
+            entradas, reinicio = self.lector.leer_nuevas()
+            if reinicio:
+                # Segmento vivo truncado: se reconstruye a partir de los segmentos cerrados
+                self._recargar(desde)
+                entradas, _ = self.lector.leer_nuevas()
+            for entrada in entradas:
+                if entrada.get("estado") not in ESTADOS_NOTIFICADOS:
+                    continue
+                try:
+                    fecha = datetime.fromisoformat(str(entrada.get("timestamp", "")))
+                except ValueError:
+                    continue
+                clave = self.clave(entrada.get("id_poliza"), entrada.get("tipo", ""), entrada.get("canal", ""))
+                if clave is not None and clave_periodo(fecha, self.periodo) == periodo_actual:
+                    self.enviados.add(clave)
+            return len(entradas)
+
+    def _recargar(self, desde: date):
+        """Envíos desde el histórico, con el lector al inicio del segmento vivo (con el lock tomado)"""
+        cargar_con_lector(self.lector, self.enviados.clear, lambda: self._cargar_historico(desde))
+
+    def _cargar_historico(self, desde: date):
+        """Envíos del periodo en los segmentos cerrados del log (el vivo lo sigue el lector)"""
+        historico = leer_log(self.path, desde=desde, columnas=["estado", "id_poliza", "tipo", "canal"], incluir_vivo=False)
+        historico = historico[historico["estado"].isin(ESTADOS_NOTIFICADOS)]
+        claves = (
+            self.clave(id_poliza, tipo, canal)
+            for id_poliza, tipo, canal in zip(historico["id_poliza"], historico["tipo"].fillna(""), historico["canal"].fillna(""))
+        )
+        self.enviados.update(clave for clave in claves if clave is not None)
+
+    def ya_enviado(self, id_poliza, tipo: str, canal: str) -> bool:
+        """Indica si la póliza ya fue notificada (o está en envío) en el periodo vigente"""
+        clave = self.clave(id_poliza, tipo, canal)
+        if clave is None:
+            return False
+        with self._lock:
+            return clave in self.enviados or clave in self.reservados
+
+    def reservar(self, id_poliza, tipo: str, canal: str) -> bool:
+        """
+        Reserva el envío de forma atómica
+
+        Returns:
+            True si la póliza no había sido notificada ni reservada (el llamador debe enviar);
+            una fila sin póliza no se reserva y siempre se envía
+        """
+        clave = self.clave(id_poliza, tipo, canal)
+        if clave is None:
+            return True
+        with self._lock:
+            if clave in self.enviados or clave in self.reservados:
+                return False
+            self.reservados.add(clave)
+            return True
+
+    def confirmar(self, id_poliza, tipo: str, canal: str, exito: bool):
+        """Cierra una reserva: si el envío falló se libera para permitir reintentarlo"""
+        clave = self.clave(id_poliza, tipo, canal)
+        if clave is None:
+            return
+        with self._lock:
+            self.reservados.discard(clave)
+            if exito:
+                self.enviados.add(clave)
+
+# Un índice por log y por proceso (la UI y el worker mantienen el suyo a partir del mismo log)
+_indices: Dict[str, IndiceEnvios] = {}
+_indices_lock = threading.Lock()
+
+def obtener_indice_envios(path: str) -> IndiceEnvios:
+    """
+    Índice de idempotencia del log dado, actualizado con las entradas nuevas
+
+    El periodo se toma de la configuración del despacho ('periodo_idempotencia');
+    si cambia, el índice se reconstruye desde el inicio del log.
+    """
+    periodo = get_config_despacho()["periodo_idempotencia"]
+    with _indices_lock:
+        indice = _indices.get(path)
+        if indice is None or indice.periodo != periodo:
+            indice = IndiceEnvios(path, periodo)
+            _indices[path] = indice
+    indice.actualizar()
+    return indice
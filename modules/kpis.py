@@ -0,0 +1,223 @@
+"""
+Capa de agregados materializados (cubo de KPIs) para el tablero ejecutivo
+Se construye una sola vez por versión del dataset y el dashboard solo lee números precalculados
+"""
+import os
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, List, Optional
+import streamlit as st
+
+# Ventanas de renovación (etiqueta del selector -> límite en días)
+VENTANAS_RENOVACION = {"<= 30 días": 30, "<= 15 días": 15, "<= 7 días": 7}
+
+# Segmentos de mora (etiqueta del selector -> (mínimo, máximo) de días de mora, inclusive)
+SEGMENTOS_MORA = {
+    "1–15 días": (1, 15),
+    "16–45 días": (16, 45),
+    ">45 días": (46, None),
+}
+
+# Rangos de valor en mora para la gráfica de barras
+RANGOS_MORA_BINS = [0, 100000, 500000, 1000000, 5000000, float("inf")]
+RANGOS_MORA_LABELS = ["$0-$100K", "$100K-$500K", "$500K-$1M", "$1M-$5M", ">$5M"]
+
+VALORES_RENOVABLE = ["true", "1", "si", "sí", "yes"]
+
+# Número de bins del histograma de valores en mora
+HISTOGRAMA_NBINS = 20
+
+def version_dataset(path: str) -> str:
+    """
+    Calcula una versión barata del archivo de datos (tamaño + fecha de modificación)
+
+    Args:
+        path: Ruta al archivo CSV
+
+    Returns:
+        Identificador de versión; cambia cada vez que el archivo se modifica
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return "sin-version"
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+def mascara_renovable(df: pd.DataFrame) -> pd.Series:
+    """Pólizas renovables (o sin dato de renovabilidad)"""
+    return df["renovable"].astype(str).str.lower().isin(VALORES_RENOVABLE) | df["renovable"].isna()
+
+def mascara_segmento_mora(df: pd.DataFrame, segmento: str) -> pd.Series:
+    """Casos del segmento de mora con valor en mora positivo"""
+    dias_mora = df["dias_mora"].fillna(0)
+    minimo, maximo = SEGMENTOS_MORA[segmento]
+    if maximo is None:
+        mascara = dias_mora > minimo - 1
+    else:
+        mascara = (dias_mora >= minimo) & (dias_mora <= maximo)
+    return mascara & (df["valor_en_mora"].fillna(0) > 0)
+
+def orden_urgencia(sem) -> int:
+    """Orden de presentación de un semáforo: rojo, amarillo, verde, otros"""
+    sem_str = str(sem).lower()
+    if "rojo" in sem_str or "🔴" in str(sem) or "red" in sem_str:
+        return 1
+    elif "amarillo" in sem_str or "🟡" in str(sem) or "yellow" in sem_str:
+        return 2
+    elif "verde" in sem_str or "🟢" in str(sem) or "green" in sem_str:
+        return 3
+    else:
+        return 4
+
+def histograma_servidor(valores, nbins: int = HISTOGRAMA_NBINS, escala_log: bool = False) -> Dict[str, List[float]]:
+    """
+    Agrupa los valores en bins en el servidor (solo se envían bordes y conteos al gráfico)
+
+    Args:
+        valores: Serie o arreglo de valores numéricos
+        nbins: Número de bins
+        escala_log: Si es True usa bins espaciados logarítmicamente (solo valores > 0)
+
+    Returns:
+        Dict con 'bordes' (nbins + 1) y 'conteos' (nbins)
+    """
+    arr = np.asarray(valores, dtype=float)
+    arr = arr[np.isfinite(arr)]
+    if escala_log:
+        arr = arr[arr > 0]
+    if arr.size == 0:
+        return {"bordes": [], "conteos": []}
+
+    minimo, maximo = float(arr.min()), float(arr.max())
+    if minimo == maximo:
+        # Todos los valores iguales: un único bin centrado en el valor
+        delta = abs(minimo) * 0.05 or 0.5
+        bordes = np.array([minimo - delta, maximo + delta])
+        if escala_log:
+            bordes[0] = max(bordes[0], minimo / 1.05)
+    elif escala_log:
+        bordes = np.geomspace(minimo, maximo, nbins + 1)
+    else:
+        bordes = np.linspace(minimo, maximo, nbins + 1)
+    conteos, bordes = np.histogram(arr, bins=bordes)
+    return {"bordes": bordes.tolist(), "conteos": conteos.astype(int).tolist()}
+
+def _cubo_renovaciones(df: pd.DataFrame) -> Dict[int, Dict[str, Any]]:
+    """
+    Conteos por semáforo para todas las ventanas en una sola pasada
+
+    Cada póliza renovable se asigna a un bucket de días (<=7, <=15, <=30, >30) y los
+    conteos de cada ventana se obtienen como suma acumulada de los buckets.
+    """
+    limites = sorted(VENTANAS_RENOVACION.values())
+    renovables = df[mascara_renovable(df)]
+    dias = renovables["dias_para_vencimiento"].fillna(9999).to_numpy()
+    bucket = np.searchsorted(np.asarray(limites), dias, side="left")
+    total_renovables = len(renovables)
+
+    cubo = {}
+    tiene_semaforo = "semáforo_vencimiento" in renovables.columns
+    if tiene_semaforo:
+        conteos = pd.crosstab(renovables["semáforo_vencimiento"], bucket)
+        conteos = conteos.reindex(columns=range(len(limites) + 1), fill_value=0)
+        acumulados = conteos.cumsum(axis=1)
+    en_bucket = np.bincount(bucket, minlength=len(limites) + 1).cumsum()
+
+    for i, limite in enumerate(limites):
+        en_ventana = int(en_bucket[i])
+        excluidos = total_renovables - en_ventana
+        semaforos: List[Dict[str, Any]] = []
+        if tiene_semaforo:
+            serie = acumulados[i]
+            serie = serie[serie > 0].sort_index()
+            semaforos = [{"Semáforo": sem, "Cantidad": int(n)} for sem, n in serie.items()]
+            # Los registros fuera de la ventana se muestran como "Verde"
+            if excluidos > 0:
+                semaforos.append({"Semáforo": "Verde", "Cantidad": excluidos})
+            semaforos.sort(key=lambda r: (orden_urgencia(r["Semáforo"]), -r["Cantidad"]))
+        cubo[limite] = {
+            "en_ventana": en_ventana,
+            "excluidos": excluidos,
+            "total": en_ventana + excluidos,
+            "tiene_semaforo": tiene_semaforo,
+            "semaforos": semaforos,
+        }
+    return cubo
+
+def _cubo_cartera(df: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+    """
+    Totales de mora y rangos de valor por segmento en una sola pasada
+    """
+    valor = df["valor_en_mora"].fillna(0)
+    etiquetas = list(SEGMENTOS_MORA.keys())
+
+    condiciones = [mascara_segmento_mora(df, etiqueta) for etiqueta in etiquetas]
+    segmento = pd.Series(np.select(condiciones, etiquetas, default=""), index=df.index)
+
+    en_mora = segmento != ""
+    seg_mora = segmento[en_mora]
+    valor_mora = valor[en_mora]
+    agregados = valor_mora.groupby(seg_mora).agg(["count", "sum", "mean"])
+    rangos = pd.cut(valor_mora, bins=RANGOS_MORA_BINS, labels=RANGOS_MORA_LABELS, right=False)
+    rangos_por_seg = pd.crosstab(seg_mora, rangos).reindex(columns=RANGOS_MORA_LABELS, fill_value=0)
+    valores_por_seg = {k: v.to_numpy() for k, v in valor_mora.groupby(seg_mora)}
+
+    cubo = {}
+    for etiqueta in etiquetas:
+        if etiqueta in agregados.index:
+            clientes = int(agregados.at[etiqueta, "count"])
+            monto_total = float(agregados.at[etiqueta, "sum"])
+            promedio = float(agregados.at[etiqueta, "mean"])
+            conteo_rangos = rangos_por_seg.loc[etiqueta].astype(int).tolist()
+        else:
+            clientes, monto_total, promedio = 0, 0.0, 0.0
+            conteo_rangos = [0] * len(RANGOS_MORA_LABELS)
+        valores_seg = valores_por_seg.get(etiqueta, np.array([]))
+        cubo[etiqueta] = {
+            "clientes": clientes,
+            "monto_total": monto_total,
+            "promedio": promedio,
+            "rangos": {"Rango": list(RANGOS_MORA_LABELS), "Cantidad": conteo_rangos},
+            "histograma": {
+                "lineal": histograma_servidor(valores_seg),
+                "log": histograma_servidor(valores_seg, escala_log=True),
+            },
+        }
+    return cubo
+
+def construir_cubo_kpis(df: pd.DataFrame, version: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Construye todos los agregados del tablero a partir del dataset
+
+    Args:
+        df: DataFrame completo de cartera y renovaciones
+        version: Versión del dataset a la que corresponde el cubo
+
+    Returns:
+        Dict con conteos por semáforo por ventana y totales/rangos/histogramas de mora por segmento
+    """
+    return {
+        "version": version,
+        "renovaciones": _cubo_renovaciones(df),
+        "cartera": _cubo_cartera(df),
+    }
+
+@st.cache_data(show_spinner=False)
+def cubo_kpis(version: str, _df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Cubo de KPIs cacheado por versión del dataset (compartido entre sesiones)
+
+    El DataFrame no forma parte de la llave de caché (prefijo _), la versión la define.
+    """
+    return construir_cubo_kpis(_df, version=version)
+
+def obtener_cubo_kpis(df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Obtiene el cubo de la sesión actual, construyéndolo si aún no existe
+    """
+    cubo = st.session_state.get("kpis")
+    version = st.session_state.get("df_version")
+    if cubo is None or (version is not None and cubo.get("version") != version):
+        cubo = cubo_kpis(version or "sin-version", df)
+        st.session_state["kpis"] = cubo
+    return cubo
@@ -0,0 +1,212 @@
+"""
+Escritura en lotes del log de notificaciones (JSONL)
+Acumula las entradas en memoria y las anexa al archivo en una sola escritura cuando el lote
+llega a un tamaño o antigüedad máximos, o al terminar una campaña, con una política de
+fsync configurable. Antes de escribir el primer lote de cada día rota el segmento vivo si
+contiene entradas de días anteriores y compacta los rotados en segundo plano (pasada la
+espera de compactación)
+
+Compromiso de durabilidad: hasta 'max_entradas' entradas o 'max_espera' segundos de envíos
+viven solo en memoria. Si el proceso muere de forma abrupta (SIGKILL, OOM) esas entradas se
+pierden y la deduplicación, que se reconstruye desde el log, no las ve: los mensajes de ese
+lote que el outbox aún tenía en proceso se reenvían al recuperarse. El outbox marca un
+mensaje como enviado solo después de vaciar el log, así nunca queda por delante del log. Con
+fsync 'siempre' cada entrada se escribe al registrarse y la ventana se reduce a un mensaje,
+a cambio de una escritura (y un fsync) por envío
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date
+from typing import Any, Dict, List, Optional
+import streamlit as st
+
+from modules.log_segmentos import ESPERA_COMPACTACION, compactar, rotar
+
+# Valores por defecto (se pueden sobrescribir en [log] de secrets.toml o por variables de entorno)
+MAX_ENTRADAS_POR_DEFECTO = 500    # Entradas que fuerzan la escritura del lote
+MAX_ESPERA_POR_DEFECTO = 1.0      # Segundos máximos que una entrada espera en memoria
+# 'nunca': el sistema operativo decide cuándo llega a disco; 'lote': fsync tras cada escritura
+# del lote; 'siempre': cada entrada se escribe y sincroniza de inmediato (sin lotes)
+POLITICAS_FSYNC = ["nunca", "lote", "siempre"]
+FSYNC_POR_DEFECTO = "lote"
+
+logger = logging.getLogger(__name__)
+
+def get_config_log() -> Dict[str, Any]:
+    """
+    Obtiene la configuración del escritor del log desde variables de entorno o secrets de Streamlit
+    """
+    try:
+        log_secrets = st.secrets.get("log", {})
+    except (AttributeError, FileNotFoundError, KeyError):
+        log_secrets = {}
+
+    config = {
+        "max_entradas": int(os.getenv("LOG_MAX_ENTRADAS", log_secrets.get("max_entradas", MAX_ENTRADAS_POR_DEFECTO))),
+        "max_espera": float(os.getenv("LOG_MAX_ESPERA", log_secrets.get("max_espera", MAX_ESPERA_POR_DEFECTO))),
+        "fsync": str(os.getenv("LOG_FSYNC", log_secrets.get("fsync", FSYNC_POR_DEFECTO))).lower(),
+    }
+    if config["fsync"] not in POLITICAS_FSYNC:
+        raise ValueError(f"Política de fsync no soportada: {config['fsync']}")
+    return config
+
+class EscritorLog:
+    """
+    Escritor thread-safe de un archivo JSONL de solo-anexado
+
+    Las entradas se serializan al registrarlas y se anexan en bloque (una llamada a write
+    por lote, con el archivo abierto en modo append), de modo que las líneas de hilos
+    concurrentes nunca se intercalan. Un hilo en segundo plano escribe los lotes que
+    superan 'max_espera' aunque no lleguen a 'max_entradas'. Un error de disco al escribir
+    desde escribir() o desde el hilo no llega al envío que registró la entrada: el lote
+    queda en memoria, se reintenta tras 'max_espera' y el error se informa por logging.
+
+    Args:
+        path: Archivo de log
+        max_entradas: Entradas que fuerzan la escritura
+        max_espera: Segundos máximos que una entrada espera en memoria
+        fsync: Política de sincronización a disco ('nunca', 'lote', 'siempre')
+    """
+
+    def __init__(self, path: str, max_entradas: int = MAX_ENTRADAS_POR_DEFECTO,
+                 max_espera: float = MAX_ESPERA_POR_DEFECTO, fsync: str = FSYNC_POR_DEFECTO):
+        if fsync not in POLITICAS_FSYNC:
+            raise ValueError(f"Política de fsync no soportada: {fsync}")
+        self.path = path
+        self.max_entradas = 1 if fsync == "siempre" else max(1, max_entradas)
+        self.max_espera = max_espera
+        self.fsync = fsync
+        self._lineas: List[str] = []
+        self._primera: Optional[float] = None
+        self._archivo = None
+        self._dia: Optional[date] = None
+        self._lock = threading.Lock()
+        self._hay_lineas = threading.Condition(self._lock)
+        self._hilo: Optional[threading.Thread] = None
+
+    def escribir(self, entrada: Dict[str, Any]):
+        """Agrega una entrada al lote (se escribe al llenarse el lote o al vencer la espera)"""
+        linea = json.dumps(entrada, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._lineas.append(linea)
+            if self._primera is None:
+                self._primera = time.monotonic()
+                self._asegurar_hilo()
+                self._hay_lineas.notify()
+            if len(self._lineas) >= self.max_entradas:
+                try:
+                    self._vaciar()
+                except OSError as e:
+                    # El mensaje ya salió: el lote se conserva y lo reintenta el hilo de fondo
+                    self._primera = time.monotonic()
+                    logger.warning("No se pudo escribir el log %s (%d entradas pendientes): %s", self.path, len(self._lineas), e)
+
+    def vaciar(self):
+        """Escribe de inmediato las entradas pendientes (fin de campaña, cierre del proceso)"""
+        with self._lock:
+            self._vaciar()
+
+    def pendientes(self) -> int:
+        """Entradas en memoria aún no escritas"""
+        with self._lock:
+            return len(self._lineas)
+
+    def cerrar(self):
+        """Escribe lo pendiente y cierra el archivo"""
+        with self._lock:
+            self._vaciar()
+            if self._archivo is not None:
+                self._archivo.close()
+                self._archivo = None
+
+    def _vaciar(self):
+        """Escribe el lote (con el lock tomado)"""
+        if not self._lineas:
+            return
+        self._rotar_si_corresponde()
+        archivo = self._abrir()
+        archivo.write("".join(self._lineas))
+        archivo.flush()
+        if self.fsync != "nunca":
+            os.fsync(archivo.fileno())
+        self._lineas = []
+        self._primera = None
+
+    def _rotar_si_corresponde(self):
+        """Cierra el segmento vivo del día anterior (se verifica una vez por día)"""
+        hoy = date.today()
+        if self._dia == hoy:
+            return
+        if rotar(self.path, hoy):
+            # Se compacta cuando vence la espera en que otros procesos aún pueden anexar al rotado
+            compactador = threading.Timer(ESPERA_COMPACTACION + 1, compactar, args=(self.path,))
+            compactador.name, compactador.daemon = "compactador-log", True
+            compactador.start()
+        self._dia = hoy
+
+    def _abrir(self):
+        """Archivo abierto en modo append; se reabre si otro proceso lo movió o eliminó"""
+        if self._archivo is not None:
+            try:
+                actual = os.stat(self.path)
+                abierto = os.fstat(self._archivo.fileno())
+                if (actual.st_dev, actual.st_ino) == (abierto.st_dev, abierto.st_ino):
+                    return self._archivo
+            except OSError:
+                pass
+            self._archivo.close()
+        directorio = os.path.dirname(self.path)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._archivo = open(self.path, "a", encoding="utf-8")
+        return self._archivo
+
+    def _asegurar_hilo(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._hilo = threading.Thread(target=self._vaciar_vencidos, name="escritor-log", daemon=True)
+            self._hilo.start()
+
+    def _vaciar_vencidos(self):
+        """Hilo en segundo plano: escribe el lote cuando su primera entrada cumple max_espera"""
+        with self._lock:
+            while True:
+                if self._primera is None:
+                    self._hay_lineas.wait()
+                    continue
+                restante = self._primera + self.max_espera - time.monotonic()
+                if restante > 0:
+                    self._hay_lineas.wait(restante)
+                    continue
+                try:
+                    self._vaciar()
+                except OSError as e:
+                    # Se reintenta con la próxima entrada o en el siguiente vaciado explícito
+                    self._primera = time.monotonic()
+                    logger.warning("No se pudo escribir el log %s (%d entradas pendientes): %s", self.path, len(self._lineas), e)
+
+_escritores: Dict[str, EscritorLog] = {}
+_escritores_lock = threading.Lock()
+
+def obtener_escritor_log(path: str) -> EscritorLog:
+    """Escritor compartido del archivo (uno por ruta para todo el proceso)"""
+    with _escritores_lock:
+        escritor = _escritores.get(path)
+        if escritor is None:
+            config = get_config_log()
+            escritor = EscritorLog(path, config["max_entradas"], config["max_espera"], config["fsync"])
+            _escritores[path] = escritor
+        return escritor
+
+def vaciar_logs():
+    """Escribe lo pendiente de todos los escritores"""
+    with _escritores_lock:
+        escritores = list(_escritores.values())
+    for escritor in escritores:
+        escritor.vaciar()
+
+# Al terminar el proceso (worker, benchmark) no se pierden las entradas en memoria
+atexit.register(vaciar_logs)
@@ -0,0 +1,181 @@
+"""
+Lectura incremental del log de notificaciones (JSONL)
+Cada consumidor recuerda hasta qué byte leyó y solo procesa las líneas agregadas después;
+las últimas N entradas se leen hacia atrás desde el final del archivo
+"""
+import os
+import json
+import threading
+from typing import Callable, List, Dict, Any, Optional, Tuple
+
+# Bytes leídos por paso al recorrer el archivo desde el final
+BLOQUE_COLA = 64 * 1024
+
+# Cargas del histórico que se intentan si el segmento vivo se rota mientras se cargan
+INTENTOS_HISTORICO = 3
+
+class LectorIncremental:
+    """
+    Sigue un archivo JSONL de solo-anexado y retorna las entradas nuevas en cada llamada
+
+    El archivo se mantiene abierto entre llamadas. Si se rota (se mueve o se reemplaza por
+    otro inode), primero se terminan de leer las líneas que quedaron en el segmento anterior
+    y luego se sigue el archivo nuevo desde el principio, sin perder ni repetir entradas.
+    Si se trunca, la lectura se reinicia y se indica con la bandera 'reinicio' para que el
+    consumidor limpie su estado.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+        self._archivo = None
+        self._lock = threading.Lock()
+
+    def leer_nuevas(self) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        Lee las líneas completas agregadas desde la última llamada
+
+        Returns:
+            Tuple[List[Dict], bool]: (entradas nuevas, reinicio)
+        """
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                stat = None
+
+            reinicio = False
+            entradas: List[Dict[str, Any]] = []
+            if self._archivo is not None:
+                abierto = os.fstat(self._archivo.fileno())
+                if stat is None or (stat.st_dev, stat.st_ino) != (abierto.st_dev, abierto.st_ino):
+                    # Rotado: lo que quedó en el segmento anterior (la línea final ya está completa)
+                    entradas = self._leer_completas(abierto.st_size, final=True)
+                    self._archivo.close()
+                    self._archivo, self.offset = None, 0
+                elif stat.st_size < self.offset:
+                    self.offset = 0
+                    reinicio = True
+
+            if stat is None:
+                return entradas, reinicio
+            if self._archivo is None:
+                try:
+                    self._archivo = open(self.path, "rb")
+                except OSError:
+                    return entradas, reinicio
+                stat = os.fstat(self._archivo.fileno())
+            entradas.extend(self._leer_completas(stat.st_size))
+            return entradas, reinicio
+
+    def fijar(self) -> Optional[Tuple[int, int]]:
+        """
+        Reinicia la lectura al principio del archivo actual y lo deja abierto
+
+        Un consumidor que carga el histórico cerrado lo llama antes de cargarlo: las entradas
+        de este archivo las lee el lector aunque el archivo se rote durante la carga.
+
+        Returns:
+            Identidad (dispositivo, inode) del archivo, o None si no existe
+        """
+        with self._lock:
+            if self._archivo is not None:
+                self._archivo.close()
+            self._archivo, self.offset = None, 0
+            try:
+                self._archivo = open(self.path, "rb")
+            except OSError:
+                return None
+            abierto = os.fstat(self._archivo.fileno())
+            return abierto.st_dev, abierto.st_ino
+
+    def identidad(self) -> Optional[Tuple[int, int]]:
+        """Identidad (dispositivo, inode) del archivo que está hoy en la ruta, o None si no existe"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_dev, stat.st_ino
+
+    def _leer_completas(self, tamano: int, final: bool = False) -> List[Dict[str, Any]]:
+        """Entradas entre el offset y 'tamano' (con el lock tomado)"""
+        if tamano <= self.offset:
+            return []
+        self._archivo.seek(self.offset)
+        datos = self._archivo.read(tamano - self.offset)
+
+        # Solo se consumen líneas completas; una línea a medio escribir queda para la próxima
+        fin = len(datos) if final else datos.rfind(b"\n")
+        if fin < 0:
+            return []
+        self.offset += fin + (0 if final else 1)
+
+        entradas = []
+        for linea in datos[:fin].split(b"\n"):
+            if linea.strip():
+                try:
+                    entradas.append(json.loads(linea))
+                except ValueError:
+                    continue
+        return entradas
+
+def cargar_con_lector(lector: LectorIncremental, limpiar: Callable[[], None], cargar: Callable[[], None]):
+    """
+    Carga el histórico cerrado y deja al lector al inicio del segmento vivo, sin huecos ni repetidos
+
+    El lector se fija en el segmento vivo antes de cargar: lo que se escriba en él lo lee el
+    lector y el histórico (que omite el vivo) no lo incluye. Si el segmento se rotó durante la
+    carga, el histórico pudo haberlo leído también, así que se descarta y se vuelve a cargar.
+    """
+    for _ in range(INTENTOS_HISTORICO):
+        limpiar()
+        identidad = lector.fijar()
+        cargar()
+        if lector.identidad() == identidad:
+            return
+
+def leer_ultimas(path: str, limite: int, bloque: int = BLOQUE_COLA) -> List[Dict[str, Any]]:
+    """
+    Últimas 'limite' entradas del archivo, en el orden en que se escribieron
+
+    Lee bloques hacia atrás desde el final hasta reunir limite + 1 saltos de línea, de
+    modo que el costo depende de 'limite' y no del tamaño total del log. Una línea final
+    a medio escribir (sin salto de línea) se ignora, igual que en la lectura incremental.
+
+    Returns:
+        Lista de entradas (vacía si el archivo no existe)
+    """
+    if limite <= 0:
+        return []
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return []
+    with f:
+        fin = f.seek(0, os.SEEK_END)
+        posicion, partes, saltos = fin, [], 0
+        while posicion > 0 and saltos <= limite:
+            tamano = min(bloque, posicion)
+            posicion -= tamano
+            f.seek(posicion)
+            parte = f.read(tamano)
+            partes.append(parte)
+            saltos += parte.count(b"\n")
+    datos = b"".join(reversed(partes))
+
+    # Descartar la línea incompleta del final y, si no se llegó al inicio, la primera (cortada)
+    corte = datos.rfind(b"\n")
+    if corte < 0:
+        return []
+    lineas = datos[:corte].split(b"\n")
+    if posicion > 0:
+        lineas = lineas[1:]
+
+    entradas = []
+    for linea in lineas[-limite:]:
+        if linea.strip():
+            try:
+                entradas.append(json.loads(linea))
+            except ValueError:
+                continue
+    return entradas
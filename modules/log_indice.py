@@ -0,0 +1,277 @@
+"""
+Índice persistente del log de notificaciones por cliente y póliza
+Guarda en SQLite la ubicación de cada entrada (byte en los segmentos JSONL, fila en las
+partes Parquet) por id_cliente e id_poliza, de modo que el historial completo de un cliente
+se lee en un tiempo proporcional a sus propias entradas y no al tamaño del log
+"""
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from collections import defaultdict
+from contextlib import closing
+from typing import Dict, Iterable, List, Optional, Tuple
+import pandas as pd
+import pyarrow.parquet as pq
+
+from modules.log_segmentos import (
+    COLUMNAS,
+    archivos_particion,
+    directorio_rotados,
+    directorio_segmentos,
+    normalizar_entradas,
+    particiones,
+    segmentos_json,
+)
+
+# Campos de la entrada que se indexan
+CAMPOS_INDICE = ["id_cliente", "id_poliza"]
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS segmentos (
+    segmento TEXT PRIMARY KEY,
+    avance INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS ubicaciones (
+    campo TEXT NOT NULL,
+    valor TEXT NOT NULL,
+    segmento TEXT NOT NULL,
+    posicion INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ubicaciones_valor ON ubicaciones(campo, valor);
+CREATE INDEX IF NOT EXISTS idx_ubicaciones_segmento ON ubicaciones(segmento);
+"""
+
+Ubicacion = Tuple[str, str, str, int]
+
+def _identificar(ruta: str) -> Optional[str]:
+    """
+    Identidad estable de un segmento JSONL: su inode (se conserva al rotarlo) y el CRC de
+    su primera línea (distingue un inode reutilizado). None si aún no tiene una línea completa.
+    """
+    try:
+        with open(ruta, "rb") as f:
+            stat = os.fstat(f.fileno())
+            linea = f.readline()
+    except OSError:
+        return None
+    if not linea.endswith(b"\n"):
+        return None
+    return f"jsonl:{stat.st_ino}-{zlib.crc32(linea):08x}"
+
+def _ubicaciones(entrada: Dict, segmento: str, posicion: int) -> Iterable[Ubicacion]:
+    for campo in CAMPOS_INDICE:
+        valor = entrada.get(campo)
+        if valor is not None and valor != "":
+            yield (campo, str(valor), segmento, posicion)
+
+class IndiceLog:
+    """
+    Índice de ubicaciones de las entradas del log por id_cliente e id_poliza
+
+    Cada segmento JSONL (el vivo y los rotados) se indexa de forma incremental desde el
+    último byte indexado, de modo que una actualización solo procesa lo anexado. Una parte
+    Parquet se indexa (leyendo solo las columnas del índice) cuando su segmento de origen
+    terminó de compactarse, y en la misma transacción se descartan las ubicaciones del
+    segmento JSONL que ya no existe. La base se comparte entre procesos (modo WAL).
+
+    Args:
+        path: Segmento vivo del log (la base queda en el directorio de segmentos)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db = os.path.join(directorio_segmentos(path), "indice.sqlite3")
+        self._lock = threading.Lock()
+
+    def conectar(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.db), exist_ok=True)
+        conn = sqlite3.connect(self.db, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_ESQUEMA)
+        return conn
+
+    def actualizar(self) -> int:
+        """
+        Incorpora al índice las entradas nuevas de todos los segmentos
+
+        Returns:
+            Ubicaciones agregadas
+        """
+        with self._lock, closing(self.conectar()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                agregadas = self._indexar_partes(conn) + self._indexar_jsonl(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return agregadas
+
+    def _indexar_partes(self, conn: sqlite3.Connection) -> int:
+        """Partes Parquet nuevas cuyo segmento de origen ya se compactó por completo"""
+        indexadas = {fila[0] for fila in conn.execute("SELECT segmento FROM segmentos WHERE segmento LIKE 'parquet:%'")}
+        try:
+            en_curso = {nombre.split(".")[0] for nombre in os.listdir(directorio_rotados(self.path))}
+        except FileNotFoundError:
+            en_curso = set()
+        base = directorio_segmentos(self.path)
+        agregadas = 0
+        for fecha in particiones(self.path):
+            for archivo in archivos_particion(self.path, fecha):
+                segmento = "parquet:" + os.path.relpath(archivo, base)
+                if segmento in indexadas or os.path.basename(archivo).split(".")[0] in en_curso:
+                    continue
+                tabla = pq.read_table(archivo, columns=CAMPOS_INDICE).to_pandas()
+                filas = [
+                    (campo, str(valor), segmento, posicion)
+                    for campo in CAMPOS_INDICE
+                    for posicion, valor in zip(tabla.index, tabla[campo])
+                    if valor is not None and valor != ""
+                ]
+                conn.executemany("INSERT INTO ubicaciones VALUES (?, ?, ?, ?)", filas)
+                conn.execute("INSERT INTO segmentos VALUES (?, ?)", (segmento, len(tabla)))
+                agregadas += len(filas)
+        return agregadas
+
+    def _indexar_jsonl(self, conn: sqlite3.Connection) -> int:
+        """Bytes nuevos del vivo y los rotados; descarta los segmentos que ya no existen"""
+        vigentes = self._segmentos_vigentes()
+        avances = dict(conn.execute("SELECT segmento, avance FROM segmentos WHERE segmento LIKE 'jsonl:%'").fetchall())
+        for segmento in set(avances) - set(vigentes):
+            conn.execute("DELETE FROM ubicaciones WHERE segmento = ?", (segmento,))
+            conn.execute("DELETE FROM segmentos WHERE segmento = ?", (segmento,))
+
+        agregadas = 0
+        for segmento, ruta in vigentes.items():
+            avance = avances.get(segmento, 0)
+            try:
+                with open(ruta, "rb") as f:
+                    f.seek(avance)
+                    datos = f.read()
+            except FileNotFoundError:
+                continue  # Se compactó entre el listado y la lectura: sus partes entran en la próxima
+            fin = datos.rfind(b"\n")
+            if fin < 0:
+                continue
+            filas = []
+            posicion = avance
+            for linea in datos[:fin + 1].splitlines(keepends=True):
+                if linea.strip():
+                    try:
+                        filas.extend(_ubicaciones(json.loads(linea), segmento, posicion))
+                    except ValueError:
+                        pass
+                posicion += len(linea)
+            conn.executemany("INSERT INTO ubicaciones VALUES (?, ?, ?, ?)", filas)
+            conn.execute(
+                "INSERT INTO segmentos VALUES (?, ?) ON CONFLICT(segmento) DO UPDATE SET avance = excluded.avance",
+                (segmento, avance + fin + 1)
+            )
+            agregadas += len(filas)
+        return agregadas
+
+    def _segmentos_vigentes(self) -> Dict[str, str]:
+        """Identidad -> ruta actual de los segmentos JSONL (rotados y vivo)"""
+        vigentes = {}
+        for ruta in segmentos_json(self.path):
+            segmento = _identificar(ruta)
+            if segmento:
+                vigentes[segmento] = ruta
+        return vigentes
+
+    def buscar(self, campo: str, valores: Iterable) -> pd.DataFrame:
+        """
+        Historial completo de las entradas con id_cliente (o id_poliza) en 'valores'
+
+        Args:
+            campo: 'id_cliente' o 'id_poliza'
+            valores: Identificadores a buscar
+
+        Returns:
+            DataFrame con las columnas del esquema, la entrada más reciente primero
+        """
+        if campo not in CAMPOS_INDICE:
+            raise ValueError(f"Campo no indexado: {campo}")
+        valores = list(dict.fromkeys(str(v) for v in valores))
+        if not valores:
+            return pd.DataFrame(columns=COLUMNAS)
+        # Un segmento puede compactarse entre la consulta y la lectura: se reintenta con el índice al día
+        for intento in range(2):
+            self.actualizar()
+            try:
+                df = self._leer(self._consultar(campo, valores))
+                break
+            except FileNotFoundError:
+                if intento:
+                    raise
+        return df.sort_values("timestamp", ascending=False, kind="stable", ignore_index=True)
+
+    def _consultar(self, campo: str, valores: List[str]) -> Dict[str, List[int]]:
+        posiciones = defaultdict(list)
+        with closing(self.conectar()) as conn:
+            for i in range(0, len(valores), 500):
+                lote = valores[i:i + 500]
+                marcas = ",".join("?" * len(lote))
+                for segmento, posicion in conn.execute(
+                    f"SELECT segmento, posicion FROM ubicaciones WHERE campo = ? AND valor IN ({marcas})",
+                    [campo] + lote
+                ):
+                    posiciones[segmento].append(posicion)
+        return posiciones
+
+    def _leer(self, posiciones: Dict[str, List[int]]) -> pd.DataFrame:
+        """Lee solo las líneas (JSONL) y los row groups (Parquet) que contienen las posiciones"""
+        vigentes = self._segmentos_vigentes() if any(s.startswith("jsonl:") for s in posiciones) else {}
+        entradas, partes = [], []
+        for segmento, filas in posiciones.items():
+            filas = sorted(set(filas))
+            if segmento.startswith("jsonl:"):
+                if segmento not in vigentes:
+                    raise FileNotFoundError(segmento)
+                with open(vigentes[segmento], "rb") as f:
+                    for offset in filas:
+                        f.seek(offset)
+                        entradas.append(json.loads(f.readline()))
+            else:
+                partes.append(self._leer_filas(os.path.join(directorio_segmentos(self.path), segmento[len("parquet:"):]), filas))
+        if entradas:
+            partes.append(normalizar_entradas(entradas))
+        partes = [p for p in partes if len(p)]
+        if not partes:
+            return pd.DataFrame(columns=COLUMNAS)
+        return pd.concat(partes, ignore_index=True)
+
+    @staticmethod
+    def _leer_filas(archivo: str, filas: List[int]) -> pd.DataFrame:
+        archivo_pq = pq.ParquetFile(archivo)
+        grupos = defaultdict(list)
+        inicio = 0
+        limites = []
+        for g in range(archivo_pq.num_row_groups):
+            limites.append(inicio)
+            inicio += archivo_pq.metadata.row_group(g).num_rows
+        g = 0
+        for fila in filas:
+            while g + 1 < len(limites) and fila >= limites[g + 1]:
+                g += 1
+            grupos[g].append(fila - limites[g])
+        return pd.concat(
+            [archivo_pq.read_row_group(g).to_pandas().iloc[indices] for g, indices in grupos.items()],
+            ignore_index=True
+        )
+
+# Un índice por log y por proceso (la base en disco es compartida)
+_indices: Dict[str, IndiceLog] = {}
+_indices_lock = threading.Lock()
+
+def obtener_indice_log(path: str) -> IndiceLog:
+    """Índice del log dado (una instancia por ruta para todo el proceso)"""
+    with _indices_lock:
+        indice = _indices.get(path)
+        if indice is None:
+            indice = IndiceLog(path)
+            _indices[path] = indice
+        return indice
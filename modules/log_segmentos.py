@@ -0,0 +1,317 @@
+"""
+Segmentos del log de notificaciones
+El log vivo (JSONL) recibe las entradas del día; al cambiar de día se rota a un segmento
+cerrado que luego se compacta a Parquet particionado por fecha (fecha=AAAA-MM-DD). Una
+consulta por rango de fechas solo abre las particiones del rango, y solo el segmento vivo
+(y los rotados que aún no se compactan) se interpretan como JSON
+"""
+import glob
+import json
+import os
+import time
+import uuid
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from modules.log_incremental import leer_ultimas
+
+# Esquema tipado de las particiones (el mismo formato de las entradas del JSONL)
+ESQUEMA = pa.schema([
+    ("timestamp", pa.timestamp("us")),
+    ("tipo", pa.string()),
+    ("canal", pa.string()),
+    ("destinatario", pa.string()),
+    ("mensaje", pa.string()),
+    ("estado", pa.string()),
+    ("id_cliente", pa.string()),
+    ("id_poliza", pa.string()),
+    ("error", pa.string()),
+    ("usuario", pa.string()),
+])
+COLUMNAS = ESQUEMA.names
+
+# Filas por row group de las particiones: leer una entrada puntual (por el índice del log)
+# solo decodifica su grupo y no el día completo
+FILAS_POR_GRUPO = 4096
+
+# Segundos tras los cuales un segmento reclamado por un compactador que no terminó se retoma
+ESPERA_RECLAMO = 600
+
+# Segundos sin escrituras que un segmento rotado espera antes de compactarse: un escritor de
+# otro proceso que abrió el archivo antes de la rotación puede anexar aún su último lote
+ESPERA_COMPACTACION = 60
+
+def directorio_segmentos(path: str) -> str:
+    """Directorio de los segmentos del log (logs/notificaciones.jsonl -> logs/notificaciones/)"""
+    return os.path.splitext(path)[0]
+
+def directorio_rotados(path: str) -> str:
+    """Directorio de los segmentos rotados que aún no se compactan"""
+    return os.path.join(directorio_segmentos(path), "rotados")
+
+def _directorio_particion(path: str, fecha: str) -> str:
+    return os.path.join(directorio_segmentos(path), f"fecha={fecha}")
+
+def _fecha_primera_entrada(path: str) -> Optional[str]:
+    """Fecha (AAAA-MM-DD) de la primera entrada del archivo, o None si está vacío o no existe"""
+    try:
+        with open(path, "rb") as f:
+            linea = f.readline()
+    except OSError:
+        return None
+    try:
+        fecha = str(json.loads(linea).get("timestamp", ""))[:10]
+    except ValueError:
+        return None
+    return fecha if len(fecha) == 10 else None
+
+def rotar(path: str, hoy: Optional[date] = None) -> Optional[str]:
+    """
+    Cierra el segmento vivo si empezó antes de hoy
+
+    El archivo se mueve (rename atómico) al directorio de rotados con un nombre único; los
+    escritores de otros procesos detectan el cambio y abren un segmento vivo nuevo.
+
+    Returns:
+        Ruta del segmento rotado, o None si no correspondía rotar
+    """
+    fecha = _fecha_primera_entrada(path)
+    if fecha is None or fecha >= (hoy or date.today()).isoformat():
+        return None
+    os.makedirs(directorio_rotados(path), exist_ok=True)
+    base = os.path.splitext(os.path.basename(path))[0]
+    destino = os.path.join(directorio_rotados(path), f"{base}-{fecha}-{uuid.uuid4().hex[:8]}.jsonl")
+    try:
+        os.rename(path, destino)
+    except FileNotFoundError:
+        return None  # Otro proceso lo rotó primero
+    # La espera de compactación se cuenta desde la rotación (y se extiende con cada escritura tardía)
+    os.utime(destino)
+    return destino
+
+def _nombre_segmento(path: str) -> str:
+    """Nombre base de un segmento o de sus partes (notificaciones-<fecha>-<id>)"""
+    return os.path.basename(path).split(".")[0]
+
+def _leer_jsonl(path: str) -> List[Dict[str, Any]]:
+    entradas = []
+    with open(path, "rb") as f:
+        for linea in f:
+            if linea.strip():
+                try:
+                    entradas.append(json.loads(linea))
+                except ValueError:
+                    continue
+    return entradas
+
+def normalizar_entradas(entradas: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Entradas del JSONL como DataFrame con los tipos del esquema (timestamp como fecha, resto texto)"""
+    df = pd.DataFrame(entradas).reindex(columns=COLUMNAS)
+    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce", format="ISO8601")
+    for col in COLUMNAS[1:]:
+        df[col] = df[col].astype(str).astype(object).where(df[col].notna(), None)
+    return df
+
+def compactar(path: str) -> int:
+    """
+    Compacta los segmentos rotados en particiones Parquet por fecha
+
+    Cada segmento se reclama renombrándolo (dos procesos no compactan el mismo) y se
+    escribe como una parte por fecha de sus entradas (un segmento puede traer entradas
+    de otro día escritas cerca de medianoche). El nombre de la parte deriva del segmento,
+    así que repetir una compactación interrumpida no duplica entradas. Solo se compactan los
+    segmentos sin escrituras en los últimos ESPERA_COMPACTACION segundos.
+
+    Returns:
+        Entradas compactadas
+    """
+    rotados = directorio_rotados(path)
+    pendientes = [
+        p for p in glob.glob(os.path.join(rotados, "*.jsonl"))
+        if time.time() - os.path.getmtime(p) > ESPERA_COMPACTACION
+    ]
+    # Reclamos de un compactador que se interrumpió
+    pendientes += [
+        p for p in glob.glob(os.path.join(rotados, "*.jsonl.compactando"))
+        if time.time() - os.path.getmtime(p) > ESPERA_RECLAMO
+    ]
+
+    total = 0
+    for segmento in sorted(pendientes):
+        reclamado = segmento if segmento.endswith(".compactando") else segmento + ".compactando"
+        try:
+            os.rename(segmento, reclamado)
+        except FileNotFoundError:
+            continue
+        nombre = _nombre_segmento(reclamado)
+        df = normalizar_entradas(_leer_jsonl(reclamado))
+        df = df.dropna(subset=["timestamp"])
+        for fecha, parte in df.groupby(df["timestamp"].dt.strftime("%Y-%m-%d")):
+            directorio = _directorio_particion(path, fecha)
+            os.makedirs(directorio, exist_ok=True)
+            destino = os.path.join(directorio, f"{nombre}.parquet")
+            tabla = pa.Table.from_pandas(parte.sort_values("timestamp", kind="stable"), schema=ESQUEMA, preserve_index=False)
+            pq.write_table(tabla, destino + ".tmp", row_group_size=FILAS_POR_GRUPO)
+            os.replace(destino + ".tmp", destino)
+        total += len(df)
+        os.remove(reclamado)
+    return total
+
+def particiones(path: str) -> List[str]:
+    """Fechas (AAAA-MM-DD) con partición compactada, en orden"""
+    directorios = glob.glob(os.path.join(directorio_segmentos(path), "fecha=*"))
+    return sorted(os.path.basename(d)[len("fecha="):] for d in directorios)
+
+def archivos_particion(path: str, fecha: str) -> List[str]:
+    """Partes Parquet de la partición de una fecha"""
+    return sorted(glob.glob(os.path.join(_directorio_particion(path, fecha), "*.parquet")))
+
+def segmentos_json(path: str) -> List[str]:
+    """Segmentos que aún se leen como JSON: rotados sin compactar y el vivo (al final)"""
+    rotados = directorio_rotados(path)
+    segmentos = sorted(glob.glob(os.path.join(rotados, "*.jsonl")) + glob.glob(os.path.join(rotados, "*.jsonl.compactando")))
+    return segmentos + [path]
+
+def _leer_segmentos(segmentos: List[str]) -> Tuple[List[Dict[str, Any]], Set[str]]:
+    """
+    Entradas de los segmentos JSON y nombres de los que se leyeron
+
+    Mientras un segmento exista (rotado, o reclamado por una compactación en curso o que se
+    interrumpió) es la fuente de sus entradas: las partes Parquet con su nombre se omiten al
+    leer las particiones, así una entrada nunca se cuenta dos veces.
+    """
+    entradas = []
+    leidos = set()
+    for segmento in segmentos:
+        try:
+            entradas.extend(_leer_jsonl(segmento))
+        except FileNotFoundError:
+            continue  # Compactado o rotado mientras se leía la lista (sus partes ya existen)
+        leidos.add(_nombre_segmento(segmento))
+    return entradas, leidos
+
+def _fecha(valor) -> Optional[str]:
+    if valor is None:
+        return None
+    return valor.isoformat()[:10] if isinstance(valor, (date, datetime)) else str(valor)[:10]
+
+def _valores_filtro(filtros: Optional[Dict[str, Any]]) -> Dict[str, List[str]]:
+    """Filtros {columna: valor o lista de valores} sin los vacíos, con los valores como listas"""
+    normalizados = {}
+    for columna, valores in (filtros or {}).items():
+        if columna not in COLUMNAS[1:]:
+            raise ValueError(f"Columna de filtro no soportada: {columna}")
+        if valores is None or valores == [] or valores == "":
+            continue
+        normalizados[columna] = [str(v) for v in valores] if isinstance(valores, (list, tuple, set)) else [str(valores)]
+    return normalizados
+
+def leer_log(
+    path: str,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    columnas: Optional[List[str]] = None,
+    incluir_vivo: bool = True,
+    filtros: Optional[Dict[str, Any]] = None,
+    limite: Optional[int] = None
+) -> pd.DataFrame:
+    """
+    Entradas del log en un rango de fechas (inclusive), de todos los segmentos
+
+    Los filtros se aplican en el escaneo: solo se abren las particiones Parquet del rango,
+    de ellas solo 'columnas', y los filtros por valor se pasan al lector de Parquet (que
+    descarta row groups por sus estadísticas y filas antes de convertirlas a pandas). Los
+    segmentos JSON se filtran al leerlos. Con 'limite' las particiones se recorren de la
+    más nueva a la más antigua y el recorrido se detiene al reunir las entradas pedidas.
+    Con incluir_vivo=False se omite el segmento vivo (para consumidores que ya lo siguen
+    con LectorIncremental).
+
+    Args:
+        filtros: {columna: valor o lista de valores} (ej: {"estado": "enviado", "canal": ["email"]})
+        limite: Máximo de entradas (las más recientes)
+
+    Returns:
+        DataFrame con las columnas del esquema (o 'columnas'), ordenado por timestamp
+    """
+    desde, hasta = _fecha(desde), _fecha(hasta)
+    filtros = _valores_filtro(filtros)
+    columnas = list(columnas or COLUMNAS)
+    lectura = columnas if "timestamp" in columnas else ["timestamp"] + columnas
+
+    partes = []
+    segmentos = segmentos_json(path)
+    entradas, leidos = _leer_segmentos(segmentos if incluir_vivo else segmentos[:-1])
+    dias_json = pd.Series(dtype=object)
+    if entradas:
+        df = normalizar_entradas(entradas)
+        dia = df["timestamp"].dt.strftime("%Y-%m-%d")
+        seleccion = pd.Series(True, index=df.index)
+        if desde:
+            seleccion &= dia >= desde
+        if hasta:
+            seleccion &= dia <= hasta
+        for columna, valores in filtros.items():
+            seleccion &= df[columna].isin(valores)
+        partes.append(df.loc[seleccion, lectura])
+        dias_json = dia[seleccion]
+
+    filtros_parquet = [(columna, "in", valores) for columna, valores in filtros.items()] or None
+    reunidas = 0
+    for fecha in reversed(particiones(path)):
+        if (desde and fecha < desde) or (hasta and fecha > hasta):
+            continue
+        for archivo in archivos_particion(path, fecha):
+            if _nombre_segmento(archivo) in leidos:
+                continue
+            tabla = pq.read_table(archivo, columns=lectura, filters=filtros_parquet)
+            reunidas += tabla.num_rows
+            partes.append(tabla.to_pandas())
+        # Lo que queda por recorrer es anterior a esta fecha (las entradas JSON de días anteriores no cuentan)
+        if limite is not None and reunidas + int((dias_json >= fecha).sum()) >= limite:
+            break
+
+    partes = [p for p in partes if len(p)]
+    if not partes:
+        return pd.DataFrame(columns=columnas)
+    df = pd.concat(partes, ignore_index=True).sort_values("timestamp", kind="stable", ignore_index=True)
+    if limite is not None:
+        df = df.tail(limite).reset_index(drop=True)
+    return df[columnas]
+
+def ultimas(path: str, limite: int) -> pd.DataFrame:
+    """
+    Últimas 'limite' entradas del log
+
+    Lee la cola del segmento vivo y, si no alcanza, completa con los segmentos rotados y
+    las particiones más recientes (de la más nueva hacia atrás, solo las necesarias).
+
+    Returns:
+        DataFrame en orden de escritura (la más reciente al final)
+    """
+    vivas = leer_ultimas(path, limite)
+    faltan = limite - len(vivas)
+    partes = [pd.DataFrame(vivas)] if vivas else []
+    if faltan > 0:
+        anteriores = []
+        entradas, leidos = _leer_segmentos(segmentos_json(path)[:-1])
+        if entradas:
+            anteriores.append(normalizar_entradas(entradas))
+        reunidas = len(entradas)
+        for fecha in reversed(particiones(path)):
+            if reunidas >= faltan:
+                break
+            for archivo in archivos_particion(path, fecha):
+                if _nombre_segmento(archivo) in leidos:
+                    continue
+                tabla = pq.read_table(archivo).to_pandas()
+                anteriores.append(tabla)
+                reunidas += len(tabla)
+        if anteriores:
+            previas = pd.concat(anteriores, ignore_index=True).sort_values("timestamp", kind="stable")
+            partes.insert(0, previas.tail(faltan))
+    if not partes:
+        return pd.DataFrame()
+    return pd.concat(partes, ignore_index=True)
@@ -0,0 +1,117 @@
+"""
+Construcción vectorizada de mensajes de campaña (cartera y renovaciones)
+Genera destinatario, asunto y texto para todas las filas de un DataFrame en una sola pasada,
+con formato de moneda y fechas por columna; lo usan tanto las vistas previas como los envíos.
+Los textos salen del registro de plantillas (plantillas_mensajes.json)
+"""
+from typing import Callable, Dict
+import numpy as np
+import pandas as pd
+
+from modules.kpis import SEGMENTOS_MORA
+from modules.plantillas import obtener_registro
+
+COLUMNAS_MENSAJE = ["destinatario", "asunto", "mensaje", "plantilla"]
+
+def _texto(df: pd.DataFrame, col: str, defecto: str = "") -> pd.Series:
+    """Columna como texto (valores faltantes reemplazados por 'defecto')"""
+    if col not in df.columns:
+        return pd.Series(defecto, index=df.index, dtype=object)
+    serie = df[col]
+    return serie.astype(str).where(serie.notna(), defecto)
+
+def _numero(df: pd.DataFrame, col: str) -> pd.Series:
+    """Columna numérica (valores faltantes o no numéricos como 0)"""
+    if col not in df.columns:
+        return pd.Series(0.0, index=df.index)
+    return pd.to_numeric(df[col], errors="coerce").fillna(0)
+
+def formato_moneda(valores: pd.Series) -> pd.Series:
+    """
+    Formatea una columna numérica como moneda sin decimales: 1234567.4 -> '$1,234,567'
+    """
+    enteros = valores.round().astype("int64").astype(str)
+    return "$" + enteros.str.replace(r"\B(?=(\d{3})+(?!\d))", ",", regex=True)
+
+def formato_fecha(df: pd.DataFrame, col: str) -> pd.Series:
+    """
+    Formatea una columna de fechas como AAAA-MM-DD
+
+    Acepta fechas ya convertidas o texto (ej: filas leídas del outbox); los valores que
+    no son fechas se conservan como texto y los faltantes quedan vacíos.
+    """
+    if col not in df.columns:
+        return pd.Series("", index=df.index, dtype=object)
+    fechas = pd.to_datetime(df[col], errors="coerce")
+    return fechas.dt.strftime("%Y-%m-%d").where(fechas.notna(), _texto(df, col).replace("NaT", ""))
+
+def _destinatario(df: pd.DataFrame, canal: str) -> pd.Series:
+    """Contacto del canal sin transformar (la normalización la hace cada canal al enviar)"""
+    col = "email_cliente" if canal == "email" else "telefono_cliente"
+    if col not in df.columns:
+        return pd.Series(None, index=df.index, dtype=object)
+    return df[col]
+
+# Campos disponibles en las plantillas (además de cualquier columna de la sábana por su nombre)
+CAMPOS: Dict[str, Callable[[pd.DataFrame], pd.Series]] = {
+    "nombre": lambda df: _texto(df, "nombre_cliente", "Cliente"),
+    "poliza": lambda df: _texto(df, "numero_poliza"),
+    "producto": lambda df: _texto(df, "producto"),
+    "plan": lambda df: _texto(df, "plan"),
+    "link_pago": lambda df: _texto(df, "link_pago"),
+    "valor_mora": lambda df: formato_moneda(_numero(df, "valor_en_mora")),
+    "dias_mora": lambda df: _numero(df, "dias_mora").astype("int64").astype(str),
+    "fecha_limite": lambda df: formato_fecha(df, "fecha_venc_factura"),
+    "fecha_fin": lambda df: formato_fecha(df, "fecha_fin_vigencia"),
+    "dias": lambda df: _numero(df, "dias_para_vencimiento").astype("int64").abs().astype(str),
+}
+
+def segmento_mora(df: pd.DataFrame) -> pd.Series:
+    """Etiqueta del segmento de mora de cada fila ('' si no está en mora)"""
+    dias = _numero(df, "dias_mora").to_numpy()
+    condiciones = [
+        (dias >= minimo) & (True if maximo is None else dias <= maximo)
+        for minimo, maximo in SEGMENTOS_MORA.values()
+    ]
+    return pd.Series(np.select(condiciones, list(SEGMENTOS_MORA), ""), index=df.index)
+
+def vencimiento(df: pd.DataFrame) -> pd.Series:
+    """Estado de vencimiento de la póliza: 'vencida', 'hoy' o 'futura'"""
+    dias = _numero(df, "dias_para_vencimiento").astype("int64").to_numpy()
+    return pd.Series(np.select([dias < 0, dias == 0], ["vencida", "hoy"], "futura"), index=df.index)
+
+def atributos_plantilla(df: pd.DataFrame, canal: str) -> pd.DataFrame:
+    """Valores normalizados de los criterios de selección de plantilla por fila"""
+    atributos = pd.DataFrame({
+        "canal": canal,
+        "idioma": _texto(df, "idioma_preferido", "es"),
+        "producto": _texto(df, "producto"),
+        "segmento": _texto(df, "segmento"),
+        "segmento_mora": segmento_mora(df),
+        "vencimiento": vencimiento(df),
+    }, index=df.index)
+    return atributos.apply(lambda col: col.str.strip().str.lower())
+
+def renderizar_mensajes(df: pd.DataFrame, tipo: str, canal: str = "email") -> pd.DataFrame:
+    """
+    Construye los mensajes de una campaña completa
+
+    Solo se calculan los campos que usan las plantillas elegidas.
+
+    Args:
+        df: Filas de clientes/pólizas
+        tipo: 'cartera' o 'renovacion'
+        canal: 'email' o 'whatsapp'
+
+    Returns:
+        DataFrame alineado con df con columnas destinatario, asunto, mensaje, plantilla
+    """
+    registro = obtener_registro()
+    campos = {
+        campo: CAMPOS[campo](df) if campo in CAMPOS else _texto(df, campo)
+        for campo in registro.campos_usados(tipo)
+        if campo in CAMPOS or campo in df.columns
+    }
+    textos = registro.renderizar(tipo, campos, atributos_plantilla(df, canal))
+    textos.insert(0, "destinatario", _destinatario(df, canal))
+    return textos[COLUMNAS_MENSAJE]
@@ -0,0 +1,231 @@
+"""
+Métricas de ritmo de envío (envíos, fallos y bloqueos por minuto/hora y canal) y conteos
+del historial completo por tipo, canal, estado y usuario
+Se mantienen por agregación incremental sobre el log de notificaciones
+"""
+import threading
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+import pandas as pd
+import streamlit as st
+
+from modules.log_incremental import LectorIncremental, cargar_con_lector
+from modules.log_segmentos import leer_log
+from modules.notificaciones import NOTIFICACIONES_LOG
+
+# Ventana de retención de los buckets por minuto
+RETENCION_DIAS = 7
+
+ESTADOS = ["enviado", "fallido", "bloqueado"]
+
+# Dimensiones de los conteos del historial (además de la fecha)
+DIMENSIONES = ["tipo", "canal", "estado", "usuario"]
+
+class AgregadorThroughput:
+    """
+    Conteos por (minuto, canal, estado) mantenidos a medida que se anexan entradas al log
+
+    Cada actualización procesa solo las líneas nuevas; los buckets más antiguos que la
+    retención se descartan para que el estado no crezca indefinidamente. La primera
+    actualización (y la que sigue a un truncamiento del segmento vivo) parte de los
+    segmentos cerrados del log dentro de la retención.
+    """
+
+    def __init__(self, path: str = NOTIFICACIONES_LOG, retencion_dias: int = RETENCION_DIAS):
+        self.path = path
+        self.lector = LectorIncremental(path)
+        self.retencion = timedelta(days=retencion_dias)
+        self.conteos: Counter = Counter()
+        self.ultimo_minuto = ""
+        self._historico_cargado = False
+        self._lock = threading.Lock()
+
+    def actualizar(self) -> int:
+        """
+        Incorpora las entradas nuevas del log
+
+        Returns:
+            Número de entradas procesadas
+        """
+        with self._lock:
+            if not self._historico_cargado:
+                self._recargar()
+                self._historico_cargado = True
+            entradas, reinicio = self.lector.leer_nuevas()
+            if reinicio:
+                # Segmento vivo truncado: se recalcula a partir de los segmentos cerrados
+                self._recargar()
+                entradas, _ = self.lector.leer_nuevas()
+            for entrada in entradas:
+                minuto = str(entrada.get("timestamp", ""))[:16]  # YYYY-MM-DDTHH:MM
+                if len(minuto) < 16:
+                    continue
+                canal = str(entrada.get("canal") or "desconocido").lower()
+                estado = str(entrada.get("estado") or "desconocido").lower()
+                self.conteos[(minuto, canal, estado)] += 1
+                if minuto > self.ultimo_minuto:
+                    self.ultimo_minuto = minuto
+            if entradas:
+                self._purgar()
+            return len(entradas)
+
+    def _recargar(self):
+        """Conteos desde el histórico, con el lector al inicio del segmento vivo (con el lock tomado)"""
+        def limpiar():
+            self.conteos.clear()
+            self.ultimo_minuto = ""
+        cargar_con_lector(self.lector, limpiar, self._cargar_historico)
+
+    def _cargar_historico(self):
+        """Conteos de los segmentos cerrados del log dentro de la retención (con el lock tomado)"""
+        historico = leer_log(self.path, desde=date.today() - self.retencion, columnas=["timestamp", "canal", "estado"], incluir_vivo=False)
+        historico = historico.dropna(subset=["timestamp"])
+        if historico.empty:
+            return
+        minutos = historico["timestamp"].dt.strftime("%Y-%m-%dT%H:%M")
+        canales = historico["canal"].fillna("desconocido").str.lower()
+        estados = historico["estado"].fillna("desconocido").str.lower()
+        self.conteos.update(pd.Series(1, index=[minutos, canales, estados]).groupby(level=[0, 1, 2]).sum().to_dict())
+        self.ultimo_minuto = max(self.ultimo_minuto, minutos.max())
+        self._purgar()
+
+    def _purgar(self):
+        """Descarta los buckets más antiguos que la retención (relativa a la última actividad)"""
+        limite = (self.ultima_actividad() - self.retencion).isoformat()[:16]
+        viejas = [clave for clave in self.conteos if clave[0] < limite]
+        for clave in viejas:
+            del self.conteos[clave]
+
+    def ultima_actividad(self) -> datetime:
+        """Minuto de la entrada más reciente del log (o la hora actual si no hay entradas)"""
+        if not self.ultimo_minuto:
+            return datetime.now()
+        return datetime.strptime(self.ultimo_minuto, "%Y-%m-%dT%H:%M")
+
+    def serie(self, frecuencia: str = "min", desde: Optional[datetime] = None) -> pd.DataFrame:
+        """
+        Serie de tiempo de conteos por canal y estado
+
+        Args:
+            frecuencia: 'min' (por minuto) o 'h' (por hora)
+            desde: Fecha/hora mínima a incluir (opcional)
+
+        Returns:
+            DataFrame con columnas periodo, canal, estado, cantidad
+        """
+        with self._lock:
+            filas = [(m, c, e, n) for (m, c, e), n in self.conteos.items()]
+        if not filas:
+            return pd.DataFrame(columns=["periodo", "canal", "estado", "cantidad"])
+
+        serie = pd.DataFrame(filas, columns=["periodo", "canal", "estado", "cantidad"])
+        serie["periodo"] = pd.to_datetime(serie["periodo"], format="%Y-%m-%dT%H:%M", errors="coerce")
+        serie = serie.dropna(subset=["periodo"])
+        if desde is not None:
+            serie = serie[serie["periodo"] >= pd.Timestamp(desde)]
+        if frecuencia != "min":
+            serie["periodo"] = serie["periodo"].dt.floor(frecuencia)
+        return (
+            serie.groupby(["periodo", "canal", "estado"], as_index=False)["cantidad"].sum()
+            .sort_values("periodo")
+        )
+
+class ContadoresLog:
+    """
+    Conteos de todo el historial del log por (fecha, tipo, canal, estado, usuario)
+
+    La primera actualización parte de los segmentos cerrados (solo esas columnas de las
+    particiones Parquet); después solo se procesan las líneas nuevas del segmento vivo.
+    Las métricas de cualquier combinación de filtros salen de sumar unas pocas claves,
+    sin volver a leer el log en cada vista.
+    """
+
+    def __init__(self, path: str = NOTIFICACIONES_LOG):
+        self.path = path
+        self.lector = LectorIncremental(path)
+        self.conteos: Counter = Counter()
+        self._historico_cargado = False
+        self._lock = threading.Lock()
+
+    def actualizar(self) -> int:
+        """
+        Incorpora las entradas nuevas del log
+
+        Returns:
+            Número de entradas procesadas
+        """
+        with self._lock:
+            if not self._historico_cargado:
+                cargar_con_lector(self.lector, self.conteos.clear, self._cargar_historico)
+                self._historico_cargado = True
+            entradas, reinicio = self.lector.leer_nuevas()
+            if reinicio:
+                # Segmento vivo truncado: se recalcula a partir de los segmentos cerrados
+                cargar_con_lector(self.lector, self.conteos.clear, self._cargar_historico)
+                entradas, _ = self.lector.leer_nuevas()
+            for entrada in entradas:
+                fecha = str(entrada.get("timestamp", ""))[:10]
+                if len(fecha) < 10:
+                    continue
+                self.conteos[(fecha,) + tuple(str(entrada.get(d) or "") for d in DIMENSIONES)] += 1
+            return len(entradas)
+
+    def _cargar_historico(self):
+        """Conteos de los segmentos cerrados del log (con el lock tomado)"""
+        historico = leer_log(self.path, columnas=["timestamp"] + DIMENSIONES, incluir_vivo=False)
+        historico = historico.dropna(subset=["timestamp"])
+        if historico.empty:
+            return
+        claves = [historico["timestamp"].dt.strftime("%Y-%m-%d")] + [historico[d].fillna("") for d in DIMENSIONES]
+        self.conteos.update(historico.groupby(claves).size().to_dict())
+
+    def totales(
+        self,
+        por: str = "estado",
+        filtros: Optional[Dict[str, Any]] = None,
+        desde: Optional[date] = None,
+        hasta: Optional[date] = None
+    ) -> Counter:
+        """
+        Conteos agrupados por una dimensión para las entradas que cumplen los filtros
+
+        Args:
+            por: Dimensión del resultado ('tipo', 'canal', 'estado' o 'usuario')
+            filtros: {dimensión: valor o lista de valores}
+            desde, hasta: Rango de fechas (inclusive)
+
+        Returns:
+            Counter {valor de la dimensión: entradas}
+        """
+        posicion = 1 + DIMENSIONES.index(por)
+        condiciones = []
+        for dimension, valores in (filtros or {}).items():
+            if valores is None or valores == [] or valores == "":
+                continue
+            valores = {str(v) for v in valores} if isinstance(valores, (list, tuple, set)) else {str(valores)}
+            condiciones.append((1 + DIMENSIONES.index(dimension), valores))
+        desde = desde.isoformat() if desde else ""
+        hasta = hasta.isoformat() if hasta else "9999"
+        resultado: Counter = Counter()
+        with self._lock:
+            for clave, cantidad in self.conteos.items():
+                if desde <= clave[0] <= hasta and all(clave[i] in valores for i, valores in condiciones):
+                    resultado[clave[posicion]] += cantidad
+        return resultado
+
+    def valores(self, dimension: str) -> List[str]:
+        """Valores observados de una dimensión (para poblar los filtros)"""
+        posicion = 1 + DIMENSIONES.index(dimension)
+        with self._lock:
+            return sorted({clave[posicion] for clave in self.conteos if clave[posicion]})
+
+@st.cache_resource(show_spinner=False)
+def obtener_agregador_throughput() -> AgregadorThroughput:
+    """Instancia única del agregador para todo el servidor"""
+    return AgregadorThroughput()
+
+@st.cache_resource(show_spinner=False)
+def obtener_contadores_log() -> ContadoresLog:
+    """Instancia única de los conteos del historial para todo el servidor"""
+    return ContadoresLog()
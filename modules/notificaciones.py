@@ -3,21 +3,28 @@ Módulo de notificaciones para envío de mensajes por Gmail y WhatsApp
 Incluye sistema de trazabilidad y logs
 """
 import os
-import smtplib
-import json
+import sqlite3
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from typing import Optional, Dict, Tuple, Any, Callable
+from typing import Optional, Dict, List, Tuple, Any, Callable
 import streamlit as st
-
-# Para WhatsApp - usando Twilio (alternativa: WhatsApp Business API)
-try:
-    from twilio.rest import Client as TwilioClient
-    TWILIO_AVAILABLE = True
-except ImportError:
-    TWILIO_AVAILABLE = False
+from modules.smtp_pool import obtener_pool_smtp
+from modules.despacho import despachar_por_canal
+from modules.enrutamiento import CANALES, CANAL_AUTOMATICO, CONTACTO_CANAL, VALORES_CONSENTIMIENTO, asignar_canal, canal_preferido
+from modules.mensajes import renderizar_mensajes
+from modules.contactos import contacto_valido, email_valido, normalizar_telefono, validar_contactos
+from modules.progreso import FlujoProgreso
+from modules.log_escritor import obtener_escritor_log
+from modules.log_indice import obtener_indice_log
+from modules.log_segmentos import leer_log, ultimas
+from modules.idempotencia import IndiceEnvios, obtener_indice_envios
+from modules.reintentos import CircuitoAbierto, ejecutar_con_reintentos, obtener_circuito
+from modules.simulador import obtener_simulador
+# Para WhatsApp - API de mensajes de Twilio (alternativa: WhatsApp Business API)
+from modules.twilio_cliente import obtener_cliente_twilio, API_BASE_POR_DEFECTO
 
 # Configuración de rutas
 LOGS_DIR = "logs"
@@ -25,8 +32,7 @@ NOTIFICACIONES_LOG = os.path.join(LOGS_DIR, "notificaciones.jsonl")
 
 def init_logs_dir():
     """Crea el directorio de logs si no existe"""
-    if not os.path.exists(LOGS_DIR):
-        os.makedirs(LOGS_DIR)
+    os.makedirs(LOGS_DIR, exist_ok=True)
 
 def log_notificacion(
     tipo: str,
@@ -42,6 +48,10 @@ def log_notificacion(
     """
     Registra una notificación en el log de trazabilidad
     
+    La entrada se agrega al lote del escritor compartido del log, que la anexa al archivo
+    junto con las demás al llenarse el lote, al vencer la espera máxima o al terminar la
+    campaña (ver [log] en secrets.toml).
+    
     Args:
         tipo: Tipo de notificación ('cartera', 'renovacion')
         canal: Canal usado ('email', 'whatsapp')
@@ -53,8 +63,6 @@ def log_notificacion(
         error: Mensaje de error si falló (opcional)
         usuario: Usuario que envió la notificación (opcional)
     """
-    init_logs_dir()
-    
     log_entry = {
         "timestamp": datetime.now().isoformat(),
         "tipo": tipo,
@@ -68,8 +76,7 @@ def log_notificacion(
         "usuario": usuario or st.session_state.get("user", "unknown")
     }
     
-    with open(NOTIFICACIONES_LOG, "a", encoding="utf-8") as f:
-        f.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
+    obtener_escritor_log(NOTIFICACIONES_LOG).escribir(log_entry)
 
 def get_config_email() -> Dict[str, str]:
     """
@@ -86,8 +93,23 @@ def get_config_email() -> Dict[str, str]:
         "smtp_port": int(os.getenv("SMTP_PORT", email_secrets.get("smtp_port", 587))),
         "email_from": os.getenv("EMAIL_FROM", email_secrets.get("email_from", "")),
         "email_password": os.getenv("EMAIL_PASSWORD", email_secrets.get("email_password", "")),
+        "smtp_starttls": str(os.getenv("SMTP_STARTTLS", email_secrets.get("smtp_starttls", True))).lower() not in ["false", "0", "no"],
     }
 
+def es_modo_prototipo() -> bool:
+    """
+    Indica si los envíos usan el simulador (modo prototipo) o los proveedores reales
+
+    Se configura con NOTIFICACIONES_MODO o 'modo' en [notificaciones] de secrets
+    ('prototipo' por defecto, 'produccion' para envíos reales).
+    """
+    try:
+        notificaciones_secrets = st.secrets.get("notificaciones", {})
+    except (AttributeError, FileNotFoundError, KeyError):
+        notificaciones_secrets = {}
+    modo = os.getenv("NOTIFICACIONES_MODO", notificaciones_secrets.get("modo", "prototipo"))
+    return str(modo).strip().lower() != "produccion"
+
 def get_config_whatsapp() -> Dict[str, str]:
     """
     Obtiene la configuración de WhatsApp desde variables de entorno o secrets de Streamlit
@@ -102,6 +124,7 @@ def get_config_whatsapp() -> Dict[str, str]:
         "account_sid": os.getenv("TWILIO_ACCOUNT_SID", whatsapp_secrets.get("account_sid", "")),
         "auth_token": os.getenv("TWILIO_AUTH_TOKEN", whatsapp_secrets.get("auth_token", "")),
         "whatsapp_from": os.getenv("WHATSAPP_FROM", whatsapp_secrets.get("whatsapp_from", "")),
+        "api_base": os.getenv("TWILIO_API_BASE", whatsapp_secrets.get("api_base", API_BASE_POR_DEFECTO)),
     }
 
 def enviar_email(
@@ -110,24 +133,33 @@ def enviar_email(
     mensaje: str,
     id_cliente: Optional[str] = None,
     id_poliza: Optional[str] = None,
-    modo_prototipo: bool = True,
-    tipo: str = "general"
+    modo_prototipo: Optional[bool] = None,
+    tipo: str = "general",
+    usuario: Optional[str] = None
 ) -> Tuple[bool, Optional[str]]:
     """
     Envía un email usando SMTP o simula el envío en modo prototipo
     
     Args:
         modo_prototipo: Si es True, simula el envío sin requerir credenciales
+            (por defecto según la configuración, ver es_modo_prototipo)
+        usuario: Usuario que realiza el envío (por defecto el de la sesión)
     
     Returns:
         Tuple[bool, Optional[str]]: (éxito, mensaje_error)
     """
+    if modo_prototipo is None:
+        modo_prototipo = es_modo_prototipo()
+    
     try:
-        # Modo prototipo: simular envío exitoso
+        # Un email mal formado falla aquí, sin ir al servidor SMTP
+        if not email_valido(destinatario):
+            raise ValueError(f"Email inválido: {destinatario}")
+        
+        # Modo prototipo: proveedor simulado (latencia, errores y límites configurables en [simulador.email])
         if modo_prototipo:
-            # Simular delay de envío
-            import time
-            time.sleep(0.5)  # Simular latencia de red
+            simulador = obtener_simulador("email")
+            ejecutar_con_reintentos("email", lambda: simulador.enviar(destinatario))
             
             # Log exitoso (simulado)
             log_notificacion(
@@ -137,7 +169,8 @@ def enviar_email(
                 mensaje=mensaje,
                 estado="enviado",
                 id_cliente=id_cliente,
-                id_poliza=id_poliza
+                id_poliza=id_poliza,
+                usuario=usuario
             )
             return True, None
         
@@ -164,7 +197,8 @@ def enviar_email(
                 estado="fallido",
                 id_cliente=id_cliente,
                 id_poliza=id_poliza,
-                error=error_msg
+                error=error_msg,
+                usuario=usuario
             )
             return False, error_msg
         
@@ -175,12 +209,10 @@ def enviar_email(
         msg["Subject"] = asunto
         msg.attach(MIMEText(mensaje, "plain", "utf-8"))
         
-        # Enviar
-        server = smtplib.SMTP(config["smtp_server"], config["smtp_port"])
-        server.starttls()
-        server.login(config["email_from"], config["email_password"])
-        server.send_message(msg)
-        server.quit()
+        # Enviar reutilizando una sesión SMTP autenticada del pool compartido; los errores
+        # transitorios se reintentan y con el circuito abierto el envío se reencola
+        pool = obtener_pool_smtp(config)
+        ejecutar_con_reintentos("email", lambda: pool.enviar(msg))
         
         # Log exitoso
         log_notificacion(
@@ -190,11 +222,15 @@ def enviar_email(
             mensaje=mensaje,
             estado="enviado",
             id_cliente=id_cliente,
-            id_poliza=id_poliza
+            id_poliza=id_poliza,
+            usuario=usuario
         )
         
         return True, None
         
+    except CircuitoAbierto:
+        # No se intentó el envío: no se registra como fallido, el llamador lo reencola
+        raise
     except Exception as e:
         error_msg = str(e)
         log_notificacion(
@@ -205,7 +241,8 @@ def enviar_email(
             estado="fallido",
             id_cliente=id_cliente,
             id_poliza=id_poliza,
-            error=error_msg
+            error=error_msg,
+            usuario=usuario
         )
         return False, error_msg
 
@@ -214,59 +251,50 @@ def enviar_whatsapp(
     mensaje: str,
     id_cliente: Optional[str] = None,
     id_poliza: Optional[str] = None,
-    modo_prototipo: bool = True,
-    tipo: str = "general"
+    modo_prototipo: Optional[bool] = None,
+    tipo: str = "general",
+    usuario: Optional[str] = None
 ) -> Tuple[bool, Optional[str]]:
     """
     Envía un mensaje de WhatsApp usando Twilio o simula el envío en modo prototipo
     
     Args:
         modo_prototipo: Si es True, simula el envío sin requerir credenciales
+            (por defecto según la configuración, ver es_modo_prototipo)
+        usuario: Usuario que realiza el envío (por defecto el de la sesión)
     
     Returns:
         Tuple[bool, Optional[str]]: (éxito, mensaje_error)
     """
-    # Modo prototipo: simular envío exitoso
-    if modo_prototipo:
-        # Simular delay de envío
-        import time
-        time.sleep(0.5)  # Simular latencia de red
-        
-        # Formatear número para el log (convertir a string primero)
-        destinatario_str = str(destinatario).strip()
-        if not destinatario_str.startswith("+"):
-            destinatario_log = f"+57{destinatario_str.lstrip('57')}"
-        else:
-            destinatario_log = destinatario_str
-        
-        # Log exitoso (simulado)
-        log_notificacion(
-            tipo=tipo,
-            canal="whatsapp",
-            destinatario=destinatario_log,
-            mensaje=mensaje,
-            estado="enviado",
-            id_cliente=id_cliente,
-            id_poliza=id_poliza
-        )
-        return True, None
-    
-    # Modo producción: envío real
-    if not TWILIO_AVAILABLE:
-        error_msg = "Twilio no está instalado. Instala con: pip install twilio"
-        log_notificacion(
-            tipo=tipo,
-            canal="whatsapp",
-            destinatario=destinatario,
-            mensaje=mensaje,
-            estado="fallido",
-            id_cliente=id_cliente,
-            id_poliza=id_poliza,
-            error=error_msg
-        )
-        return False, error_msg
+    if modo_prototipo is None:
+        modo_prototipo = es_modo_prototipo()
     
     try:
+        # Formatear número en E.164 (ej: +573001234567); uno inválido falla aquí, sin ir a Twilio
+        telefono = normalizar_telefono(destinatario)
+        if telefono is None:
+            raise ValueError(f"Teléfono inválido: {destinatario}")
+        destinatario = telefono
+        
+        # Modo prototipo: proveedor simulado (latencia, errores y límites configurables en [simulador.whatsapp])
+        if modo_prototipo:
+            simulador = obtener_simulador("whatsapp")
+            ejecutar_con_reintentos("whatsapp", lambda: simulador.enviar(destinatario))
+            
+            # Log exitoso (simulado)
+            log_notificacion(
+                tipo=tipo,
+                canal="whatsapp",
+                destinatario=destinatario,
+                mensaje=mensaje,
+                estado="enviado",
+                id_cliente=id_cliente,
+                id_poliza=id_poliza,
+                usuario=usuario
+            )
+            return True, None
+        
+        # Modo producción: envío real
         config = get_config_whatsapp()
         
         if not config["account_sid"] or not config["auth_token"] or not config["whatsapp_from"]:
@@ -291,24 +319,19 @@ def enviar_whatsapp(
                 estado="fallido",
                 id_cliente=id_cliente,
                 id_poliza=id_poliza,
-                error=error_msg
+                error=error_msg,
+                usuario=usuario
             )
             return False, error_msg
         
-        # Formatear número (debe incluir código de país, ej: +573001234567)
-        # Convertir a string primero por si viene como número
-        destinatario = str(destinatario).strip()
-        if not destinatario.startswith("+"):
-            # Asumir código de país colombiano si no está presente
-            destinatario = f"+57{destinatario.lstrip('57')}"
-        
-        # Enviar con Twilio
-        client = TwilioClient(config["account_sid"], config["auth_token"])
-        message = client.messages.create(
-            body=mensaje,
+        # Enviar con el cliente compartido (reutiliza conexiones entre mensajes); los errores
+        # transitorios se reintentan y con el circuito abierto el envío se reencola
+        cliente = obtener_cliente_twilio(config)
+        ejecutar_con_reintentos("whatsapp", lambda: cliente.enviar_mensaje(
             from_=config["whatsapp_from"],  # Formato: whatsapp:+14155238886
-            to=f"whatsapp:{destinatario}"
-        )
+            to=f"whatsapp:{destinatario}",
+            body=mensaje
+        ))
         
         # Log exitoso
         log_notificacion(
@@ -318,11 +341,15 @@ def enviar_whatsapp(
             mensaje=mensaje,
             estado="enviado",
             id_cliente=id_cliente,
-            id_poliza=id_poliza
+            id_poliza=id_poliza,
+            usuario=usuario
         )
         
         return True, None
         
+    except CircuitoAbierto:
+        # No se intentó el envío: no se registra como fallido, el llamador lo reencola
+        raise
     except Exception as e:
         error_msg = str(e)
         log_notificacion(
@@ -333,13 +360,24 @@ def enviar_whatsapp(
             estado="fallido",
             id_cliente=id_cliente,
             id_poliza=id_poliza,
-            error=error_msg
+            error=error_msg,
+            usuario=usuario
         )
         return False, error_msg
 
+def tiene_consentimiento(valor) -> bool:
+    """Convierte el valor de consentimiento de la sábana (sí/no, true/false, 1/0) a booleano"""
+    if pd.isna(valor):
+        return False
+    valor_str = str(valor).lower().strip()
+    return valor_str in VALORES_CONSENTIMIENTO
+
 def enviar_notificacion_cartera(
     row: pd.Series,
-    canal: str = "email"
+    canal: str = "email",
+    usuario: Optional[str] = None,
+    mensaje: Optional[str] = None,
+    asunto: Optional[str] = None
 ) -> Tuple[bool, Optional[str]]:
     """
     Envía notificación de cartera (mora) por el canal especificado
@@ -347,6 +385,9 @@ def enviar_notificacion_cartera(
     Args:
         row: Fila del DataFrame con información del cliente/póliza
         canal: 'email' o 'whatsapp'
+        usuario: Usuario que realiza el envío (por defecto el de la sesión)
+        mensaje: Texto ya construido (envíos masivos); si es None se construye para la fila
+        asunto: Asunto ya construido (solo email)
     
     Returns:
         Tuple[bool, Optional[str]]: (éxito, mensaje_error)
@@ -362,7 +403,8 @@ def enviar_notificacion_cartera(
                 estado="bloqueado",
                 id_cliente=str(row.get("id_cliente", "")),
                 id_poliza=str(row.get("numero_poliza", "")),
-                error="Sin consentimiento de email"
+                error="Sin consentimiento de email",
+                usuario=usuario
             )
             return False, "Cliente no tiene consentimiento para recibir emails"
         destinatario = row.get("email_cliente", "")
@@ -376,7 +418,8 @@ def enviar_notificacion_cartera(
                 estado="bloqueado",
                 id_cliente=str(row.get("id_cliente", "")),
                 id_poliza=str(row.get("numero_poliza", "")),
-                error="Sin consentimiento de WhatsApp"
+                error="Sin consentimiento de WhatsApp",
+                usuario=usuario
             )
             return False, "Cliente no tiene consentimiento para recibir WhatsApp"
         destinatario = row.get("telefono_cliente", "")
@@ -392,33 +435,26 @@ def enviar_notificacion_cartera(
             estado="fallido",
             id_cliente=str(row.get("id_cliente", "")),
             id_poliza=str(row.get("numero_poliza", "")),
-            error=error_msg
+            error=error_msg,
+            usuario=usuario
         )
         return False, error_msg
     
-    # Construir mensaje
-    nombre = row.get("nombre_cliente", "Cliente")
-    valor_mora = row.get("valor_en_mora", 0)
-    fecha_venc = row.get("fecha_venc_factura", "")
-    link_pago = row.get("link_pago", "")
-    
-    mensaje = (
-        f"Hola {nombre}, registramos un saldo en mora por ${valor_mora:,.0f}. "
-        f"Fecha límite: {fecha_venc}. "
-        f"Puedes pagar aquí: {link_pago}"
-    )
+    # Construir mensaje (los envíos masivos lo reciben ya construido para toda la campaña)
+    if mensaje is None:
+        texto = renderizar_mensajes(row.to_frame().T, "cartera", canal).iloc[0]
+        mensaje, asunto = texto["mensaje"], texto["asunto"]
     
-    # Enviar según canal (modo prototipo activado por defecto)
+    # Enviar según canal (simulado o real según el modo configurado)
     if canal == "email":
-        asunto = f"Recordatorio de pago - Póliza {row.get('numero_poliza', '')}"
         return enviar_email(
             destinatario=destinatario,
             asunto=asunto,
             mensaje=mensaje,
             id_cliente=str(row.get("id_cliente", "")),
             id_poliza=str(row.get("numero_poliza", "")),
-            modo_prototipo=True,  # Modo prototipo activado
-            tipo="cartera"  # Tipo correcto para cartera
+            tipo="cartera",  # Tipo correcto para cartera
+            usuario=usuario
         )
     else:  # whatsapp
         return enviar_whatsapp(
@@ -426,25 +462,57 @@ def enviar_notificacion_cartera(
             mensaje=mensaje,
             id_cliente=str(row.get("id_cliente", "")),
             id_poliza=str(row.get("numero_poliza", "")),
-            modo_prototipo=True,  # Modo prototipo activado
-            tipo="cartera"  # Tipo correcto para cartera
+            tipo="cartera",  # Tipo correcto para cartera
+            usuario=usuario
         )
 
-def enviar_notificaciones_cartera_masivo(
+def _mensaje_adicional(row: pd.Series) -> str:
+    """Texto de los objetivos fusionados en el mensaje de la fila (columna 'mensaje_adicional' del planificador)"""
+    adicional = row.get("mensaje_adicional")
+    return adicional if isinstance(adicional, str) else ""
+
+def _objetivos_cubiertos(row: pd.Series) -> List[Tuple[str, str]]:
+    """
+    (tipo, póliza) que el mensaje de la fila cubre además del suyo (columna 'cubiertos' del planificador)
+
+    Solo cuentan si el mensaje lleva su texto y la póliza es identificable.
+    """
+    cubiertos = row.get("cubiertos")
+    if not isinstance(cubiertos, str) or not cubiertos or not _mensaje_adicional(row):
+        return []
+    pares = [tuple(par.split(":", 1)) for par in cubiertos.split(", ") if ":" in par]
+    return [(tipo, poliza) for tipo, poliza in pares if IndiceEnvios.clave(poliza, tipo, "") is not None]
+
+def _enviar_masivo(
     df: pd.DataFrame,
-    canal: str = "email",
-    progress_callback: Optional[Callable[[int, int], None]] = None
+    tipo: str,
+    canal: str,
+    enviar_fila: Callable[..., Tuple[bool, Optional[str]]],
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    max_workers: Optional[int] = None,
+    usuario: Optional[str] = None,
+    progreso: Optional[FlujoProgreso] = None
 ) -> Dict[str, Any]:
     """
-    Envía notificaciones de cartera en bloque a múltiples clientes
-    
-    Args:
-        df: DataFrame con las filas de clientes a notificar
-        canal: 'email' o 'whatsapp'
-        progress_callback: Función opcional para actualizar progreso (recibe progreso, total)
-    
-    Returns:
-        Dict con estadísticas del envío masivo
+    Envío masivo común a cartera y renovaciones
+
+    Construye los mensajes de toda la campaña en una pasada, valida destinatario y
+    consentimiento de cada fila y despacha las filas válidas en paralelo con el motor
+    de despacho. Los teléfonos se normalizan a E.164 y los contactos mal formados se
+    reportan como 'contacto_invalido' sin llegar al proveedor. Con canal 'auto' cada fila va por su mejor canal permitido (el preferido
+    del cliente o, si no tiene consentimiento o contacto, el de respaldo) y las colas de
+    todos los canales se despachan en el mismo lote. Las pólizas ya notificadas en el
+    periodo (mismo tipo y canal) se omiten como 'duplicado'; las filas de un plan que fusiona
+    varios objetivos llevan al final del mensaje el texto de los demás ('mensaje_adicional'),
+    reservan también los 'cubiertos' y, si el mensaje sale, los registran como 'cubierto' en
+    el log para que no se notifiquen de nuevo. Si el circuito de un canal
+    se abre por una caída del proveedor sus filas restantes quedan como 'reencolado'
+    (con 'reintentar_en' segundos) sin esperar cada una su timeout. El detalle conserva
+    el orden del DataFrame e indica el canal de cada fila.
+
+    El avance se publica en 'progreso' (o en un flujo propio si no se pasa): cada resultado
+    solo actualiza contadores y los suscriptores, incluido progress_callback, reciben
+    instantáneas limitadas en frecuencia en lugar de una llamada por fila.
     """
     resultados = {
         "total": len(df),
@@ -452,167 +520,241 @@ def enviar_notificaciones_cartera_masivo(
         "fallidos": 0,
         "bloqueados": 0,
         "sin_destinatario": 0,
+        "invalidos": 0,
+        "duplicados": 0,
+        "reencolados": 0,
         "detalles": []
     }
     
-    # Función helper para convertir consentimiento a booleano
-    def tiene_consentimiento(valor):
-        if pd.isna(valor):
-            return False
-        valor_str = str(valor).lower().strip()
-        return valor_str in ["sí", "si", "yes", "true", "1", "1.0", "s", "y"]
+    # Teléfonos en E.164 y validez de cada contacto (ya viene calculada si la sábana se cargó validada)
+    df = validar_contactos(df)
+    
+    # El usuario se resuelve aquí: los hilos del despacho no tienen acceso a la sesión
+    usuario = usuario or st.session_state.get("user", "unknown")
     
     total = len(df)
-    for idx, (row_idx, row) in enumerate(df.iterrows(), 1):
-        # Actualizar progreso si hay callback
-        if progress_callback:
-            progress_callback(idx, total)
-        
-        # Validar consentimiento
-        if canal == "email":
-            tiene_consent = tiene_consentimiento(row.get("consentimiento_email"))
-            destinatario = row.get("email_cliente", "")
-        else:  # whatsapp
-            tiene_consent = tiene_consentimiento(row.get("consentimiento_whatsapp"))
-            destinatario = row.get("telefono_cliente", "")
+    detalles: List[Optional[Dict[str, Any]]] = [None] * total
+    pendientes: Dict[str, List[Tuple[int, pd.Series, Any]]] = {}
+    cubiertos: Dict[int, List[Tuple[str, str]]] = {}
+    progreso = progreso or FlujoProgreso(total)
+    if progress_callback:
+        progreso.suscribir(lambda instantanea: progress_callback(instantanea["procesados"], instantanea["total"]))
+    
+    # Canal de cada fila; con 'auto' las filas sin ningún canal habilitado se validan con su
+    # canal preferido (o el primero de respaldo) para informar el motivo
+    if canal == CANAL_AUTOMATICO:
+        asignado = asignar_canal(df)
+        respaldo = canal_preferido(df).replace("", CANALES[0])
+        canales = asignado.where(asignado != "", respaldo).to_numpy()
+        motivo_bloqueo = "Sin consentimiento en ningún canal"
+    else:
+        canales = np.full(total, canal, dtype=object)
+        motivo_bloqueo = f"Sin consentimiento de {canal}"
+    
+    # Mensajes de toda la campaña (una pasada por canal: las plantillas pueden variar por canal)
+    mensajes = np.empty(total, dtype=object)
+    asuntos = np.empty(total, dtype=object)
+    validos = np.zeros(total, dtype=bool)
+    for canal_fila in pd.unique(canales):
+        filas = canales == canal_fila
+        textos = renderizar_mensajes(df[filas], tipo, canal_fila)
+        mensajes[filas] = textos["mensaje"].to_numpy()
+        asuntos[filas] = textos["asunto"].to_numpy()
+        validos[filas] = contacto_valido(df[filas], CONTACTO_CANAL[canal_fila][0]).to_numpy()
+    # Filas de un plan: el mensaje incluye los objetivos fusionados
+    if "mensaje_adicional" in df.columns:
+        adicionales = df["mensaje_adicional"].where(df["mensaje_adicional"].notna(), "").astype(str).to_numpy()
+        con_adicional = adicionales != ""
+        mensajes[con_adicional] = mensajes[con_adicional] + "\n\n" + adicionales[con_adicional]
+    indice = obtener_indice_envios(NOTIFICACIONES_LOG)
+    
+    for posicion, (row_idx, row) in enumerate(df.iterrows()):
+        canal_fila = canales[posicion]
+        col_contacto, col_consentimiento = CONTACTO_CANAL[canal_fila]
+        tiene_consent = tiene_consentimiento(row.get(col_consentimiento))
+        destinatario = row.get(col_contacto, "")
         
         # Validar destinatario
         if not destinatario or pd.isna(destinatario):
             resultados["sin_destinatario"] += 1
-            resultados["detalles"].append({
+            detalles[posicion] = {
                 "id_poliza": str(row.get("numero_poliza", "")),
                 "nombre": row.get("nombre_cliente", ""),
+                "canal": canal_fila,
                 "estado": "sin_destinatario",
-                "error": f"No hay {canal} disponible"
-            })
+                "error": f"No hay {canal_fila} disponible"
+            }
+            progreso.registrar(detalles[posicion]["estado"])
             continue
         
         # Validar consentimiento
         if not tiene_consent:
             resultados["bloqueados"] += 1
-            resultados["detalles"].append({
+            detalles[posicion] = {
                 "id_poliza": str(row.get("numero_poliza", "")),
                 "nombre": row.get("nombre_cliente", ""),
+                "canal": canal_fila,
                 "estado": "bloqueado",
-                "error": f"Sin consentimiento de {canal}"
-            })
+                "error": motivo_bloqueo
+            }
+            progreso.registrar(detalles[posicion]["estado"])
             continue
         
-        # Enviar notificación
-        exito, error = enviar_notificacion_cartera(row, canal=canal)
+        # Excluir contactos mal formados (no se envían para fallar en el proveedor)
+        if not validos[posicion]:
+            resultados["invalidos"] += 1
+            detalles[posicion] = {
+                "id_poliza": str(row.get("numero_poliza", "")),
+                "nombre": row.get("nombre_cliente", ""),
+                "canal": canal_fila,
+                "estado": "contacto_invalido",
+                "destinatario": destinatario,
+                "error": f"{'Email' if canal_fila == 'email' else 'Teléfono'} inválido"
+            }
+            progreso.registrar(detalles[posicion]["estado"])
+            continue
         
-        if exito:
+        # Omitir pólizas ya notificadas en el periodo (la reserva evita duplicados entre envíos simultáneos)
+        if not indice.reservar(row.get("numero_poliza", ""), tipo, canal_fila):
+            resultados["duplicados"] += 1
+            detalles[posicion] = {
+                "id_poliza": str(row.get("numero_poliza", "")),
+                "nombre": row.get("nombre_cliente", ""),
+                "canal": canal_fila,
+                "estado": "duplicado",
+                "error": "Ya notificada en el periodo"
+            }
+            progreso.registrar(detalles[posicion]["estado"])
+            continue
+        
+        pendientes.setdefault(canal_fila, []).append((posicion, row, destinatario))
+        # Objetivos fusionados en este mensaje (los ya notificados o en envío por otra campaña no se tocan)
+        cubiertos[posicion] = [
+            (tipo_cubierto, poliza) for tipo_cubierto, poliza in _objetivos_cubiertos(row)
+            if indice.reservar(poliza, tipo_cubierto, canal_fila)
+        ]
+    
+    def enviar(item):
+        posicion, row, _ = item
+        try:
+            return enviar_fila(row, canal=canales[posicion], usuario=usuario, mensaje=mensajes[posicion], asunto=asuntos[posicion])
+        except CircuitoAbierto as e:
+            return False, e
+    
+    # Enviar notificaciones en paralelo: una cola por canal con su límite de tasa y circuit breaker
+    circuitos = {canal_cola: obtener_circuito(canal_cola) for canal_cola in pendientes}
+    for (posicion, row, destinatario), (exito, error) in despachar_por_canal(pendientes, enviar, max_workers, circuitos):
+        canal_fila = canales[posicion]
+        indice.confirmar(row.get("numero_poliza", ""), tipo, canal_fila, exito)
+        for tipo_cubierto, poliza in cubiertos.get(posicion, []):
+            indice.confirmar(poliza, tipo_cubierto, canal_fila, exito)
+            if exito:
+                log_notificacion(
+                    tipo=tipo_cubierto,
+                    canal=canal_fila,
+                    destinatario=destinatario,
+                    mensaje=f"Incluida en el mensaje de la póliza {row.get('numero_poliza', '')}",
+                    estado="cubierto",
+                    id_cliente=str(row.get("id_cliente", "")),
+                    id_poliza=poliza,
+                    usuario=usuario
+                )
+        if isinstance(error, CircuitoAbierto):
+            resultados["reencolados"] += 1
+            detalles[posicion] = {
+                "id_poliza": str(row.get("numero_poliza", "")),
+                "nombre": row.get("nombre_cliente", ""),
+                "canal": canal_fila,
+                "estado": "reencolado",
+                "error": str(error),
+                "reintentar_en": error.reintentar_en
+            }
+        elif exito:
             resultados["enviados"] += 1
-            resultados["detalles"].append({
+            detalles[posicion] = {
                 "id_poliza": str(row.get("numero_poliza", "")),
                 "nombre": row.get("nombre_cliente", ""),
+                "canal": canal_fila,
                 "estado": "enviado",
                 "destinatario": destinatario
-            })
+            }
         else:
             resultados["fallidos"] += 1
-            resultados["detalles"].append({
+            detalles[posicion] = {
                 "id_poliza": str(row.get("numero_poliza", "")),
                 "nombre": row.get("nombre_cliente", ""),
+                "canal": canal_fila,
                 "estado": "fallido",
                 "error": error or "Error desconocido"
-            })
+            }
+        progreso.registrar(detalles[posicion]["estado"])
     
+    # Fin de campaña: el log queda completo en disco antes de informar los resultados
+    obtener_escritor_log(NOTIFICACIONES_LOG).vaciar()
+    try:
+        obtener_indice_log(NOTIFICACIONES_LOG).actualizar()
+    except (OSError, sqlite3.Error):
+        pass  # El índice se pone al día en la próxima consulta
+    progreso.cerrar()
+    resultados["detalles"] = detalles
     return resultados
 
-def enviar_notificaciones_renovacion_masivo(
+def enviar_notificaciones_cartera_masivo(
     df: pd.DataFrame,
     canal: str = "email",
-    progress_callback: Optional[Callable[[int, int], None]] = None
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    max_workers: Optional[int] = None,
+    usuario: Optional[str] = None,
+    progreso: Optional[FlujoProgreso] = None
 ) -> Dict[str, Any]:
     """
-    Envía notificaciones de renovación en bloque a múltiples clientes
+    Envía notificaciones de cartera en bloque a múltiples clientes
     
     Args:
         df: DataFrame con las filas de clientes a notificar
-        canal: 'email' o 'whatsapp'
-        progress_callback: Función opcional para actualizar progreso (recibe progreso, total)
+        canal: 'email', 'whatsapp' o 'auto' (cada cliente por su mejor canal permitido)
+        progress_callback: Función opcional para actualizar progreso (recibe progreso, total;
+            se llama con la frecuencia limitada del flujo de progreso, no por cada fila)
+        max_workers: Envíos concurrentes (por defecto el configurado en [despacho])
+        usuario: Usuario que realiza el envío (por defecto el de la sesión)
+        progreso: Flujo de progreso al que suscribirse para seguir el avance (conteos y ETA)
     
     Returns:
         Dict con estadísticas del envío masivo
     """
-    resultados = {
-        "total": len(df),
-        "enviados": 0,
-        "fallidos": 0,
-        "bloqueados": 0,
-        "sin_destinatario": 0,
-        "detalles": []
-    }
-    
-    # Función helper para convertir consentimiento a booleano
-    def tiene_consentimiento(valor):
-        if pd.isna(valor):
-            return False
-        valor_str = str(valor).lower().strip()
-        return valor_str in ["sí", "si", "yes", "true", "1", "1.0", "s", "y"]
+    return _enviar_masivo(df, "cartera", canal, enviar_notificacion_cartera, progress_callback, max_workers, usuario, progreso)
+
+def enviar_notificaciones_renovacion_masivo(
+    df: pd.DataFrame,
+    canal: str = "email",
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    max_workers: Optional[int] = None,
+    usuario: Optional[str] = None,
+    progreso: Optional[FlujoProgreso] = None
+) -> Dict[str, Any]:
+    """
+    Envía notificaciones de renovación en bloque a múltiples clientes
     
-    total = len(df)
-    for idx, (row_idx, row) in enumerate(df.iterrows(), 1):
-        # Actualizar progreso si hay callback
-        if progress_callback:
-            progress_callback(idx, total)
-        
-        # Validar consentimiento
-        if canal == "email":
-            tiene_consent = tiene_consentimiento(row.get("consentimiento_email"))
-            destinatario = row.get("email_cliente", "")
-        else:  # whatsapp
-            tiene_consent = tiene_consentimiento(row.get("consentimiento_whatsapp"))
-            destinatario = row.get("telefono_cliente", "")
-        
-        # Validar destinatario
-        if not destinatario or pd.isna(destinatario):
-            resultados["sin_destinatario"] += 1
-            resultados["detalles"].append({
-                "id_poliza": str(row.get("numero_poliza", "")),
-                "nombre": row.get("nombre_cliente", ""),
-                "estado": "sin_destinatario",
-                "error": f"No hay {canal} disponible"
-            })
-            continue
-        
-        # Validar consentimiento
-        if not tiene_consent:
-            resultados["bloqueados"] += 1
-            resultados["detalles"].append({
-                "id_poliza": str(row.get("numero_poliza", "")),
-                "nombre": row.get("nombre_cliente", ""),
-                "estado": "bloqueado",
-                "error": f"Sin consentimiento de {canal}"
-            })
-            continue
-        
-        # Enviar notificación
-        exito, error = enviar_notificacion_renovacion(row, canal=canal)
-        
-        if exito:
-            resultados["enviados"] += 1
-            resultados["detalles"].append({
-                "id_poliza": str(row.get("numero_poliza", "")),
-                "nombre": row.get("nombre_cliente", ""),
-                "estado": "enviado",
-                "destinatario": destinatario
-            })
-        else:
-            resultados["fallidos"] += 1
-            resultados["detalles"].append({
-                "id_poliza": str(row.get("numero_poliza", "")),
-                "nombre": row.get("nombre_cliente", ""),
-                "estado": "fallido",
-                "error": error or "Error desconocido"
-            })
+    Args:
+        df: DataFrame con las filas de clientes a notificar
+        canal: 'email', 'whatsapp' o 'auto' (cada cliente por su mejor canal permitido)
+        progress_callback: Función opcional para actualizar progreso (recibe progreso, total;
+            se llama con la frecuencia limitada del flujo de progreso, no por cada fila)
+        max_workers: Envíos concurrentes (por defecto el configurado en [despacho])
+        usuario: Usuario que realiza el envío (por defecto el de la sesión)
+        progreso: Flujo de progreso al que suscribirse para seguir el avance (conteos y ETA)
     
-    return resultados
+    Returns:
+        Dict con estadísticas del envío masivo
+    """
+    return _enviar_masivo(df, "renovacion", canal, enviar_notificacion_renovacion, progress_callback, max_workers, usuario, progreso)
 
 def enviar_notificacion_renovacion(
     row: pd.Series,
-    canal: str = "email"
+    canal: str = "email",
+    usuario: Optional[str] = None,
+    mensaje: Optional[str] = None,
+    asunto: Optional[str] = None
 ) -> Tuple[bool, Optional[str]]:
     """
     Envía notificación de renovación por el canal especificado
@@ -620,17 +762,13 @@ def enviar_notificacion_renovacion(
     Args:
         row: Fila del DataFrame con información del cliente/póliza
         canal: 'email' o 'whatsapp'
+        usuario: Usuario que realiza el envío (por defecto el de la sesión)
+        mensaje: Texto ya construido (envíos masivos); si es None se construye para la fila
+        asunto: Asunto ya construido (solo email)
     
     Returns:
         Tuple[bool, Optional[str]]: (éxito, mensaje_error)
     """
-    # Función helper para convertir consentimiento a booleano
-    def tiene_consentimiento(valor):
-        if pd.isna(valor):
-            return False
-        valor_str = str(valor).lower().strip()
-        return valor_str in ["sí", "si", "yes", "true", "1", "1.0", "s", "y"]
-    
     # Validar consentimiento
     if canal == "email":
         if not tiene_consentimiento(row.get("consentimiento_email")):
@@ -642,7 +780,8 @@ def enviar_notificacion_renovacion(
                 estado="bloqueado",
                 id_cliente=str(row.get("id_cliente", "")),
                 id_poliza=str(row.get("numero_poliza", "")),
-                error="Sin consentimiento de email"
+                error="Sin consentimiento de email",
+                usuario=usuario
             )
             return False, "Cliente no tiene consentimiento para recibir emails"
         destinatario = row.get("email_cliente", "")
@@ -656,7 +795,8 @@ def enviar_notificacion_renovacion(
                 estado="bloqueado",
                 id_cliente=str(row.get("id_cliente", "")),
                 id_poliza=str(row.get("numero_poliza", "")),
-                error="Sin consentimiento de WhatsApp"
+                error="Sin consentimiento de WhatsApp",
+                usuario=usuario
             )
             return False, "Cliente no tiene consentimiento para recibir WhatsApp"
         destinatario = row.get("telefono_cliente", "")
@@ -672,53 +812,28 @@ def enviar_notificacion_renovacion(
             estado="fallido",
             id_cliente=str(row.get("id_cliente", "")),
             id_poliza=str(row.get("numero_poliza", "")),
-            error=error_msg
+            error=error_msg,
+            usuario=usuario
         )
         return False, error_msg
     
-    # Construir mensaje
-    nombre = row.get("nombre_cliente", "Cliente")
     num_poliza = row.get("numero_poliza", "")
-    producto = row.get("producto", "")
-    plan = row.get("plan", "")
-    fecha_fin = row.get("fecha_fin_vigencia", "")
-    dias_venc = int(row.get("dias_para_vencimiento", 0) or 0)
-    
-    # Validar días para vencimiento y ajustar mensaje
-    if dias_venc < 0:
-        msg_dias = f"Tu póliza venció hace {abs(dias_venc)} días"
-        msg_renovacion = "Es importante que gestionemos tu renovación lo antes posible."
-    elif dias_venc == 0:
-        msg_dias = "Tu póliza vence hoy"
-        msg_renovacion = "¿Deseas que gestionemos tu renovación?"
-    else:
-        msg_dias = f"Faltan {dias_venc} días"
-        msg_renovacion = "¿Deseas que gestionemos tu renovación?"
     
-    mensaje = (
-        f"Hola {nombre}, tu póliza {num_poliza} "
-        f"({producto} - {plan}) vence el {fecha_fin}. "
-        f"{msg_dias}. "
-        f"{msg_renovacion}"
-    )
+    # Construir mensaje (los envíos masivos lo reciben ya construido para toda la campaña)
+    if mensaje is None:
+        texto = renderizar_mensajes(row.to_frame().T, "renovacion", canal).iloc[0]
+        mensaje, asunto = texto["mensaje"], texto["asunto"]
     
-    # Enviar según canal (modo prototipo activado por defecto)
+    # Enviar según canal (simulado o real según el modo configurado)
     if canal == "email":
-        # Ajustar asunto según días
-        if dias_venc < 0:
-            asunto = f"⚠️ URGENTE: Renovación de póliza {num_poliza} - Vencida hace {abs(dias_venc)} días"
-        elif dias_venc == 0:
-            asunto = f"Renovación de póliza {num_poliza} - Vence hoy"
-        else:
-            asunto = f"Renovación de póliza {num_poliza} - Vence en {dias_venc} días"
         return enviar_email(
             destinatario=destinatario,
             asunto=asunto,
             mensaje=mensaje,
             id_cliente=str(row.get("id_cliente", "")),
             id_poliza=str(num_poliza),
-            modo_prototipo=True,  # Modo prototipo activado
-            tipo="renovacion"  # Tipo correcto para renovación
+            tipo="renovacion",  # Tipo correcto para renovación
+            usuario=usuario
         )
     else:  # whatsapp
         return enviar_whatsapp(
@@ -726,8 +841,8 @@ def enviar_notificacion_renovacion(
             mensaje=mensaje,
             id_cliente=str(row.get("id_cliente", "")),
             id_poliza=str(num_poliza),
-            modo_prototipo=True,  # Modo prototipo activado
-            tipo="renovacion"  # Tipo correcto para renovación
+            tipo="renovacion",  # Tipo correcto para renovación
+            usuario=usuario
         )
 
 def obtener_logs_notificaciones(limite: int = 100) -> pd.DataFrame:
@@ -740,27 +855,59 @@ def obtener_logs_notificaciones(limite: int = 100) -> pd.DataFrame:
     Returns:
         DataFrame con los logs
     """
-    if not os.path.exists(NOTIFICACIONES_LOG):
-        return pd.DataFrame()
+    # Incluir las entradas de este proceso que aún esperan en el lote del escritor
+    obtener_escritor_log(NOTIFICACIONES_LOG).vaciar()
     
-    logs = []
     try:
-        with open(NOTIFICACIONES_LOG, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-            # Tomar las últimas N líneas
-            for line in lines[-limite:]:
-                if line.strip():
-                    logs.append(json.loads(line))
+        # Solo se leen los bloques finales del segmento vivo que contienen las últimas N líneas
+        # (y, si no alcanzan, las particiones más recientes del histórico)
+        df = ultimas(NOTIFICACIONES_LOG, limite)
     except Exception as e:
         st.error(f"Error leyendo logs: {e}")
         return pd.DataFrame()
     
-    if not logs:
+    if df.empty:
         return pd.DataFrame()
     
-    df = pd.DataFrame(logs)
     if "timestamp" in df.columns:
-        df["timestamp"] = pd.to_datetime(df["timestamp"])
+        df["timestamp"] = pd.to_datetime(df["timestamp"], format="ISO8601")
         df = df.sort_values("timestamp", ascending=False)
     
     return df
+
+def consultar_logs_notificaciones(
+    filtros: Optional[Dict[str, Any]] = None,
+    desde=None,
+    hasta=None,
+    limite: int = 100
+) -> pd.DataFrame:
+    """
+    Últimos logs que cumplen los filtros, aplicados en el escaneo del log (solo se leen las
+    particiones del rango de fechas y las filas que coinciden, no una ventana fija de entradas)
+    
+    Args:
+        filtros: {columna: valor o lista de valores} sobre tipo, canal, estado, usuario, etc.
+        desde, hasta: Rango de fechas (inclusive)
+        limite: Número máximo de registros a retornar
+    
+    Returns:
+        DataFrame con los logs, el más reciente primero
+    """
+    obtener_escritor_log(NOTIFICACIONES_LOG).vaciar()
+    df = leer_log(NOTIFICACIONES_LOG, desde=desde, hasta=hasta, filtros=filtros, limite=limite)
+    return df.iloc[::-1].reset_index(drop=True)
+
+def obtener_historial_notificaciones(campo: str, valores) -> pd.DataFrame:
+    """
+    Historial completo de notificaciones de unos clientes o pólizas (todo el log, no solo
+    las últimas entradas), leído a través del índice por id_cliente/id_poliza
+    
+    Args:
+        campo: 'id_cliente' o 'id_poliza'
+        valores: Identificadores a buscar
+    
+    Returns:
+        DataFrame con los logs, el más reciente primero
+    """
+    obtener_escritor_log(NOTIFICACIONES_LOG).vaciar()
+    return obtener_indice_log(NOTIFICACIONES_LOG).buscar(campo, valores)
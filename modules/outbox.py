@@ -0,0 +1,470 @@
+"""
+Outbox durable de campañas (cola en SQLite)
+La UI encola la campaña de inmediato y un proceso aparte (worker_outbox.py) la despacha.
+Si el worker se cae, los mensajes en proceso se recuperan al vencer su lease y la campaña continúa.
+"""
+import os
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+from datetime import datetime
+from typing import Optional, Dict, List, Any
+import pandas as pd
+
+from modules.notificaciones import (
+    LOGS_DIR,
+    NOTIFICACIONES_LOG,
+    init_logs_dir,
+    enviar_notificaciones_cartera_masivo,
+    enviar_notificaciones_renovacion_masivo,
+)
+from modules.log_escritor import obtener_escritor_log
+from modules.mensajes import CAMPOS
+from modules.progreso import CONTADORES, FlujoProgreso
+from modules.plantillas import obtener_registro
+from modules.ventanas import aperturas_envio
+
+OUTBOX_DB = os.path.join(LOGS_DIR, "outbox.sqlite3")
+
+# Segundos que un worker puede retener un mensaje sin renovar el lease antes de que se
+# considere abandonado; mientras envía un lote lo renueva cada RENOVACION_LEASE segundos
+LEASE_SEGUNDOS = 300
+RENOVACION_LEASE = LEASE_SEGUNDOS / 5
+
+# Mensajes reclamados por lote
+TAMANO_LOTE = 200
+
+# Cada cuánto el worker publica el avance del lote en curso (la UI lo lee al recargar)
+INTERVALO_PROGRESO = 1.0  # segundos
+
+# Columnas de la fila que se guardan con cada mensaje (lo necesario para construir y enviar)
+COLUMNAS_PAYLOAD = [
+    "id_cliente", "id_poliza", "numero_poliza", "nombre_cliente", "documento_cliente",
+    "email_cliente", "telefono_cliente", "consentimiento_email", "consentimiento_whatsapp",
+    "valor_en_mora", "dias_mora", "fecha_venc_factura", "link_pago",
+    "producto", "plan", "fecha_fin_vigencia", "dias_para_vencimiento",
+    "segmento", "idioma_preferido", "canal_preferido_contacto", "horario_preferido_contacto",
+    "cubiertos",  # Objetivos fusionados por el planificador (ver planificador.encolar_plan)
+    "mensaje_adicional",  # Texto de esos objetivos, que se agrega al mensaje
+]
+
+ENVIOS_MASIVOS = {
+    "cartera": enviar_notificaciones_cartera_masivo,
+    "renovacion": enviar_notificaciones_renovacion_masivo,
+}
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS campanas (
+    id TEXT PRIMARY KEY,
+    tipo TEXT NOT NULL,
+    canal TEXT NOT NULL,
+    usuario TEXT,
+    creada TEXT NOT NULL,
+    total INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS mensajes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    campana_id TEXT NOT NULL REFERENCES campanas(id),
+    posicion INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    estado TEXT NOT NULL DEFAULT 'pendiente',
+    intentos INTEGER NOT NULL DEFAULT 0,
+    lease_hasta REAL,
+    lease_dueno TEXT,
+    disponible_desde REAL,
+    id_poliza TEXT,
+    nombre TEXT,
+    destinatario TEXT,
+    canal TEXT,
+    error TEXT,
+    actualizado TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_mensajes_estado ON mensajes(estado, id);
+CREATE INDEX IF NOT EXISTS idx_mensajes_campana ON mensajes(campana_id, estado);
+CREATE TABLE IF NOT EXISTS progreso (
+    lote TEXT PRIMARY KEY,
+    campana_id TEXT NOT NULL,
+    datos TEXT NOT NULL,
+    actualizado REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_progreso_campana ON progreso(campana_id);
+"""
+
+def conectar(path: Optional[str] = None) -> sqlite3.Connection:
+    """Abre la base del outbox (modo WAL para que UI y worker lean/escriban a la vez)"""
+    if path is None:
+        init_logs_dir()
+        path = OUTBOX_DB
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_ESQUEMA)
+    columnas = {fila["name"] for fila in conn.execute("PRAGMA table_info(mensajes)")}
+    if "disponible_desde" not in columnas:
+        # Bases creadas antes de los reintentos diferidos
+        conn.execute("ALTER TABLE mensajes ADD COLUMN disponible_desde REAL")
+    if "lease_dueno" not in columnas:
+        # Bases creadas antes de la renovación del lease
+        conn.execute("ALTER TABLE mensajes ADD COLUMN lease_dueno TEXT")
+    if "canal" not in columnas:
+        # Bases creadas antes de guardar el canal resuelto de cada mensaje (campañas 'auto')
+        conn.execute("ALTER TABLE mensajes ADD COLUMN canal TEXT")
+    indices = {fila["name"] for fila in conn.execute("PRAGMA index_list(mensajes)")}
+    if "idx_mensajes_liberacion" not in indices:
+        # Cola de temporizadores: los pendientes ordenados por el momento en que se liberan
+        # (las bases anteriores dejaban NULL en los mensajes que no tenían que esperar)
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("UPDATE mensajes SET disponible_desde = 0 WHERE disponible_desde IS NULL AND estado IN ('pendiente', 'procesando')")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_mensajes_liberacion ON mensajes(estado, disponible_desde, id)")
+        conn.execute("COMMIT")
+    return conn
+
+def _serializar_filas(df: pd.DataFrame, tipo: str) -> List[str]:
+    """
+    Serializa las filas a JSON conservando el formato de texto de las fechas
+    (str(Timestamp), igual al que se ve en los mensajes construidos directamente)
+
+    Además de COLUMNAS_PAYLOAD se guardan las columnas de la sábana que usen las plantillas.
+    """
+    extra = sorted(obtener_registro().campos_usados(tipo) - set(CAMPOS) - set(COLUMNAS_PAYLOAD))
+    cols = [c for c in COLUMNAS_PAYLOAD + extra if c in df.columns]
+    datos = df[cols].copy()
+    for c in cols:
+        if pd.api.types.is_datetime64_any_dtype(datos[c]):
+            datos[c] = datos[c].map(str)
+    if len(datos) == 0:
+        return []
+    return datos.to_json(orient="records", lines=True, force_ascii=False).strip().split("\n")
+
+def encolar_campana(
+    df: pd.DataFrame,
+    tipo: str,
+    canal: str,
+    usuario: Optional[str] = None,
+    path: Optional[str] = None,
+    respetar_horario: bool = False
+) -> str:
+    """
+    Encola una campaña completa en el outbox (operación inmediata, no envía nada)
+
+    Args:
+        df: Filas de clientes a notificar
+        tipo: 'cartera' o 'renovacion'
+        canal: 'email', 'whatsapp' o 'auto' (canal preferido de cada cliente con respaldo)
+        usuario: Usuario que solicita el envío
+        path: Ruta alternativa de la base (opcional)
+        respetar_horario: Si es True cada mensaje queda programado para la franja del
+            horario preferido de contacto del cliente (ver modules.ventanas); si no, se
+            libera de inmediato
+
+    Returns:
+        ID de la campaña
+    """
+    if tipo not in ENVIOS_MASIVOS:
+        raise ValueError(f"Tipo de campaña no soportado: {tipo}")
+    campana_id = uuid.uuid4().hex[:12]
+    payloads = _serializar_filas(df, tipo)
+    polizas = df["numero_poliza"].astype(str).tolist() if "numero_poliza" in df.columns else [None] * len(df)
+    nombres = df["nombre_cliente"].astype(str).tolist() if "nombre_cliente" in df.columns else [None] * len(df)
+    liberacion = aperturas_envio(df) if respetar_horario else [time.time()] * len(df)
+    ahora = datetime.now().isoformat()
+    with closing(conectar(path)) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "INSERT INTO campanas (id, tipo, canal, usuario, creada, total) VALUES (?, ?, ?, ?, ?, ?)",
+            (campana_id, tipo, canal, usuario, ahora, len(payloads))
+        )
+        conn.executemany(
+            "INSERT INTO mensajes (campana_id, posicion, payload, disponible_desde, id_poliza, nombre, actualizado) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(campana_id, i, p, float(liberacion[i]), polizas[i], nombres[i], ahora) for i, p in enumerate(payloads)]
+        )
+        conn.execute("COMMIT")
+    return campana_id
+
+def recuperar_abandonados(path: Optional[str] = None) -> int:
+    """
+    Devuelve a 'pendiente' los mensajes cuyo lease venció (worker caído a mitad de lote)
+
+    Returns:
+        Número de mensajes recuperados
+    """
+    with closing(conectar(path)) as conn:
+        cur = conn.execute(
+            "UPDATE mensajes SET estado = 'pendiente', lease_hasta = NULL, lease_dueno = NULL "
+            "WHERE estado = 'procesando' AND lease_hasta < ?",
+            (time.time(),)
+        )
+        return cur.rowcount
+
+def reclamar_lote(limite: int = TAMANO_LOTE, path: Optional[str] = None, dueno: Optional[str] = None) -> List[sqlite3.Row]:
+    """
+    Reclama mensajes pendientes para este worker (los marca 'procesando' con lease)
+
+    Solo se reclaman los mensajes cuya hora de liberación ya pasó, en ese orden; el índice
+    por (estado, disponible_desde) hace que los programados para más tarde no se recorran.
+
+    Args:
+        dueno: Identificador del lote que retiene el lease (para renovarlo y registrar
+            los resultados solo si sigue siendo suyo)
+
+    Returns:
+        Filas reclamadas junto con los datos de su campaña
+    """
+    with closing(conectar(path)) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        filas = conn.execute(
+            "SELECT m.id, m.campana_id, m.payload, c.tipo, c.canal, c.usuario "
+            "FROM mensajes m JOIN campanas c ON c.id = m.campana_id "
+            "WHERE m.estado = 'pendiente' AND m.disponible_desde <= ? "
+            "ORDER BY m.disponible_desde, m.id LIMIT ?",
+            (time.time(), limite)
+        ).fetchall()
+        if filas:
+            conn.executemany(
+                "UPDATE mensajes SET estado = 'procesando', lease_hasta = ?, lease_dueno = ?, intentos = intentos + 1 WHERE id = ?",
+                [(time.time() + LEASE_SEGUNDOS, dueno, f["id"]) for f in filas]
+            )
+        conn.execute("COMMIT")
+    return filas
+
+def renovar_lease(dueno: str, path: Optional[str] = None) -> int:
+    """
+    Extiende el lease de los mensajes que el lote aún retiene (heartbeat)
+
+    Returns:
+        Número de mensajes renovados
+    """
+    with closing(conectar(path)) as conn:
+        cur = conn.execute(
+            "UPDATE mensajes SET lease_hasta = ? WHERE lease_dueno = ? AND estado = 'procesando'",
+            (time.time() + LEASE_SEGUNDOS, dueno)
+        )
+        return cur.rowcount
+
+def _mantener_lease(dueno: str, path: Optional[str], detener: threading.Event):
+    """Hilo del lote en curso: renueva el lease hasta que el lote termina"""
+    while not detener.wait(RENOVACION_LEASE):
+        try:
+            renovar_lease(dueno, path)
+        except sqlite3.Error:
+            pass  # Base ocupada: se reintenta en la próxima renovación, antes de que venza el lease
+
+def registrar_resultados(
+    resultados: List[Dict[str, Any]],
+    path: Optional[str] = None,
+    lote: Optional[str] = None,
+    dueno: Optional[str] = None
+):
+    """
+    Guarda el resultado de cada mensaje
+
+    Los mensajes 'reencolado' (circuito del canal abierto) vuelven a 'pendiente' y no
+    se reclaman de nuevo hasta pasados sus 'reintentar_en' segundos.
+
+    Args:
+        resultados: Lista de dicts con 'id' del mensaje y el detalle del envío masivo
+        lote: Lote cuyo avance publicado se descarta en la misma transacción (sus
+            resultados pasan a contarse desde los mensajes)
+        dueno: Si se indica, solo se actualizan los mensajes cuyo lease sigue siendo suyo
+    """
+    ahora = datetime.now().isoformat()
+    filas = []
+    for r in resultados:
+        estado, disponible_desde = r.get("estado", "fallido"), None
+        if estado == "reencolado":
+            estado, disponible_desde = "pendiente", time.time() + float(r.get("reintentar_en") or 0)
+        filas.append((
+            estado, disponible_desde, r.get("id_poliza"), r.get("nombre"),
+            None if r.get("destinatario") is None else str(r.get("destinatario")),
+            r.get("canal"), r.get("error"), ahora, r["id"], dueno, dueno
+        ))
+    with closing(conectar(path)) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            "UPDATE mensajes SET estado = ?, lease_hasta = NULL, lease_dueno = NULL, disponible_desde = ?, id_poliza = ?, "
+            "nombre = ?, destinatario = ?, canal = COALESCE(?, canal), error = ?, actualizado = ? "
+            "WHERE id = ? AND (? IS NULL OR lease_dueno = ?)",
+            filas
+        )
+        if lote is not None:
+            conn.execute("DELETE FROM progreso WHERE lote = ?", (lote,))
+        conn.execute("COMMIT")
+
+def _publicar_progreso(conn: sqlite3.Connection, lote: str, campana_id: str, instantanea: Dict[str, Any]):
+    """Guarda la última instantánea del lote en curso"""
+    conn.execute(
+        "INSERT INTO progreso (lote, campana_id, datos, actualizado) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(lote) DO UPDATE SET datos = excluded.datos, actualizado = excluded.actualizado",
+        (lote, campana_id, json.dumps(instantanea), time.time())
+    )
+
+def procesar_lote(limite: int = TAMANO_LOTE, path: Optional[str] = None) -> int:
+    """
+    Reclama un lote de mensajes y los envía con el motor de envío masivo
+
+    Mientras se envía, el avance de cada campaña del lote (conteos, tasa y ETA) se publica
+    en la tabla progreso cada INTERVALO_PROGRESO segundos, sin esperar al final del lote, y
+    un hilo renueva el lease de los mensajes reclamados cada RENOVACION_LEASE segundos.
+
+    Returns:
+        Número de mensajes procesados
+    """
+    dueno = uuid.uuid4().hex
+    filas = reclamar_lote(limite, path, dueno=dueno)
+    if not filas:
+        return 0
+
+    # Heartbeat: un lote lento (timeouts, backoff, pausas del proveedor) no pierde su lease
+    # ante otro worker, que volvería a enviar sus mensajes
+    detener = threading.Event()
+    renovador = threading.Thread(target=_mantener_lease, args=(dueno, path, detener), name="lease-outbox", daemon=True)
+    renovador.start()
+    try:
+        _enviar_lote(filas, dueno, path)
+    finally:
+        detener.set()
+        renovador.join()
+    return len(filas)
+
+def _enviar_lote(filas: List[sqlite3.Row], dueno: str, path: Optional[str]):
+    """Envía las filas reclamadas, agrupadas por campaña, y registra sus resultados"""
+
+    # Agrupar por campaña (tipo, canal y usuario son propios de cada campaña)
+    grupos: Dict[str, List[sqlite3.Row]] = {}
+    for fila in filas:
+        grupos.setdefault(fila["campana_id"], []).append(fila)
+
+    with closing(conectar(path)) as conn:
+        for campana_id, campana_filas in grupos.items():
+            primera = campana_filas[0]
+            df = pd.DataFrame([json.loads(f["payload"]) for f in campana_filas])
+            lote = uuid.uuid4().hex
+            progreso = FlujoProgreso(len(campana_filas), intervalo=INTERVALO_PROGRESO)
+            progreso.suscribir(lambda instantanea, lote=lote, campana_id=campana_id: _publicar_progreso(conn, lote, campana_id, instantanea))
+            resultados = ENVIOS_MASIVOS[primera["tipo"]](
+                df, canal=primera["canal"], usuario=primera["usuario"], progreso=progreso
+            )
+            # Un mensaje queda 'enviado' en el outbox solo con su entrada del log ya escrita:
+            # el log es lo que consulta la deduplicación al reiniciar
+            obtener_escritor_log(NOTIFICACIONES_LOG).vaciar()
+            registrar_resultados(
+                [dict(detalle, id=f["id"]) for f, detalle in zip(campana_filas, resultados["detalles"])],
+                path,
+                lote=lote,
+                dueno=dueno
+            )
+
+def proxima_liberacion(path: Optional[str] = None) -> Optional[float]:
+    """Momento (epoch) en que se libera el próximo mensaje programado, o None si no hay"""
+    with closing(conectar(path)) as conn:
+        fila = conn.execute(
+            "SELECT MIN(disponible_desde) FROM mensajes WHERE estado = 'pendiente' AND disponible_desde > ?",
+            (time.time(),)
+        ).fetchone()
+    return fila[0]
+
+def estado_campana(campana_id: str, path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Estado de avance de una campaña
+
+    Incluye el avance publicado por los workers para los lotes que aún están enviando:
+    'procesados' los suma, 'en_curso' trae sus conteos acumulados (enviados, fallidos...)
+    y 'tasa' (mensajes/s) y 'eta' (segundos para los mensajes ya liberados) se estiman
+    con ellos.
+
+    Returns:
+        Dict con datos de la campaña, conteo por estado y mensajes programados para una
+        franja posterior (con la próxima liberación), o None si no existe
+    """
+    with closing(conectar(path)) as conn:
+        campana = conn.execute("SELECT * FROM campanas WHERE id = ?", (campana_id,)).fetchone()
+        if campana is None:
+            return None
+        conteos = dict(conn.execute(
+            "SELECT estado, COUNT(*) FROM mensajes WHERE campana_id = ? GROUP BY estado", (campana_id,)
+        ).fetchall())
+        programados, proxima = conn.execute(
+            "SELECT COUNT(*), MIN(disponible_desde) FROM mensajes "
+            "WHERE campana_id = ? AND estado = 'pendiente' AND disponible_desde > ?",
+            (campana_id, time.time())
+        ).fetchone()
+        # Lotes en curso (se ignoran los de un worker caído: su lease ya venció)
+        lotes = [json.loads(fila["datos"]) for fila in conn.execute(
+            "SELECT datos FROM progreso WHERE campana_id = ? AND actualizado > ?",
+            (campana_id, time.time() - LEASE_SEGUNDOS)
+        )]
+    pendientes = conteos.get("pendiente", 0) + conteos.get("procesando", 0)
+    en_curso = {clave: sum(lote[clave] for lote in lotes) for clave in CONTADORES.values()}
+    # Los reencolados vuelven a la cola: no cuentan como procesados
+    en_curso["procesados"] = sum(lote["procesados"] for lote in lotes) - en_curso["reencolados"]
+    tasa = sum(lote["tasa"] for lote in lotes if not lote["terminado"])
+    por_enviar = max(0, pendientes - programados - en_curso["procesados"])
+    return {
+        **dict(campana),
+        "conteos": conteos,
+        "pendientes": pendientes,
+        "programados": programados,
+        "proxima_liberacion": datetime.fromtimestamp(proxima) if proxima else None,
+        "procesados": campana["total"] - pendientes + en_curso["procesados"],
+        "en_curso": en_curso,
+        "tasa": tasa,
+        "eta": por_enviar / tasa if tasa > 0 else None,
+        "terminada": pendientes == 0,
+    }
+
+def resultados_campana(campana_id: str, path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Resultados de la campaña con la misma estructura que retornan los envíos masivos
+
+    El detalle trae el canal por el que salió cada mensaje (en campañas 'auto' puede variar
+    por fila); es None para los mensajes que aún no se procesan. Los mensajes que volvieron
+    a la cola por un corte del canal figuran como 'reencolado' hasta su próximo intento.
+    """
+    with closing(conectar(path)) as conn:
+        filas = conn.execute(
+            "SELECT estado, id_poliza, nombre, destinatario, canal, error FROM mensajes "
+            "WHERE campana_id = ? ORDER BY posicion", (campana_id,)
+        ).fetchall()
+    resultados = {
+        "total": len(filas),
+        "enviados": 0,
+        "fallidos": 0,
+        "bloqueados": 0,
+        "sin_destinatario": 0,
+        "invalidos": 0,
+        "duplicados": 0,
+        "reencolados": 0,
+        "detalles": []
+    }
+    claves = {
+        "enviado": "enviados", "fallido": "fallidos", "bloqueado": "bloqueados",
+        "sin_destinatario": "sin_destinatario", "contacto_invalido": "invalidos", "duplicado": "duplicados",
+        "reencolado": "reencolados",
+    }
+    for fila in filas:
+        estado = fila["estado"]
+        # Un pendiente con error volvió a la cola tras abrirse el circuito de su canal
+        if estado == "pendiente" and fila["error"]:
+            estado = "reencolado"
+        if estado in claves:
+            resultados[claves[estado]] += 1
+        detalle = {"id_poliza": fila["id_poliza"], "nombre": fila["nombre"], "canal": fila["canal"], "estado": estado}
+        if fila["destinatario"]:
+            detalle["destinatario"] = fila["destinatario"]
+        if fila["error"]:
+            detalle["error"] = fila["error"]
+        resultados["detalles"].append(detalle)
+    return resultados
+
+def ultima_campana(tipo: str, path: Optional[str] = None) -> Optional[str]:
+    """ID de la campaña más reciente del tipo dado (para retomar el seguimiento tras cerrar la pestaña)"""
+    with closing(conectar(path)) as conn:
+        fila = conn.execute(
+            "SELECT id FROM campanas WHERE tipo = ? ORDER BY creada DESC LIMIT 1", (tipo,)
+        ).fetchone()
+    return fila["id"] if fila else None
@@ -0,0 +1,283 @@
+"""
+Planificador de campañas en una sola pasada
+Evalúa todas las reglas de campaña (segmentos de mora y ventanas de renovación) de forma
+vectorizada sobre la sábana, fusiona los objetivos que se solapan por cliente y canal y
+produce un único plan de envío sin duplicados, con la atribución de cada regla
+"""
+from typing import Callable, Dict, List, Optional, Any
+import numpy as np
+import pandas as pd
+
+from modules.kpis import SEGMENTOS_MORA, VENTANAS_RENOVACION, mascara_renovable, mascara_segmento_mora
+from modules.enrutamiento import CANAL_AUTOMATICO, asignar_canal, contacto_habilitado
+from modules.mensajes import renderizar_mensajes
+from modules.outbox import encolar_campana
+
+def _regla_mora(segmento: str) -> Callable[[pd.DataFrame], pd.Series]:
+    return lambda df: mascara_segmento_mora(df, segmento)
+
+def _regla_renovacion(limite: int) -> Callable[[pd.DataFrame], pd.Series]:
+    return lambda df: (df["dias_para_vencimiento"].fillna(9999) <= limite) & mascara_renovable(df)
+
+# Reglas de campaña en orden de prioridad: si un cliente cumple varias en el mismo canal,
+# recibe un solo mensaje del tipo de la primera (la mora más grave antes que la renovación)
+REGLAS: Dict[str, Dict[str, Any]] = {
+    **{
+        f"cartera {segmento}": {"tipo": "cartera", "mascara": _regla_mora(segmento)}
+        for segmento in reversed(list(SEGMENTOS_MORA))
+    },
+    **{
+        f"renovacion {ventana}": {"tipo": "renovacion", "mascara": _regla_renovacion(limite)}
+        for ventana, limite in sorted(VENTANAS_RENOVACION.items(), key=lambda v: v[1])
+    },
+}
+
+# Reglas activas por defecto: todos los segmentos de mora y la ventana de renovación más amplia
+REGLAS_POR_DEFECTO = [r for r in REGLAS if REGLAS[r]["tipo"] == "cartera"] + [
+    f"renovacion {max(VENTANAS_RENOVACION, key=VENTANAS_RENOVACION.get)}"
+]
+
+COLUMNAS_PLAN = [
+    "cliente", "canal", "tipo", "regla", "reglas", "polizas", "objetivos", "cubiertos", "mensaje_adicional",
+    "fila", "numero_poliza", "nombre_cliente", "destinatario",
+]
+
+def evaluar_reglas(df: pd.DataFrame, reglas: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Evalúa las reglas sobre todas las filas
+
+    Returns:
+        DataFrame booleano alineado con df con una columna por regla (en orden de prioridad)
+    """
+    reglas = [r for r in REGLAS if r in set(reglas)] if reglas is not None else list(REGLAS)
+    return pd.DataFrame(
+        {regla: REGLAS[regla]["mascara"](df).to_numpy(dtype=bool) for regla in reglas},
+        index=df.index, columns=reglas
+    )
+
+def _clave_cliente(df: pd.DataFrame) -> pd.Series:
+    """Identificador del cliente (id_cliente, o la póliza si no hay id)"""
+    poliza = df["numero_poliza"].astype(str) if "numero_poliza" in df.columns else pd.Series(df.index.astype(str), index=df.index)
+    if "id_cliente" not in df.columns:
+        return poliza
+    return df["id_cliente"].astype(str).where(df["id_cliente"].notna(), poliza)
+
+def _numero(df: pd.DataFrame, col: str, defecto: float) -> np.ndarray:
+    """Columna numérica como arreglo (faltantes o no numéricos como 'defecto')"""
+    if col not in df.columns:
+        return np.full(len(df), defecto, dtype=float)
+    return pd.to_numeric(df[col], errors="coerce").fillna(defecto).to_numpy(dtype=float)
+
+def _unir_reglas(matriz: np.ndarray, nombres: List[str]) -> np.ndarray:
+    """Nombres de las reglas marcadas en cada fila de la matriz, separados por ' | '"""
+    texto = np.full(len(matriz), "", dtype=object)
+    for k, nombre in enumerate(nombres):
+        texto = texto + np.where(matriz[:, k], nombre + " | ", "")
+    return np.array([t[:-3] for t in texto], dtype=object)
+
+def _objetivos_por_tipo(matriz: np.ndarray, nombres: List[str], grupo: np.ndarray, poliza: np.ndarray) -> pd.DataFrame:
+    """
+    Pares (póliza, tipo) distintos de cada mensaje, es decir, los mensajes que habrían enviado
+    las campañas por separado (las ventanas de renovación se anidan: una póliza que cumple
+    varias reglas del mismo tipo es un solo objetivo)
+
+    Returns:
+        DataFrame con grupo, tipo, poliza y objetivo (fila de 'matriz' de la que sale el par)
+    """
+    pares = []
+    for tipo in dict.fromkeys(REGLAS[r]["tipo"] for r in nombres):
+        columnas = [k for k, r in enumerate(nombres) if REGLAS[r]["tipo"] == tipo]
+        objetivo = np.flatnonzero(matriz[:, columnas].any(axis=1))
+        pares.append(pd.DataFrame({"grupo": grupo[objetivo], "tipo": tipo, "poliza": poliza[objetivo], "objetivo": objetivo}))
+    if not pares:
+        return pd.DataFrame(columns=["grupo", "tipo", "poliza", "objetivo"])
+    pares = pd.concat(pares, ignore_index=True).drop_duplicates(["grupo", "tipo", "poliza"])
+    return pares.sort_values(["grupo", "objetivo"], kind="stable", ignore_index=True)
+
+def _mensajes_adicionales(df: pd.DataFrame, pares: pd.DataFrame, canal: np.ndarray) -> pd.Series:
+    """
+    Texto de cada objetivo fusionado, con la plantilla de su tipo y el canal de su mensaje
+
+    Se construye al planificar porque el envío solo lleva la fila principal: el mensaje
+    final es el de la fila principal seguido de estos textos.
+    """
+    textos = pd.Series("", index=pares.index, dtype=object)
+    for (tipo, canal_par), bloque in pares.groupby([pares["tipo"], canal], sort=False):
+        mensajes = renderizar_mensajes(df.iloc[bloque["posicion"].to_numpy()], tipo, canal_par)
+        textos[bloque.index] = mensajes["mensaje"].to_numpy()
+    return textos
+
+def _unir_por_grupo(grupo: np.ndarray, valores: np.ndarray, total: int, separador: str = ", ") -> np.ndarray:
+    """
+    Une con 'separador' los valores distintos de cada grupo (filas ordenadas por grupo)
+
+    Itera sobre la posición dentro del grupo, no sobre los grupos: tantas pasadas
+    vectorizadas como valores tenga el grupo más grande.
+    """
+    distintos = ~pd.DataFrame({"grupo": grupo, "valor": valores}).duplicated().to_numpy()
+    grupo, valores = grupo[distintos], valores[distintos]
+    rango = pd.Series(grupo).groupby(grupo).cumcount().to_numpy()
+    texto = np.full(total, "", dtype=object)
+    for k in range(int(rango.max()) + 1 if len(rango) else 0):
+        fila = rango == k
+        texto[grupo[fila]] = texto[grupo[fila]] + ("" if k == 0 else separador) + valores[fila]
+    return texto
+
+def planificar_campanas(
+    df: pd.DataFrame,
+    canales: List[str],
+    reglas: Optional[List[str]] = None
+) -> pd.DataFrame:
+    """
+    Construye el plan de envío de todas las campañas en una pasada
+
+    Las filas que cumplen alguna regla y tienen contacto habilitado en el canal son
+    objetivos; los objetivos del mismo cliente y canal (varias pólizas, o mora y
+    renovación a la vez) se fusionan en un solo mensaje. El mensaje usa la póliza y el
+    tipo de la regla de mayor prioridad (y, dentro de ella, la más urgente), seguido del
+    texto de cada uno de los demás objetivos fusionados.
+
+    Args:
+        df: Sábana de clientes/pólizas
+        canales: Canales a planificar ('email', 'whatsapp', o 'auto' para enviar a cada
+            cliente por su canal preferido o, si no está habilitado, el de respaldo)
+        reglas: Reglas activas (por defecto todas)
+
+    Returns:
+        DataFrame con una fila por (cliente, canal) y columnas COLUMNAS_PLAN:
+        regla (la que define el mensaje), reglas (todas las que aportaron objetivos),
+        polizas (pólizas cubiertas), objetivos (pares póliza-tipo distintos fusionados, es
+        decir, los mensajes que habrían enviado las campañas por separado), cubiertos (pares
+        'tipo:póliza' fusionados distintos del principal, que se marcan como notificados
+        al enviar el mensaje), mensaje_adicional (texto de esos pares, que se agrega al
+        mensaje principal) y fila (índice en df de la fila con que se construye el mensaje)
+    """
+    cumple = evaluar_reglas(df, reglas)
+    nombres = list(cumple.columns)
+    matriz = cumple.to_numpy()
+    en_alguna = matriz.any(axis=1) if nombres else np.zeros(len(df), dtype=bool)
+    prioridad = matriz.argmax(axis=1) if nombres else np.zeros(len(df), dtype=np.int64)
+    cliente = _clave_cliente(df).to_numpy()
+    poliza = df["numero_poliza"].astype(str).to_numpy() if "numero_poliza" in df.columns else df.index.astype(str).to_numpy()
+    # Urgencia dentro de la misma regla: más días de mora, menos días para vencer
+    urgencia_mora = -_numero(df, "dias_mora", 0)
+    urgencia_venc = _numero(df, "dias_para_vencimiento", 9999)
+
+    objetivos = []
+    for canal in canales:
+        if canal == CANAL_AUTOMATICO:
+            # Cada fila por su mejor canal permitido: un solo mensaje por cliente y canal asignado
+            asignado = asignar_canal(df).to_numpy()
+            posiciones = np.flatnonzero(en_alguna & (asignado != ""))
+            canal_objetivo = asignado[posiciones]
+        else:
+            posiciones = np.flatnonzero(en_alguna & contacto_habilitado(df, canal).to_numpy())
+            canal_objetivo = canal
+        objetivos.append(pd.DataFrame({
+            "posicion": posiciones,
+            "cliente": cliente[posiciones],
+            "canal": canal_objetivo,
+            "prioridad": prioridad[posiciones],
+            "urgencia_mora": urgencia_mora[posiciones],
+            "urgencia_venc": urgencia_venc[posiciones],
+        }))
+    objetivos = pd.concat(objetivos, ignore_index=True) if objetivos else pd.DataFrame()
+    if objetivos.empty:
+        return pd.DataFrame(columns=COLUMNAS_PLAN)
+
+    # Ordenados por (cliente, canal) cada mensaje es un bloque contiguo que empieza en su fila principal
+    objetivos = objetivos.sort_values(["cliente", "canal", "prioridad", "urgencia_mora", "urgencia_venc", "posicion"], kind="stable")
+    es_principal = ~objetivos.duplicated(["cliente", "canal"]).to_numpy()
+    inicios = np.flatnonzero(es_principal)
+    grupo = np.cumsum(es_principal) - 1
+    principal = objetivos.iloc[inicios]
+
+    # Atribución: reglas y pólizas de todas las filas fusionadas en cada mensaje
+    posiciones_objetivos = objetivos["posicion"].to_numpy()
+    atribucion = np.logical_or.reduceat(matriz[posiciones_objetivos], inicios, axis=0)
+    pares = _objetivos_por_tipo(matriz[posiciones_objetivos], nombres, grupo, poliza[posiciones_objetivos])
+    cantidad_objetivos = np.bincount(pares["grupo"].to_numpy(dtype=np.int64), minlength=len(inicios))
+    polizas = _unir_por_grupo(grupo, poliza[posiciones_objetivos], len(inicios))
+
+    posiciones = principal["posicion"].to_numpy()
+    canal_principal = principal["canal"].to_numpy()
+    destinatario = np.where(
+        canal_principal == "email",
+        df["email_cliente"].to_numpy()[posiciones] if "email_cliente" in df.columns else None,
+        df["telefono_cliente"].to_numpy()[posiciones] if "telefono_cliente" in df.columns else None,
+    )
+    reglas_principal = np.array(nombres, dtype=object)[principal["prioridad"].to_numpy()]
+    tipo_principal = pd.Series(reglas_principal).map({r: REGLAS[r]["tipo"] for r in nombres}).to_numpy()
+
+    # Objetivos fusionados distintos del principal: su texto se agrega al mensaje y, al enviarse,
+    # quedan como notificados; el principal ya es el contenido del mensaje
+    grupo_par = pares["grupo"].to_numpy(dtype=np.int64)
+    es_principal_par = (pares["poliza"].to_numpy() == poliza[posiciones][grupo_par]) & (pares["tipo"].to_numpy() == tipo_principal[grupo_par])
+    fusionados = pares[~es_principal_par].assign(posicion=lambda p: posiciones_objetivos[p["objetivo"].to_numpy()])
+    grupo_fusionado = fusionados["grupo"].to_numpy(dtype=np.int64)
+    adicionales = _mensajes_adicionales(df, fusionados, canal_principal[grupo_fusionado])
+    cubiertos = _unir_por_grupo(grupo_fusionado, (fusionados["tipo"] + ":" + fusionados["poliza"]).to_numpy(dtype=object), len(inicios))
+    mensaje_adicional = _unir_por_grupo(grupo_fusionado, adicionales.to_numpy(dtype=object), len(inicios), separador="\n\n")
+    plan = pd.DataFrame({
+        "cliente": principal["cliente"].to_numpy(),
+        "canal": canal_principal,
+        "tipo": tipo_principal,
+        "regla": reglas_principal,
+        "reglas": _unir_reglas(atribucion, nombres),
+        "polizas": polizas,
+        "objetivos": cantidad_objetivos,
+        "cubiertos": cubiertos,
+        "mensaje_adicional": mensaje_adicional,
+        "fila": df.index.to_numpy()[posiciones],
+        "numero_poliza": poliza[posiciones],
+        "nombre_cliente": df["nombre_cliente"].to_numpy()[posiciones] if "nombre_cliente" in df.columns else None,
+        "destinatario": destinatario,
+    })
+    return plan[COLUMNAS_PLAN]
+
+def resumen_plan(plan: pd.DataFrame, reglas: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Atribución del plan por regla
+
+    Returns:
+        DataFrame con, por regla: mensajes a los que aporta objetivos ('atribuidos') y
+        mensajes cuyo contenido define ('principal')
+    """
+    nombres = [r for r in REGLAS if reglas is None or r in set(reglas)]
+    reglas_plan = plan["reglas"].astype(str).str.split(" | ", regex=False)
+    atribuidos = reglas_plan.explode().value_counts()
+    principal = plan["regla"].value_counts()
+    return pd.DataFrame({
+        "regla": nombres,
+        "tipo": [REGLAS[r]["tipo"] for r in nombres],
+        "atribuidos": [int(atribuidos.get(r, 0)) for r in nombres],
+        "principal": [int(principal.get(r, 0)) for r in nombres],
+    })
+
+def encolar_plan(
+    df: pd.DataFrame,
+    plan: pd.DataFrame,
+    usuario: Optional[str] = None,
+    respetar_horario: bool = False
+) -> List[str]:
+    """
+    Encola el plan en el outbox: una campaña por tipo y canal con las filas principales
+
+    Cada fila lleva el texto de los objetivos fusionados ('mensaje_adicional') y sus pares
+    'cubiertos': al enviar el mensaje también quedan como notificados en el índice de
+    idempotencia, así una campaña por separado no vuelve a notificar las pólizas fusionadas. Con respetar_horario cada mensaje se programa para la
+    franja preferida del cliente.
+
+    Returns:
+        IDs de las campañas encoladas
+    """
+    campanas = []
+    for (tipo, canal), grupo in plan.groupby(["tipo", "canal"], sort=False):
+        filas = df.loc[grupo["fila"]].assign(
+            cubiertos=grupo["cubiertos"].to_numpy(),
+            mensaje_adicional=grupo["mensaje_adicional"].to_numpy(),
+        )
+        campanas.append(encolar_campana(
+            filas, tipo=tipo, canal=canal, usuario=usuario, respetar_horario=respetar_horario
+        ))
+    return campanas
@@ -0,0 +1,169 @@
+"""
+Registro de plantillas de mensajes (editable sin cambios de código)
+Las plantillas se leen de plantillas_mensajes.json, se compilan una sola vez por versión del
+archivo y se eligen por fila según canal, idioma, producto, segmento y segmento de mora
+"""
+import json
+import threading
+from string import Formatter
+from typing import Dict, Any, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from modules.kpis import version_dataset
+
+PLANTILLAS_PATH = "plantillas_mensajes.json"
+
+# Criterios con los que una plantilla puede restringir las filas a las que aplica
+CRITERIOS = ["canal", "idioma", "producto", "segmento", "segmento_mora", "vencimiento"]
+
+# Estados de vencimiento para el criterio 'vencimiento'
+VENCIMIENTOS = ["vencida", "hoy", "futura"]
+
+Partes = List[Tuple[str, Optional[str]]]
+
+def compilar_texto(texto: str, id_plantilla: str) -> Partes:
+    """
+    Descompone un texto con campos {campo} en partes (literal, campo)
+
+    Los campos llegan ya formateados (moneda, fechas), por eso no se admiten
+    especificadores de formato ni conversiones.
+    """
+    partes = []
+    try:
+        for literal, campo, formato, conversion in Formatter().parse(texto):
+            if campo is not None and (formato or conversion or not campo.isidentifier()):
+                raise ValueError(f"campo inválido '{{{campo}}}'")
+            partes.append((literal, campo))
+    except ValueError as e:
+        raise ValueError(f"Plantilla '{id_plantilla}': {e}") from e
+    return partes
+
+def _normalizar(valor: Any) -> str:
+    return str(valor).strip().lower()
+
+class Plantilla:
+    """Plantilla compilada: criterios de selección y textos descompuestos en partes"""
+
+    def __init__(self, definicion: Dict[str, Any], posicion: int):
+        self.id = str(definicion.get("id") or f"plantilla_{posicion}")
+        if "mensaje" not in definicion:
+            raise ValueError(f"Plantilla '{self.id}': falta el texto 'mensaje'")
+        desconocidas = set(definicion) - set(CRITERIOS) - {"id", "asunto", "mensaje"}
+        if desconocidas:
+            raise ValueError(f"Plantilla '{self.id}': claves desconocidas {sorted(desconocidas)}")
+
+        self.criterios: Dict[str, List[str]] = {}
+        for criterio in CRITERIOS:
+            if criterio in definicion:
+                valores = definicion[criterio]
+                valores = valores if isinstance(valores, list) else [valores]
+                self.criterios[criterio] = [_normalizar(v) for v in valores]
+        self.especificidad = len(self.criterios)
+        self.asunto = compilar_texto(definicion.get("asunto", ""), self.id)
+        self.mensaje = compilar_texto(definicion["mensaje"], self.id)
+
+    def campos(self) -> set:
+        return {c for _, c in self.asunto + self.mensaje if c}
+
+class RegistroPlantillas:
+    """
+    Plantillas compiladas por tipo de mensaje ('cartera', 'renovacion')
+
+    Para cada fila se usa la plantilla más específica (más criterios) cuyos criterios
+    se cumplen; a igual especificidad gana la que aparece primero en el archivo.
+    Cada tipo debe tener una plantilla sin criterios que sirva de respaldo.
+    """
+
+    def __init__(self, definiciones: Dict[str, List[Dict[str, Any]]]):
+        self.plantillas: Dict[str, List[Plantilla]] = {}
+        for tipo, lista in definiciones.items():
+            plantillas = [Plantilla(d, i) for i, d in enumerate(lista)]
+            if not any(p.especificidad == 0 for p in plantillas):
+                raise ValueError(f"Las plantillas de '{tipo}' necesitan una plantilla sin criterios (respaldo)")
+            self.plantillas[tipo] = plantillas
+
+    def campos_usados(self, tipo: str) -> set:
+        """Campos que aparecen en alguna plantilla del tipo"""
+        if tipo not in self.plantillas:
+            raise ValueError(f"No hay plantillas para el tipo de mensaje: {tipo}")
+        return set().union(*(p.campos() for p in self.plantillas[tipo]))
+
+    def seleccionar(self, tipo: str, atributos: pd.DataFrame) -> np.ndarray:
+        """
+        Índice de la plantilla que corresponde a cada fila
+
+        Args:
+            tipo: Tipo de mensaje
+            atributos: Valores normalizados de los criterios por fila (columnas de CRITERIOS)
+        """
+        plantillas = self.plantillas[tipo]
+        total = len(plantillas)
+        puntajes = np.full((len(atributos), total), -1, dtype=np.int64)
+        for k, plantilla in enumerate(plantillas):
+            cumple = np.ones(len(atributos), dtype=bool)
+            for criterio, valores in plantilla.criterios.items():
+                cumple &= atributos[criterio].isin(valores).to_numpy()
+            puntajes[cumple, k] = plantilla.especificidad * (total + 1) + (total - k)
+        return puntajes.argmax(axis=1)
+
+    def renderizar(self, tipo: str, campos: Dict[str, pd.Series], atributos: pd.DataFrame) -> pd.DataFrame:
+        """
+        Sustituye los campos en bloque: cada plantilla se aplica de una vez a todas sus filas
+
+        Args:
+            tipo: Tipo de mensaje
+            campos: Textos ya formateados por campo, alineados con 'atributos'
+            atributos: Valores normalizados de los criterios por fila
+
+        Returns:
+            DataFrame con columnas asunto, mensaje, plantilla (id de la plantilla usada)
+        """
+        if tipo not in self.plantillas:
+            raise ValueError(f"No hay plantillas para el tipo de mensaje: {tipo}")
+        plantillas = self.plantillas[tipo]
+        eleccion = self.seleccionar(tipo, atributos)
+        resultado = pd.DataFrame(
+            {"asunto": "", "mensaje": "", "plantilla": ""}, index=atributos.index, dtype=object
+        )
+        for k in np.unique(eleccion):
+            plantilla = plantillas[k]
+            faltantes = plantilla.campos() - set(campos)
+            if faltantes:
+                raise ValueError(f"Plantilla '{plantilla.id}': campos no disponibles {sorted(faltantes)}")
+            filas = eleccion == k
+            indice = atributos.index[filas]
+            for columna, partes in (("asunto", plantilla.asunto), ("mensaje", plantilla.mensaje)):
+                texto = pd.Series("", index=indice, dtype=object)
+                for literal, campo in partes:
+                    texto = texto + literal
+                    if campo:
+                        texto = texto + campos[campo][filas].to_numpy()
+                resultado.loc[filas, columna] = texto.to_numpy()
+            resultado.loc[filas, "plantilla"] = plantilla.id
+        return resultado
+
+def cargar_registro(path: str = PLANTILLAS_PATH) -> RegistroPlantillas:
+    """Lee y compila el archivo de plantillas"""
+    with open(path, "r", encoding="utf-8") as f:
+        definiciones = json.load(f)
+    return RegistroPlantillas(definiciones)
+
+# Registro compilado por ruta, junto con la versión del archivo con que se compiló
+_registros: Dict[str, Tuple[str, RegistroPlantillas]] = {}
+_registros_lock = threading.Lock()
+
+def obtener_registro(path: str = PLANTILLAS_PATH) -> RegistroPlantillas:
+    """
+    Registro compilado de plantillas
+
+    Se recompila solo cuando el archivo cambia, de modo que las plantillas nuevas se
+    aplican sin reiniciar la aplicación ni el worker.
+    """
+    version = version_dataset(path)
+    with _registros_lock:
+        guardado = _registros.get(path)
+        if guardado is None or guardado[0] != version:
+            guardado = (version, cargar_registro(path))
+            _registros[path] = guardado
+        return guardado[1]
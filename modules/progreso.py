@@ -0,0 +1,130 @@
+"""
+Flujo de eventos de progreso de los envíos masivos
+Acumula el resultado de cada destinatario y publica instantáneas limitadas en frecuencia
+(cada cierto intervalo o cada N registros) con los conteos acumulados, la tasa y el tiempo
+restante estimado, para que la UI o el worker sigan el avance sin frenar el despacho
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+# Cada cuánto se publica una instantánea (la última siempre se publica al cerrar)
+INTERVALO_POR_DEFECTO = 0.5   # segundos
+
+# Estado de cada destinatario -> contador de la instantánea (los mismos del resumen del envío masivo)
+CONTADORES = {
+    "enviado": "enviados",
+    "fallido": "fallidos",
+    "bloqueado": "bloqueados",
+    "sin_destinatario": "sin_destinatario",
+    "contacto_invalido": "invalidos",
+    "duplicado": "duplicados",
+    "reencolado": "reencolados",
+}
+
+Suscriptor = Callable[[Dict[str, Any]], None]
+
+class FlujoProgreso:
+    """
+    Acumulador thread-safe del avance de un envío con publicación limitada
+
+    Registrar un resultado solo actualiza contadores; los suscriptores reciben una
+    instantánea cuando pasa 'intervalo' segundos o se acumulan 'cada' registros desde la
+    anterior, y siempre al cerrar. Así un suscriptor lento (redibujar la UI, escribir en
+    la base) se ejecuta unas pocas veces por segundo y no una vez por destinatario.
+
+    Args:
+        total: Destinatarios del envío
+        intervalo: Segundos mínimos entre instantáneas (0 = sin límite por tiempo)
+        cada: Registros que fuerzan una instantánea aunque no haya pasado el intervalo
+    """
+
+    def __init__(self, total: int, intervalo: float = INTERVALO_POR_DEFECTO, cada: Optional[int] = None):
+        self.total = total
+        self.intervalo = intervalo
+        self.cada = cada
+        self._conteos = dict.fromkeys(CONTADORES.values(), 0)
+        self._procesados = 0
+        self._inicio = time.monotonic()
+        self._ultima_publicacion = self._inicio
+        self._desde_ultima = 0
+        self._cerrado = False
+        self._suscriptores: List[Suscriptor] = []
+        self._ultima: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+
+    def suscribir(self, suscriptor: Suscriptor) -> Callable[[], None]:
+        """Agrega un suscriptor de instantáneas; retorna la función para cancelar la suscripción"""
+        with self._lock:
+            self._suscriptores.append(suscriptor)
+        return lambda: self._cancelar(suscriptor)
+
+    def _cancelar(self, suscriptor: Suscriptor):
+        with self._lock:
+            if suscriptor in self._suscriptores:
+                self._suscriptores.remove(suscriptor)
+
+    def registrar(self, estado: str, cantidad: int = 1):
+        """Registra el resultado de 'cantidad' destinatarios y publica si corresponde"""
+        with self._lock:
+            clave = CONTADORES.get(estado)
+            if clave:
+                self._conteos[clave] += cantidad
+            self._procesados += cantidad
+            self._desde_ultima += cantidad
+            ahora = time.monotonic()
+            publicar = (
+                (self.cada is not None and self._desde_ultima >= self.cada)
+                or ahora - self._ultima_publicacion >= self.intervalo
+            )
+            instantanea = self._tomar(ahora) if publicar else None
+        if instantanea is not None:
+            self._publicar(instantanea)
+
+    def cerrar(self) -> Dict[str, Any]:
+        """Publica la instantánea final (una sola vez) y la retorna"""
+        with self._lock:
+            if self._cerrado:
+                return self._ultima
+            self._cerrado = True
+            instantanea = self._tomar(time.monotonic())
+        self._publicar(instantanea)
+        return instantanea
+
+    def instantanea(self) -> Dict[str, Any]:
+        """Estado actual sin esperar a la próxima publicación"""
+        with self._lock:
+            return self._instantanea(time.monotonic())
+
+    def ultima(self) -> Optional[Dict[str, Any]]:
+        """Última instantánea publicada (para lectores que consultan en lugar de suscribirse)"""
+        with self._lock:
+            return self._ultima
+
+    def _tomar(self, ahora: float) -> Dict[str, Any]:
+        """Instantánea a publicar (con el lock tomado): reinicia la ventana de limitación"""
+        self._ultima_publicacion = ahora
+        self._desde_ultima = 0
+        self._ultima = self._instantanea(ahora)
+        return self._ultima
+
+    def _instantanea(self, ahora: float) -> Dict[str, Any]:
+        transcurrido = ahora - self._inicio
+        tasa = self._procesados / transcurrido if transcurrido > 0 else 0.0
+        restantes = max(0, self.total - self._procesados)
+        return {
+            "total": self.total,
+            "procesados": self._procesados,
+            **self._conteos,
+            "transcurrido": transcurrido,
+            "tasa": tasa,
+            "eta": restantes / tasa if tasa > 0 else None,
+            "terminado": self._cerrado,
+        }
+
+    def _publicar(self, instantanea: Dict[str, Any]):
+        # Fuera del lock: un suscriptor lento no bloquea a los hilos que registran
+        with self._lock:
+            suscriptores = list(self._suscriptores)
+        for suscriptor in suscriptores:
+            suscriptor(instantanea)
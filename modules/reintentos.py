@@ -0,0 +1,179 @@
+"""
+Reintentos con backoff exponencial y circuit breaker por canal
+Los errores transitorios del proveedor (SMTP / Twilio) se reintentan con espera creciente y
+aleatoria; si un canal acumula fallos seguidos, el circuito se abre y los envíos restantes
+fallan de inmediato para reencolarse en lugar de esperar cada uno su timeout. Es la única capa
+de reintentos: el cliente de Twilio y el pool SMTP hacen un solo intento por mensaje, así cada
+llamada fallida al proveedor cuenta una vez en el circuito
+"""
+import random
+import smtplib
+import threading
+import time
+from typing import Callable, Dict, TypeVar
+
+from modules.despacho import (
+    get_config_despacho,
+    UMBRAL_CIRCUITO_POR_DEFECTO,
+    ENFRIAMIENTO_CIRCUITO_POR_DEFECTO,
+)
+from modules.smtp_pool import es_error_de_conexion
+from modules.twilio_cliente import ErrorTwilio
+
+# Espera entre reintentos (la cantidad de reintentos y el circuito se configuran en [despacho])
+ESPERA_BASE_SEGUNDOS = 0.5
+ESPERA_MAXIMA_SEGUNDOS = 10.0
+
+T = TypeVar("T")
+
+class CircuitoAbierto(Exception):
+    """El canal está en corte: el envío no se intentó y debe reencolarse"""
+
+    def __init__(self, canal: str, reintentar_en: float):
+        self.canal = canal
+        self.reintentar_en = reintentar_en
+        super().__init__(f"Canal {canal} en pausa por fallos del proveedor; se reintentará en {reintentar_en:.0f} s")
+
+def es_transitorio(error: Exception) -> bool:
+    """
+    Indica si el error puede resolverse reintentando (caída, timeout, cuota, 4xx de SMTP)
+
+    Los errores propios del mensaje (destinatario inválido, autenticación) no son transitorios.
+    """
+    if isinstance(error, ErrorTwilio):
+        return error.status == 429 or error.status >= 500
+    if isinstance(error, smtplib.SMTPResponseException) and 400 <= error.smtp_code < 500:
+        return True
+    return es_error_de_conexion(error)
+
+def espera_backoff(intento: int, base: float = ESPERA_BASE_SEGUNDOS, maximo: float = ESPERA_MAXIMA_SEGUNDOS) -> float:
+    """Backoff exponencial con jitter completo: aleatorio entre 0 y base * 2^intento (acotado)"""
+    return random.uniform(0, min(maximo, base * (2 ** intento)))
+
+class Circuito:
+    """
+    Circuit breaker thread-safe de un canal
+
+    - cerrado: los envíos pasan; 'umbral' fallos transitorios seguidos lo abren
+    - abierto: los envíos fallan de inmediato durante 'enfriamiento' segundos
+    - semiabierto: pasado el enfriamiento se deja pasar un envío de prueba; si funciona
+      el circuito se cierra y si falla vuelve a abrirse
+    """
+
+    def __init__(self, canal: str, umbral: int = UMBRAL_CIRCUITO_POR_DEFECTO, enfriamiento: float = ENFRIAMIENTO_CIRCUITO_POR_DEFECTO):
+        self.canal = canal
+        self.umbral = umbral
+        self.enfriamiento = enfriamiento
+        self.fallos_seguidos = 0
+        self.abierto_hasta = 0.0
+        self._prueba_en_curso = False
+        self._lock = threading.Lock()
+
+    def abierto(self) -> bool:
+        """Indica si el circuito está abierto (sin reservar el envío de prueba)"""
+        with self._lock:
+            return self.fallos_seguidos >= self.umbral and (
+                time.monotonic() < self.abierto_hasta or self._prueba_en_curso
+            )
+
+    def permitir(self):
+        """
+        Autoriza un envío
+
+        Raises:
+            CircuitoAbierto: Si el canal está en corte
+        """
+        with self._lock:
+            if self.fallos_seguidos < self.umbral:
+                return
+            restante = self.abierto_hasta - time.monotonic()
+            if restante > 0 or self._prueba_en_curso:
+                raise CircuitoAbierto(self.canal, max(restante, 0.0))
+            self._prueba_en_curso = True
+
+    def registrar_exito(self):
+        with self._lock:
+            self.fallos_seguidos = 0
+            self._prueba_en_curso = False
+
+    def registrar_fallo(self):
+        with self._lock:
+            self.fallos_seguidos += 1
+            self._prueba_en_curso = False
+            if self.fallos_seguidos >= self.umbral:
+                self.abierto_hasta = time.monotonic() + self.enfriamiento
+
+    def pausar(self, segundos: float):
+        """Abre el circuito al menos 'segundos' (el proveedor pidió esperar con Retry-After)"""
+        with self._lock:
+            self.fallos_seguidos = max(self.fallos_seguidos, self.umbral)
+            self.abierto_hasta = max(self.abierto_hasta, time.monotonic() + segundos)
+            self._prueba_en_curso = False
+
+    def liberar(self):
+        """Cierra un envío que terminó con un error no transitorio (no cuenta como fallo del canal)"""
+        with self._lock:
+            self._prueba_en_curso = False
+
+# Un circuito por canal y por proceso, compartido entre campañas simultáneas
+_circuitos: Dict[str, Circuito] = {}
+_circuitos_lock = threading.Lock()
+
+def obtener_circuito(canal: str) -> Circuito:
+    """Circuit breaker compartido del canal ('email' o 'whatsapp')"""
+    config = get_config_despacho()
+    umbral, enfriamiento = config["umbral_circuito"], config["enfriamiento_circuito"]
+    with _circuitos_lock:
+        circuito = _circuitos.get(canal)
+        if circuito is None:
+            circuito = Circuito(canal, umbral, enfriamiento)
+            _circuitos[canal] = circuito
+        else:
+            circuito.umbral, circuito.enfriamiento = umbral, enfriamiento
+        return circuito
+
+def ejecutar_con_reintentos(canal: str, operacion: Callable[[], T]) -> T:
+    """
+    Ejecuta una operación de envío con reintentos y circuit breaker del canal
+
+    Cada llamada fallida al proveedor se registra en el circuito. La espera entre intentos
+    es el backoff o el Retry-After del proveedor si es mayor; un Retry-After más largo que
+    ESPERA_MAXIMA_SEGUNDOS pausa el canal completo por ese tiempo y el envío se reencola
+    (en lugar de dejar al hilo dormido).
+
+    Args:
+        canal: 'email' o 'whatsapp'
+        operacion: Función sin argumentos que realiza el envío
+
+    Returns:
+        Resultado de la operación
+
+    Raises:
+        CircuitoAbierto: Si el canal está (o queda) en corte; el envío debe reencolarse
+        Exception: El último error si no es transitorio o se agotan los reintentos
+    """
+    circuito = obtener_circuito(canal)
+    reintentos = get_config_despacho()["reintentos"]
+    intento = 0
+    while True:
+        circuito.permitir()
+        try:
+            resultado = operacion()
+        except Exception as e:
+            if not es_transitorio(e):
+                circuito.liberar()
+                raise
+            circuito.registrar_fallo()
+            reintentar_en = getattr(e, "reintentar_en", None) or 0.0
+            if reintentar_en > ESPERA_MAXIMA_SEGUNDOS:
+                circuito.pausar(reintentar_en)
+                raise CircuitoAbierto(canal, reintentar_en) from e
+            if intento >= reintentos:
+                raise
+            # Si este fallo abrió el circuito, reencolar ya en lugar de esperar para nada
+            circuito.permitir()
+            time.sleep(max(espera_backoff(intento), reintentar_en))
+            intento += 1
+            continue
+        circuito.registrar_exito()
+        return resultado
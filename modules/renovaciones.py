@@ -1,6 +1,9 @@
 import streamlit as st
 import pandas as pd
-from modules.notificaciones import enviar_notificacion_renovacion, enviar_notificaciones_renovacion_masivo
+from modules.outbox import encolar_campana, estado_campana, resultados_campana, ultima_campana
+from modules.mensajes import renderizar_mensajes
+from modules.enrutamiento import CANAL_AUTOMATICO, asignar_canal, contacto_habilitado, contacto_invalido
+from modules.ventanas import resumen_ventanas
 
 def render(df: pd.DataFrame):
     st.title("♻️ Renovaciones")
@@ -33,44 +36,36 @@ def render(df: pd.DataFrame):
         return
 
     # Seleccionar canal
-    canal = st.selectbox("Canal de notificación", ["Email", "WhatsApp"])
-    canal_lower = canal.lower()
-
-    # Función helper para convertir consentimiento a booleano
-    def tiene_consentimiento(valor):
-        if pd.isna(valor):
-            return False
-        valor_str = str(valor).lower().strip()
-        return valor_str in ["sí", "si", "yes", "true", "1", "1.0", "s", "y"]
-    
-    # Filtrar por consentimiento y disponibilidad de contacto
-    if canal == "Email":
-        view_filtrado = view[
-            (view["consentimiento_email"].apply(tiene_consentimiento)) &
-            (view["email_cliente"].notna()) &
-            (view["email_cliente"] != "")
-        ].copy()
-    else:  # WhatsApp
-        view_filtrado = view[
-            (view["consentimiento_whatsapp"].apply(tiene_consentimiento)) &
-            (view["telefono_cliente"].notna()) &
-            (view["telefono_cliente"] != "")
-        ].copy()
-
-    # Identificar clientes sin consentimiento en ningún canal
-    view_sin_consentimiento = view[
-        ~(
-            (view["consentimiento_email"].apply(tiene_consentimiento) & view["email_cliente"].notna() & (view["email_cliente"] != "")) |
-            (view["consentimiento_whatsapp"].apply(tiene_consentimiento) & view["telefono_cliente"].notna() & (view["telefono_cliente"] != ""))
-        )
-    ].copy()
+    canal = st.selectbox("Canal de notificación", ["Email", "WhatsApp", "Automático (preferido → alternativo)"])
+    canal_lower = CANAL_AUTOMATICO if canal.startswith("Automático") else canal.lower()
+
+    # Filtrar por consentimiento y disponibilidad de contacto (vectorizado)
+    habilitado_email = contacto_habilitado(view, "email")
+    habilitado_whatsapp = contacto_habilitado(view, "whatsapp")
+    invalido_email = contacto_invalido(view, "email")
+    invalido_whatsapp = contacto_invalido(view, "whatsapp")
+    if canal_lower == CANAL_AUTOMATICO:
+        # Cada cliente por su canal preferido o, si no está habilitado, el de respaldo
+        canal_asignado = asignar_canal(view)
+        view_filtrado = view[canal_asignado != ""].copy()
+        invalidos = (canal_asignado == "") & (invalido_email | invalido_whatsapp)
+    else:
+        view_filtrado = view[habilitado_email if canal == "Email" else habilitado_whatsapp].copy()
+        invalidos = invalido_email if canal == "Email" else invalido_whatsapp
+
+    # Contactos autorizados pero mal formados (email sin dominio, teléfono no convertible a E.164)
+    view_invalidos = view[invalidos].copy()
+
+    # Identificar clientes sin consentimiento en ningún canal (los de contacto inválido se reportan aparte)
+    view_sin_consentimiento = view[~(habilitado_email | habilitado_whatsapp | invalido_email | invalido_whatsapp)].copy()
     
     # Estadísticas previas
-    col1, col2, col3, col4 = st.columns(4)
+    col1, col2, col3, col4, col5 = st.columns(5)
     col1.metric("Total en ventana", len(view))
-    col2.metric("Con consentimiento", len(view_filtrado))
-    col3.metric("Sin consentimiento", len(view) - len(view_filtrado))
-    col4.metric("Listos para enviar", len(view_filtrado))
+    col2.metric("Con consentimiento", len(view_filtrado) + len(view_invalidos))
+    col3.metric("Sin consentimiento", len(view) - len(view_filtrado) - len(view_invalidos))
+    col4.metric("Contacto inválido", len(view_invalidos))
+    col5.metric("Listos para enviar", len(view_filtrado))
 
     # Mostrar tabla de clientes sin consentimiento en ningún canal
     if len(view_sin_consentimiento) > 0:
@@ -90,6 +85,22 @@ def render(df: pd.DataFrame):
             hide_index=True
         )
 
+    # Mostrar tabla de contactos inválidos (se excluyen del envío)
+    if len(view_invalidos) > 0:
+        st.divider()
+        st.subheader("🚫 Contactos Inválidos")
+        st.info(f"{len(view_invalidos)} cliente(s) autorizados tienen el email o el teléfono mal formado y no se incluirán en el envío.")
+        
+        cols_invalidos = [c for c in ["numero_poliza", "nombre_cliente", "documento_cliente",
+                                      "email_cliente", "email_valido", "telefono_cliente", "telefono_valido"]
+                          if c in view_invalidos.columns]
+        st.dataframe(
+            view_invalidos[cols_invalidos],
+            use_container_width=True,
+            height=min(300, len(view_invalidos) * 35 + 50),
+            hide_index=True
+        )
+
     if len(view_filtrado) == 0:
         st.warning("⚠️ No hay clientes con consentimiento y contacto disponible para este canal.")
         st.info("💡 Asegúrate de que los clientes tengan consentimiento y contacto configurado.")
@@ -97,75 +108,86 @@ def render(df: pd.DataFrame):
 
     # Vista previa de mensajes personalizados
     with st.expander("👁️ Vista previa de mensajes personalizados (primeros 3)"):
-        for idx, row in view_filtrado.head(3).iterrows():
-            nombre = row.get("nombre_cliente", "Cliente")
-            num_poliza = row.get("numero_poliza", "")
-            producto = row.get("producto", "")
-            plan = row.get("plan", "")
-            fecha_fin = row.get("fecha_fin_vigencia", "")
-            dias_venc = int(row.get("dias_para_vencimiento", 0) or 0)
-            destinatario = row.get("email_cliente", "") if canal == "Email" else row.get("telefono_cliente", "")
-
-            # Validar días para vencimiento y ajustar mensaje
-            if dias_venc < 0:
-                msg_dias = f"Tu póliza venció hace {abs(dias_venc)} días"
-                msg_renovacion = "Es importante que gestionemos tu renovación lo antes posible."
-            elif dias_venc == 0:
-                msg_dias = "Tu póliza vence hoy"
-                msg_renovacion = "¿Deseas que gestionemos tu renovación?"
-            else:
-                msg_dias = f"Faltan {dias_venc} días"
-                msg_renovacion = "¿Deseas que gestionemos tu renovación?"
-
-            msg = (
-                f"Hola {nombre}, tu póliza {num_poliza} "
-                f"({producto} - {plan}) vence el {fecha_fin}. "
-                f"{msg_dias}. "
-                f"{msg_renovacion}"
-            )
-
-            st.markdown(f"**📧 Para: {destinatario}**")
-            st.text_area("", msg, height=80, disabled=True, key=f"preview_renov_{idx}")
+        if canal_lower == CANAL_AUTOMATICO:
+            primeras = view_filtrado.head(3)
+            previas = pd.concat([
+                renderizar_mensajes(grupo, "renovacion", canal_fila)
+                for canal_fila, grupo in primeras.groupby(canal_asignado[primeras.index], sort=False)
+            ]).loc[primeras.index]
+        else:
+            previas = renderizar_mensajes(view_filtrado.head(3), "renovacion", canal_lower)
+        for idx, previa in previas.iterrows():
+            st.markdown(f"**📧 Para: {previa['destinatario']}**")
+            st.text_area("", previa["mensaje"], height=80, disabled=True, key=f"preview_renov_{idx}")
 
     # Botón de envío masivo
     st.divider()
     
+    # Ventanas de envío: cada mensaje se libera en la franja del horario preferido del cliente
+    respetar_horario = st.checkbox("🕒 Respetar horario preferido de contacto", value=True)
+    if respetar_horario:
+        st.dataframe(resumen_ventanas(view_filtrado), use_container_width=True, hide_index=True)
+    
     col1, col2 = st.columns([1, 3])
     
     resultados = None
+    # Campaña en seguimiento: la de esta sesión o la última encolada (permite retomar tras cerrar la pestaña)
+    campana_id = st.session_state.get("campana_renovacion") or ultima_campana("renovacion")
     
     with col1:
         if st.button("📤 Enviar a Todos", type="primary", use_container_width=True):
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
-            # Callback para actualizar progreso
-            def update_progress(current, total):
-                progress = current / total
-                progress_bar.progress(progress)
-                status_text.text(f"Enviando {current} de {total} notificaciones...")
-            
-            # Enviar notificaciones
-            resultados = enviar_notificaciones_renovacion_masivo(
-                view_filtrado, 
+            # Encolar la campaña; el worker del outbox realiza el envío en segundo plano
+            campana_id = encolar_campana(
+                view_filtrado,
+                tipo="renovacion",
                 canal=canal_lower,
-                progress_callback=update_progress
+                usuario=st.session_state.get("user"),
+                respetar_horario=respetar_horario
             )
-            
-            # Completar barra de progreso
-            progress_bar.progress(1.0)
-            status_text.text("✅ Envío completado")
+            st.session_state["campana_renovacion"] = campana_id
+            st.success(f"✅ Campaña encolada ({len(view_filtrado)} notificaciones)")
     
     with col2:
         if st.button("🔄 Recargar", use_container_width=True):
             st.rerun()
     
+    # Estado de la campaña (se consulta el outbox en cada recarga)
+    if campana_id:
+        estado = estado_campana(campana_id)
+        if estado is not None:
+            st.divider()
+            st.subheader(f"📬 Campaña {campana_id} ({estado['canal'].title()})")
+            st.caption(f"Encolada el {estado['creada'][:19].replace('T', ' ')} por {estado['usuario'] or 'N/A'}")
+            st.progress(estado["procesados"] / estado["total"] if estado["total"] > 0 else 1.0)
+            if estado["terminada"]:
+                st.caption("✅ Envío completado")
+            elif estado["programados"]:
+                st.info(
+                    f"🕒 {estado['programados']} notificación(es) programadas según el horario preferido de contacto; "
+                    f"la próxima se libera el {estado['proxima_liberacion']:%Y-%m-%d %H:%M}. "
+                    "El worker (`python worker_outbox.py`) las envía al abrir cada franja."
+                )
+            else:
+                st.info(
+                    f"⏳ {estado['procesados']} de {estado['total']} notificaciones procesadas"
+                    + (f" ({estado['tasa']:.1f}/s, faltan ~{estado['eta']:.0f} s)" if estado["eta"] is not None else "")
+                    + ". El envío continúa en segundo plano (`python worker_outbox.py`); usa 🔄 Recargar para actualizar."
+                )
+            # Avance publicado por el worker del lote que se está enviando
+            en_curso = estado["en_curso"]
+            if en_curso["procesados"] > 0:
+                st.caption(
+                    f"🔄 En curso: ✅ {en_curso['enviados']} enviados · ❌ {en_curso['fallidos']} fallidos · "
+                    f"⚠️ {en_curso['bloqueados']} bloqueados · 🔁 {en_curso['duplicados']} ya notificados"
+                )
+            resultados = resultados_campana(campana_id)
+    
     # Mostrar resultados fuera de las columnas para que ocupen ancho completo
-    if resultados is not None:
+    if resultados is not None and resultados["total"] > 0:
         st.divider()
         st.subheader("📊 Resumen del Envío Masivo")
         
-        col1, col2, col3, col4 = st.columns(4)
+        col1, col2, col3, col4, col5, col6, col7 = st.columns(7)
         col1.metric("✅ Enviados", resultados["enviados"], 
                    delta=f"{(resultados['enviados']/resultados['total']*100):.1f}%")
         col2.metric("❌ Fallidos", resultados["fallidos"],
@@ -174,6 +196,12 @@ def render(df: pd.DataFrame):
                    delta=f"{(resultados['bloqueados']/resultados['total']*100):.1f}%")
         col4.metric("📭 Sin destinatario", resultados["sin_destinatario"],
                    delta=f"{(resultados['sin_destinatario']/resultados['total']*100):.1f}%")
+        col5.metric("🚫 Contacto inválido", resultados["invalidos"],
+                   delta=f"{(resultados['invalidos']/resultados['total']*100):.1f}%")
+        col6.metric("🔁 Ya notificados", resultados["duplicados"],
+                   delta=f"{(resultados['duplicados']/resultados['total']*100):.1f}%")
+        col7.metric("⏸️ Reencolados", resultados["reencolados"],
+                   delta=f"{(resultados['reencolados']/resultados['total']*100):.1f}%")
         
         # Tabla de detalles
         if resultados["detalles"]:
@@ -188,11 +216,18 @@ def render(df: pd.DataFrame):
                     "enviado": "✅ Enviado",
                     "fallido": "❌ Fallido",
                     "bloqueado": "⚠️ Bloqueado",
-                    "sin_destinatario": "📭 Sin destinatario"
+                    "sin_destinatario": "📭 Sin destinatario",
+                    "contacto_invalido": "🚫 Contacto inválido",
+                    "duplicado": "🔁 Ya notificado",
+                    "reencolado": "⏸️ Reencolado",
+                    "pendiente": "⏳ Pendiente",
+                    "procesando": "🔄 Procesando"
                 }.get(x, x)
             )
             
             cols_display = ["id_poliza", "nombre", "Estado"]
+            if "canal" in df_resultados.columns:
+                cols_display.append("canal")
             if "destinatario" in df_resultados.columns:
                 cols_display.append("destinatario")
             if "error" in df_resultados.columns:
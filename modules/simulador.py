@@ -0,0 +1,161 @@
+"""
+Simulador de proveedores de envío (SMTP / Twilio) para el modo prototipo
+Reemplaza la espera fija por latencias aleatorias, errores transitorios, rechazos, límites de
+tasa y saturación configurables por canal, con los mismos tipos de error que los proveedores
+reales para ejercitar el despacho concurrente, los reintentos y el circuit breaker sin red
+"""
+import math
+import os
+import random
+import smtplib
+import threading
+import time
+import uuid
+from typing import Dict, Any
+import streamlit as st
+
+from modules.despacho import LimitadorTasa
+from modules.twilio_cliente import ErrorTwilio
+
+DISTRIBUCIONES = ["fija", "normal", "lognormal", "exponencial"]
+
+# Por defecto reproduce el modo prototipo original: 0.5 s por mensaje y todos exitosos
+SIMULADOR_POR_DEFECTO = {
+    "latencia_media": 0.5,         # segundos
+    "latencia_desviacion": 0.0,    # segundos (ignorada en 'fija' y 'exponencial')
+    "distribucion": "fija",
+    "tasa_error": 0.0,             # probabilidad de error transitorio (caída, timeout)
+    "tasa_rechazo": 0.0,           # probabilidad de rechazo permanente (destinatario inválido)
+    "limite_tasa": 0.0,            # mensajes/segundo que acepta el proveedor (0 = sin límite)
+    "concurrencia_maxima": 0,      # envíos simultáneos que atiende el proveedor (0 = sin límite)
+    "semilla": None,               # semilla aleatoria para corridas reproducibles
+}
+
+def get_config_simulador(canal: str) -> Dict[str, Any]:
+    """
+    Obtiene la configuración del simulador del canal desde variables de entorno
+    (SIMULADOR_<CANAL>_<PARAMETRO>) o de la sección [simulador.<canal>] de secrets
+    """
+    try:
+        simulador_secrets = st.secrets.get("simulador", {}).get(canal, {})
+    except (AttributeError, FileNotFoundError, KeyError):
+        simulador_secrets = {}
+
+    config = {}
+    for clave, defecto in SIMULADOR_POR_DEFECTO.items():
+        valor = os.getenv(f"SIMULADOR_{canal.upper()}_{clave.upper()}", simulador_secrets.get(clave, defecto))
+        if clave == "distribucion":
+            valor = str(valor).lower()
+        elif clave == "semilla":
+            valor = None if valor in (None, "") else int(valor)
+        elif clave == "concurrencia_maxima":
+            valor = int(valor)
+        else:
+            valor = float(valor)
+        config[clave] = valor
+    if config["distribucion"] not in DISTRIBUCIONES:
+        raise ValueError(f"Distribución de latencia no soportada: {config['distribucion']}")
+    return config
+
+class SimuladorCanal:
+    """
+    Proveedor simulado de un canal
+
+    Cada envío espera una latencia aleatoria y luego puede fallar con los errores que
+    produciría el proveedor real del canal:
+    - límite de tasa excedido: SMTP 451 / Twilio 429 (transitorio)
+    - error transitorio: conexión cerrada por el servidor / Twilio 503
+    - rechazo: destinatario rechazado / Twilio 400 número inválido (permanente)
+    Los envíos por encima de la concurrencia máxima esperan turno (saturación del proveedor).
+    """
+
+    def __init__(self, canal: str, config: Dict[str, Any]):
+        self.canal = canal
+        self.config = config
+        self._azar = random.Random(config["semilla"])
+        self._azar_lock = threading.Lock()
+        self._limitador = LimitadorTasa(config["limite_tasa"])
+        concurrencia = config["concurrencia_maxima"]
+        self._cupos = threading.BoundedSemaphore(concurrencia) if concurrencia > 0 else None
+        self._lock = threading.Lock()
+        self.contadores = {"enviados": 0, "errores": 0, "rechazos": 0, "limitados": 0}
+
+    def _sortear(self):
+        """Latencia y resultado del envío (una sola sección crítica por mensaje)"""
+        media, desviacion = self.config["latencia_media"], self.config["latencia_desviacion"]
+        distribucion = self.config["distribucion"]
+        with self._azar_lock:
+            if distribucion == "fija" or media <= 0:
+                latencia = media
+            elif distribucion == "normal":
+                latencia = self._azar.gauss(media, desviacion)
+            elif distribucion == "exponencial":
+                latencia = self._azar.expovariate(1 / media)
+            else:  # lognormal con la media y desviación indicadas
+                sigma2 = math.log(1 + (desviacion / media) ** 2)
+                latencia = self._azar.lognormvariate(math.log(media) - sigma2 / 2, math.sqrt(sigma2))
+            sorteo = self._azar.random()
+        return max(0.0, latencia), sorteo
+
+    def _contar(self, clave: str):
+        with self._lock:
+            self.contadores[clave] += 1
+
+    def enviar(self, destinatario: str) -> str:
+        """
+        Simula el envío de un mensaje
+
+        Returns:
+            Identificador simulado del mensaje
+
+        Raises:
+            Los mismos tipos de error que el proveedor real del canal
+        """
+        if self._cupos is not None:
+            self._cupos.acquire()
+        try:
+            latencia, sorteo = self._sortear()
+            time.sleep(latencia)
+
+            if not self._limitador.intentar():
+                self._contar("limitados")
+                if self.canal == "email":
+                    raise smtplib.SMTPResponseException(451, b"Simulado: demasiados mensajes, intente mas tarde")
+                raise ErrorTwilio(429, "Simulado: Too Many Requests", 20429)
+
+            tasa_error, tasa_rechazo = self.config["tasa_error"], self.config["tasa_rechazo"]
+            if sorteo < tasa_error:
+                self._contar("errores")
+                if self.canal == "email":
+                    raise smtplib.SMTPServerDisconnected("Simulado: conexión cerrada por el servidor")
+                raise ErrorTwilio(503, "Simulado: Service Unavailable")
+            if sorteo < tasa_error + tasa_rechazo:
+                self._contar("rechazos")
+                if self.canal == "email":
+                    raise smtplib.SMTPRecipientsRefused({destinatario: (550, b"Simulado: buzon inexistente")})
+                raise ErrorTwilio(400, "Simulado: Invalid 'To' Phone Number", 21211)
+
+            self._contar("enviados")
+            return f"sim-{uuid.uuid4().hex[:12]}"
+        finally:
+            if self._cupos is not None:
+                self._cupos.release()
+
+    def estadisticas(self) -> Dict[str, int]:
+        """Conteo de resultados simulados desde que se creó el simulador"""
+        with self._lock:
+            return dict(self.contadores)
+
+# Un simulador por canal y por proceso; se recrea si cambia la configuración
+_simuladores: Dict[str, SimuladorCanal] = {}
+_simuladores_lock = threading.Lock()
+
+def obtener_simulador(canal: str) -> SimuladorCanal:
+    """Simulador compartido del canal ('email' o 'whatsapp')"""
+    config = get_config_simulador(canal)
+    with _simuladores_lock:
+        simulador = _simuladores.get(canal)
+        if simulador is None or simulador.config != config:
+            simulador = SimuladorCanal(canal, config)
+            _simuladores[canal] = simulador
+        return simulador
@@ -0,0 +1,215 @@
+"""
+Pool de sesiones SMTP reutilizables para el envío de emails
+Una campaña masiva comparte conexiones ya autenticadas en lugar de abrir TCP+TLS+AUTH por mensaje
+"""
+import smtplib
+import threading
+import time
+from email.message import Message
+from typing import Dict, Any, List, Tuple
+
+# Valores por defecto del pool
+MAX_CONEXIONES = 4
+MAX_MENSAJES_POR_CONEXION = 100
+TTL_INACTIVA_SEGUNDOS = 300       # Conexiones inactivas más tiempo que esto se cierran
+VERIFICAR_DESPUES_SEGUNDOS = 30   # Conexiones inactivas más tiempo que esto se verifican con NOOP
+TIMEOUT_SEGUNDOS = 30
+
+def es_error_de_conexion(error: Exception) -> bool:
+    """
+    Indica si el error corresponde a la sesión SMTP (y no al mensaje)
+
+    SMTPException hereda de OSError, por eso se evalúa antes que los errores de socket.
+    """
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code == 421  # Servicio no disponible, cerrando canal
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    return isinstance(error, OSError)
+
+class _ConexionSMTP:
+    """Sesión SMTP autenticada con su contador de mensajes y marca de último uso"""
+
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.mensajes = 0
+        self.creada = time.monotonic()
+        self.ultimo_uso = self.creada
+
+    def cerrar(self):
+        try:
+            self.smtp.quit()
+        except Exception:
+            try:
+                self.smtp.close()
+            except Exception:
+                pass
+
+class PoolSMTP:
+    """
+    Pool thread-safe de conexiones SMTP
+
+    - Reutiliza sesiones autenticadas entre mensajes y entre campañas (dentro del TTL)
+    - Verifica con NOOP las conexiones que estuvieron inactivas antes de reutilizarlas
+    - Si una sesión reutilizada resulta cerrada por el servidor, reenvía una vez por una
+      conexión nueva (una sesión vieja no es un fallo del proveedor); un fallo con una
+      conexión nueva se propaga y lo reintenta ejecutar_con_reintentos
+    - Cierra cada conexión al alcanzar el máximo de mensajes permitido
+    """
+
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        max_conexiones: int = MAX_CONEXIONES,
+        max_mensajes_por_conexion: int = MAX_MENSAJES_POR_CONEXION,
+        ttl_inactiva: float = TTL_INACTIVA_SEGUNDOS,
+        timeout: float = TIMEOUT_SEGUNDOS
+    ):
+        self.config = config
+        self.max_mensajes_por_conexion = max_mensajes_por_conexion
+        self.ttl_inactiva = ttl_inactiva
+        self.timeout = timeout
+        self._inactivas: List[_ConexionSMTP] = []
+        self._lock = threading.Lock()
+        self._cupos = threading.BoundedSemaphore(max_conexiones)
+        self.conexiones_abiertas = 0
+
+    def _conectar(self) -> _ConexionSMTP:
+        """Abre una conexión nueva (TCP + STARTTLS + AUTH según configuración)"""
+        smtp = smtplib.SMTP(self.config["smtp_server"], self.config["smtp_port"], timeout=self.timeout)
+        try:
+            if self.config.get("smtp_starttls", True):
+                smtp.starttls()
+            if self.config.get("email_password"):
+                smtp.login(self.config["email_from"], self.config["email_password"])
+        except Exception:
+            smtp.close()
+            raise
+        with self._lock:
+            self.conexiones_abiertas += 1
+        return _ConexionSMTP(smtp)
+
+    @staticmethod
+    def _esta_viva(conexion: _ConexionSMTP) -> bool:
+        """Health check: NOOP debe responder 250"""
+        try:
+            return conexion.smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _tomar(self) -> _ConexionSMTP:
+        """Toma una conexión sana del pool o abre una nueva"""
+        ahora = time.monotonic()
+        while True:
+            with self._lock:
+                conexion = self._inactivas.pop() if self._inactivas else None
+            if conexion is None:
+                return self._conectar()
+            inactiva = ahora - conexion.ultimo_uso
+            if inactiva > self.ttl_inactiva:
+                conexion.cerrar()
+                continue
+            if inactiva > VERIFICAR_DESPUES_SEGUNDOS and not self._esta_viva(conexion):
+                conexion.cerrar()
+                continue
+            return conexion
+
+    def _devolver(self, conexion: _ConexionSMTP):
+        """Devuelve la conexión al pool o la cierra si alcanzó su cupo de mensajes"""
+        conexion.ultimo_uso = time.monotonic()
+        if conexion.mensajes >= self.max_mensajes_por_conexion:
+            conexion.cerrar()
+            return
+        with self._lock:
+            self._inactivas.append(conexion)
+
+    def enviar(self, msg: Message) -> None:
+        """
+        Envía un mensaje usando una conexión del pool
+
+        Si una conexión reutilizada del pool resulta caída, se descarta y el mensaje se
+        envía una vez por una conexión nueva. Los errores con una conexión nueva y los del
+        servidor sobre el mensaje se propagan (los reintentos son de la capa de despacho).
+        """
+        with self._cupos:
+            conexion = self._tomar()
+            reutilizada = conexion.mensajes > 0
+            try:
+                self._enviar_en(conexion, msg)
+            except Exception as e:
+                if not reutilizada or not es_error_de_conexion(e):
+                    raise
+                # El servidor cerró la sesión (timeout del lado servidor, 421, reinicio): reconectar una vez
+                self._enviar_en(self._conectar(), msg)
+
+    def _enviar_en(self, conexion: _ConexionSMTP, msg: Message):
+        """
+        Envía por una conexión concreta y la devuelve al pool si la sesión sigue válida
+
+        Los errores sobre el mensaje (ej: destinatario rechazado) dejan la sesión utilizable;
+        los errores de conexión la cierran.
+        """
+        try:
+            conexion.smtp.send_message(msg)
+        except Exception as e:
+            if es_error_de_conexion(e):
+                conexion.cerrar()
+            else:
+                conexion.mensajes += 1
+                self._devolver(conexion)
+            raise
+        conexion.mensajes += 1
+        self._devolver(conexion)
+
+    def cerrar_inactivas(self, solo_expiradas: bool = False):
+        """
+        Cierra las conexiones inactivas del pool
+
+        Args:
+            solo_expiradas: Si es True solo cierra las que superaron el TTL de inactividad
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            if solo_expiradas:
+                cerrar = [c for c in self._inactivas if ahora - c.ultimo_uso > self.ttl_inactiva]
+                self._inactivas = [c for c in self._inactivas if ahora - c.ultimo_uso <= self.ttl_inactiva]
+            else:
+                cerrar, self._inactivas = self._inactivas, []
+        for conexion in cerrar:
+            conexion.cerrar()
+
+# Pools compartidos por configuración (servidor, puerto, usuario, TLS)
+_pools: Dict[Tuple, PoolSMTP] = {}
+_pools_lock = threading.Lock()
+
+def obtener_pool_smtp(config: Dict[str, Any]) -> PoolSMTP:
+    """
+    Obtiene el pool compartido para la configuración de email dada
+
+    Args:
+        config: Configuración de get_config_email()
+
+    Returns:
+        PoolSMTP reutilizable entre envíos y campañas
+    """
+    clave = (
+        config["smtp_server"], int(config["smtp_port"]), config["email_from"],
+        config.get("email_password", ""), bool(config.get("smtp_starttls", True))
+    )
+    with _pools_lock:
+        pool = _pools.get(clave)
+        if pool is None:
+            pool = PoolSMTP(config)
+            _pools[clave] = pool
+        else:
+            pool.cerrar_inactivas(solo_expiradas=True)
+        return pool
+
+def cerrar_pools_smtp():
+    """Cierra todas las conexiones inactivas de todos los pools"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.cerrar_inactivas()
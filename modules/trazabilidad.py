@@ -3,11 +3,52 @@ Módulo de trazabilidad para visualizar logs de notificaciones
 """
 import streamlit as st
 import pandas as pd
-from modules.notificaciones import obtener_logs_notificaciones
+import plotly.express as px
+from datetime import timedelta
+from modules.notificaciones import consultar_logs_notificaciones, obtener_historial_notificaciones
+from modules.metricas_envio import obtener_agregador_throughput, obtener_contadores_log
+
+COLORES_ESTADO = {"enviado": "#10B981", "fallido": "#EF4444", "bloqueado": "#F59E0B"}
+
+PERIODOS_THROUGHPUT = {
+    "Última hora": timedelta(hours=1),
+    "Últimas 24 horas": timedelta(hours=24),
+    "Últimos 7 días": timedelta(days=7),
+}
+
+def render_throughput():
+    """Panel de ritmo de envío por canal (envíos, fallos y bloqueos por minuto/hora)"""
+    agregador = obtener_agregador_throughput()
+    agregador.actualizar()  # Solo procesa las líneas nuevas del log
+    
+    col1, col2 = st.columns(2)
+    granularidad = col1.radio("Granularidad", ["Minuto", "Hora"], horizontal=True, key="throughput_gran")
+    periodo = col2.selectbox("Periodo (hasta la última actividad)", list(PERIODOS_THROUGHPUT.keys()), index=1, key="throughput_periodo")
+    
+    desde = agregador.ultima_actividad() - PERIODOS_THROUGHPUT[periodo]
+    serie = agregador.serie(frecuencia="min" if granularidad == "Minuto" else "h", desde=desde)
+    if serie.empty:
+        st.info("No hay actividad de envío en el periodo seleccionado.")
+        return
+    
+    fig = px.bar(
+        serie,
+        x="periodo",
+        y="cantidad",
+        color="estado",
+        facet_row="canal",
+        color_discrete_map=COLORES_ESTADO,
+        labels={"periodo": "Fecha/Hora", "cantidad": f"Notificaciones por {granularidad.lower()}", "estado": "Estado"}
+    )
+    fig.update_layout(height=max(300, 220 * serie["canal"].nunique()), margin=dict(t=30, b=30, l=50, r=50))
+    st.plotly_chart(fig, use_container_width=True)
 
 def render(df: pd.DataFrame = None):
     st.title("📋 Trazabilidad de Notificaciones")
     
+    contadores = obtener_contadores_log()
+    contadores.actualizar()  # Solo procesa las líneas nuevas del log
+    
     # Filtros
     col1, col2, col3, col4 = st.columns(4)
     
@@ -31,47 +72,63 @@ def render(df: pd.DataFrame = None):
     
     limite = col4.number_input("Límite de registros", min_value=10, max_value=1000, value=100, step=10)
     
-    # Obtener logs
-    df_logs = obtener_logs_notificaciones(limite=limite)
+    col1, col2 = st.columns(2)
     
-    if df_logs.empty:
+    usuario_filtro = col1.selectbox(
+        "Usuario",
+        ["Todos"] + contadores.valores("usuario"),
+        key="filtro_usuario"
+    )
+    
+    rango_fechas = col2.date_input("Rango de fechas", value=(), key="filtro_fechas")
+    
+    if not contadores.totales():
         st.info("No hay registros de notificaciones aún.")
         return
     
-    # Aplicar filtros
-    view = df_logs.copy()
-    
+    # Los filtros se aplican en el escaneo del log y sobre los conteos del historial
+    filtros = {}
     if tipo_filtro != "Todos":
         tipo_map = {"Cartera": "cartera", "Renovación": "renovacion"}
-        tipo_buscado = tipo_map.get(tipo_filtro, tipo_filtro.lower())
-        # Comparación case-insensitive y normalizada
-        view = view[view["tipo"].astype(str).str.lower().str.strip() == tipo_buscado.lower()]
+        filtros["tipo"] = tipo_map.get(tipo_filtro, tipo_filtro.lower())
     
     if canal_filtro != "Todos":
         canal_map = {"Email": "email", "WhatsApp": "whatsapp"}
-        canal_buscado = canal_map.get(canal_filtro, canal_filtro.lower())
-        # Comparación case-insensitive y normalizada
-        view = view[view["canal"].astype(str).str.lower().str.strip() == canal_buscado.lower()]
+        filtros["canal"] = canal_map.get(canal_filtro, canal_filtro.lower())
     
     if estado_filtro != "Todos":
         estado_map = {"Enviado": "enviado", "Fallido": "fallido", "Bloqueado": "bloqueado"}
-        estado_buscado = estado_map.get(estado_filtro, estado_filtro.lower())
-        # Comparación case-insensitive y normalizada
-        view = view[view["estado"].astype(str).str.lower().str.strip() == estado_buscado.lower()]
+        filtros["estado"] = estado_map.get(estado_filtro, estado_filtro.lower())
     
-    # Métricas
+    if usuario_filtro != "Todos":
+        filtros["usuario"] = usuario_filtro
+    
+    # Mientras se elige el rango, una sola fecha filtra ese día
+    desde = rango_fechas[0] if len(rango_fechas) > 0 else None
+    hasta = rango_fechas[-1] if len(rango_fechas) > 0 else None
+    
+    # Últimos registros que cumplen los filtros
+    view = consultar_logs_notificaciones(filtros, desde=desde, hasta=hasta, limite=limite)
+    
+    # Métricas de todo el historial que cumple los filtros (no solo de los registros de la tabla)
     st.divider()
     col1, col2, col3, col4 = st.columns(4)
     
-    total = len(view)
-    enviados = len(view[view["estado"] == "enviado"])
-    fallidos = len(view[view["estado"] == "fallido"])
-    bloqueados = len(view[view["estado"] == "bloqueado"])
+    por_estado = contadores.totales("estado", filtros, desde, hasta)
+    # Las pólizas 'cubierto' viajaron en el mensaje de otra póliza: no son notificaciones aparte
+    total = sum(valor for estado, valor in por_estado.items() if estado != "cubierto")
+    enviados = por_estado["enviado"]
+    fallidos = por_estado["fallido"]
+    bloqueados = por_estado["bloqueado"]
     
     col1.metric("Total", total)
     col2.metric("Enviados", enviados, delta=f"{(enviados/total*100) if total > 0 else 0:.1f}%")
     col3.metric("Fallidos", fallidos, delta=f"{(fallidos/total*100) if total > 0 else 0:.1f}%")
     col4.metric("Bloqueados", bloqueados, delta=f"{(bloqueados/total*100) if total > 0 else 0:.1f}%")
+    st.caption(f"Métricas sobre todo el historial que cumple los filtros; la tabla muestra los últimos {len(view)} registros.")
+    
+    with st.expander("📈 Ritmo de envío por canal"):
+        render_throughput()
     
     st.divider()
     
@@ -137,7 +194,8 @@ def render(df: pd.DataFrame = None):
             lambda x: {
                 "enviado": "✅ Enviado",
                 "fallido": "❌ Fallido",
-                "bloqueado": "⚠️ Bloqueado"
+                "bloqueado": "⚠️ Bloqueado",
+                "cubierto": "🔗 Incluida en otro mensaje"
             }.get(str(x).lower(), str(x).title())
         )
     
@@ -180,7 +238,7 @@ def render(df: pd.DataFrame = None):
     st.divider()
     st.subheader("📄 Trazabilidad por Cliente")
     
-    if df is not None and len(df_logs) > 0:
+    if df is not None:
         # Campo de búsqueda
         busqueda_cliente = st.text_input("🔍 Buscar cliente (nombre o documento)", key="busqueda_cliente_trazabilidad")
         
@@ -197,11 +255,12 @@ def render(df: pd.DataFrame = None):
                 # Obtener IDs de clientes que coinciden
                 ids_clientes = clientes_coincidentes["id_cliente"].astype(str).unique()
                 
-                # Filtrar logs completos por esos IDs de clientes (sin aplicar otros filtros)
-                view_cliente = df_logs[df_logs["id_cliente"].astype(str).isin(ids_clientes)]
+                # Historial completo de esos clientes desde el índice del log (sin aplicar otros filtros
+                # ni el límite de registros de la tabla)
+                view_cliente = obtener_historial_notificaciones("id_cliente", ids_clientes)
                 
                 if len(view_cliente) > 0:
-                    st.success(f"✅ Se encontraron {len(view_cliente)} notificación(es) para el cliente")
+                    st.success(f"✅ Se encontraron {len(view_cliente)} notificación(es) para el cliente en todo el historial")
                     
                     # Mostrar información del cliente
                     cliente_principal = clientes_coincidentes.iloc[0]
@@ -0,0 +1,139 @@
+"""
+Cliente HTTP reutilizable para la API de mensajes de Twilio (WhatsApp)
+Una campaña comparte la misma sesión y pool de conexiones keep-alive en lugar de
+crear un cliente (y un handshake TLS) por mensaje
+"""
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+
+API_BASE_POR_DEFECTO = "https://api.twilio.com"
+MAX_CONEXIONES = 16
+TIMEOUT_SEGUNDOS = 30
+
+class ErrorTwilio(Exception):
+    """
+    Error devuelto por la API de Twilio
+
+    'reintentar_en' trae los segundos de la cabecera Retry-After (429/503) para que la capa
+    de reintentos (modules/reintentos.py) la respete; None si la respuesta no la incluye.
+    """
+
+    def __init__(self, status: int, mensaje: str, codigo: Optional[int] = None, reintentar_en: Optional[float] = None):
+        self.status = status
+        self.codigo = codigo
+        self.reintentar_en = reintentar_en
+        detalle = f"HTTP {status}" + (f" (código {codigo})" if codigo else "")
+        super().__init__(f"Error de Twilio {detalle}: {mensaje}")
+
+def segundos_retry_after(valor: Optional[str]) -> Optional[float]:
+    """
+    Interpreta la cabecera Retry-After (segundos o fecha HTTP)
+
+    Returns:
+        Segundos de espera, o None si la cabecera no existe o no es válida
+    """
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        fecha = parsedate_to_datetime(valor)
+    except (TypeError, ValueError):
+        return None
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    return max(0.0, (fecha - datetime.now(timezone.utc)).total_seconds())
+
+class ClienteTwilio:
+    """
+    Cliente thread-safe de la API de mensajes de Twilio
+
+    - Una requests.Session con pool de conexiones keep-alive compartida entre hilos
+    - Hace un solo intento por mensaje: los reintentos, el Retry-After y la pausa del canal
+      los maneja ejecutar_con_reintentos, para que cada fallo del proveedor cuente una vez
+      en el circuit breaker
+    """
+
+    def __init__(
+        self,
+        account_sid: str,
+        auth_token: str,
+        api_base: str = API_BASE_POR_DEFECTO,
+        max_conexiones: int = MAX_CONEXIONES,
+        timeout: float = TIMEOUT_SEGUNDOS
+    ):
+        self.account_sid = account_sid
+        self.url_mensajes = f"{api_base.rstrip('/')}/2010-04-01/Accounts/{account_sid}/Messages.json"
+        self.timeout = timeout
+        self.sesion = requests.Session()
+        self.sesion.auth = (account_sid, auth_token)
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=max_conexiones)
+        self.sesion.mount("http://", adaptador)
+        self.sesion.mount("https://", adaptador)
+
+    def enviar_mensaje(self, from_: str, to: str, body: str) -> Dict[str, Any]:
+        """
+        Crea un mensaje (POST /Messages.json)
+
+        Args:
+            from_: Remitente (ej: whatsapp:+14155238886)
+            to: Destinatario (ej: whatsapp:+573001234567)
+            body: Texto del mensaje
+
+        Returns:
+            Recurso del mensaje creado (incluye 'sid' y 'status')
+
+        Raises:
+            ErrorTwilio: Si la API rechaza el mensaje (con Retry-After en reintentar_en)
+        """
+        datos = {"From": from_, "To": to, "Body": body}
+        respuesta = self.sesion.post(self.url_mensajes, data=datos, timeout=self.timeout)
+        if respuesta.status_code < 400:
+            return respuesta.json()
+        raise self._error(respuesta)
+
+    @staticmethod
+    def _error(respuesta: requests.Response) -> ErrorTwilio:
+        """Construye el error a partir del cuerpo JSON de Twilio (code, message)"""
+        try:
+            cuerpo = respuesta.json()
+        except ValueError:
+            cuerpo = {}
+        mensaje = cuerpo.get("message") or respuesta.reason or "respuesta inválida"
+        return ErrorTwilio(
+            respuesta.status_code, mensaje, cuerpo.get("code"),
+            reintentar_en=segundos_retry_after(respuesta.headers.get("Retry-After"))
+        )
+
+    def cerrar(self):
+        """Cierra las conexiones del pool"""
+        self.sesion.close()
+
+# Clientes compartidos por credenciales y URL base
+_clientes: Dict[Tuple, ClienteTwilio] = {}
+_clientes_lock = threading.Lock()
+
+def obtener_cliente_twilio(config: Dict[str, Any]) -> ClienteTwilio:
+    """
+    Obtiene el cliente compartido para la configuración de WhatsApp dada
+
+    Args:
+        config: Configuración de get_config_whatsapp()
+
+    Returns:
+        ClienteTwilio reutilizable entre envíos y campañas
+    """
+    api_base = config.get("api_base") or API_BASE_POR_DEFECTO
+    clave = (config["account_sid"], config["auth_token"], api_base)
+    with _clientes_lock:
+        cliente = _clientes.get(clave)
+        if cliente is None:
+            cliente = ClienteTwilio(config["account_sid"], config["auth_token"], api_base=api_base)
+            _clientes[clave] = cliente
+        return cliente
@@ -0,0 +1,123 @@
+"""
+Ventanas de envío según el horario preferido de contacto
+Agrupa los destinatarios de una campaña por la franja que prefieren (mañana, tarde, noche) y
+calcula cuándo se libera cada mensaje al despacho, repartido a lo largo de la franja para no
+concentrar toda la carga en el momento en que abre
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# Franjas por defecto (hora de inicio, hora de fin) en la hora local del servidor
+VENTANAS_POR_DEFECTO = {
+    "manana": "08:00-12:00",
+    "tarde": "12:00-18:00",
+    "noche": "18:00-21:00",
+}
+
+# Los clientes sin horario preferido (o con uno desconocido) se liberan de inmediato
+SIN_HORARIO = "sin preferencia"
+
+def _hora(texto: str) -> float:
+    """'08:30' u '8' -> horas decimales"""
+    horas, _, minutos = texto.strip().partition(":")
+    return int(horas) + int(minutos or 0) / 60
+
+def _franja(texto: str) -> Tuple[float, float]:
+    inicio, _, fin = str(texto).partition("-")
+    inicio, fin = _hora(inicio), _hora(fin)
+    if not 0 <= inicio < fin <= 24:
+        raise ValueError(f"Franja de envío inválida: {texto}")
+    return inicio, fin
+
+def get_config_ventanas() -> Dict[str, Tuple[float, float]]:
+    """
+    Obtiene las franjas de envío desde variables de entorno (VENTANA_MANANA, VENTANA_TARDE,
+    VENTANA_NOCHE) o de la sección [ventanas] de secrets, con formato 'HH:MM-HH:MM'
+    """
+    try:
+        ventanas_secrets = st.secrets.get("ventanas", {})
+    except (AttributeError, FileNotFoundError, KeyError):
+        ventanas_secrets = {}
+
+    return {
+        franja: _franja(os.getenv(f"VENTANA_{franja.upper()}", ventanas_secrets.get(franja, defecto)))
+        for franja, defecto in VENTANAS_POR_DEFECTO.items()
+    }
+
+def normalizar_horario(valores: pd.Series) -> pd.Series:
+    """Horario preferido como clave de franja ('mañana' -> 'manana'); '' si no hay preferencia"""
+    texto = valores.astype(str).str.strip().str.lower().str.normalize("NFKD")
+    texto = texto.str.encode("ascii", "ignore").str.decode("ascii")
+    return texto.where(valores.notna(), "")
+
+def _limites(ahora: datetime, inicio: float, fin: float) -> Tuple[datetime, datetime]:
+    """Próxima apertura de la franja (o ahora si ya está abierta) y su cierre"""
+    hoy = ahora.replace(hour=0, minute=0, second=0, microsecond=0)
+    apertura, cierre = hoy + timedelta(hours=inicio), hoy + timedelta(hours=fin)
+    if ahora >= cierre:
+        return apertura + timedelta(days=1), cierre + timedelta(days=1)
+    return max(apertura, ahora), cierre
+
+def aperturas_envio(
+    df: pd.DataFrame,
+    ahora: Optional[datetime] = None,
+    espaciar: bool = True,
+    ventanas: Optional[Dict[str, Tuple[float, float]]] = None
+) -> np.ndarray:
+    """
+    Momento (epoch en segundos) en que se libera al despacho el mensaje de cada fila
+
+    Args:
+        df: Filas de la campaña (columna horario_preferido_contacto)
+        ahora: Momento de referencia (por defecto ahora)
+        espaciar: Reparte los mensajes de cada franja a lo largo de su duración en lugar
+            de liberarlos todos al abrir
+        ventanas: Franjas a usar (por defecto las configuradas)
+
+    Returns:
+        Arreglo alineado con df; las filas sin preferencia se liberan en 'ahora'
+    """
+    ahora = ahora or datetime.now()
+    ventanas = ventanas or get_config_ventanas()
+    aperturas = np.full(len(df), ahora.timestamp())
+    if "horario_preferido_contacto" not in df.columns or len(df) == 0:
+        return aperturas
+
+    franjas = normalizar_horario(df["horario_preferido_contacto"]).to_numpy()
+    for franja, (inicio, fin) in ventanas.items():
+        filas = np.flatnonzero(franjas == franja)
+        if len(filas) == 0:
+            continue
+        apertura, cierre = _limites(ahora, inicio, fin)
+        aperturas[filas] = apertura.timestamp()
+        if espaciar:
+            aperturas[filas] += np.arange(len(filas)) / len(filas) * (cierre - apertura).total_seconds()
+    return aperturas
+
+def resumen_ventanas(df: pd.DataFrame, ahora: Optional[datetime] = None) -> pd.DataFrame:
+    """
+    Destinatarios por franja con el intervalo en que se liberan
+
+    Returns:
+        DataFrame con columnas franja, destinatarios, desde, hasta
+    """
+    ahora = ahora or datetime.now()
+    ventanas = get_config_ventanas()
+    if "horario_preferido_contacto" in df.columns:
+        franjas = normalizar_horario(df["horario_preferido_contacto"])
+    else:
+        franjas = pd.Series("", index=df.index)
+    conteos = franjas.where(franjas.isin(list(ventanas)), "").value_counts()
+
+    filas = []
+    for franja, (inicio, fin) in ventanas.items():
+        if conteos.get(franja, 0):
+            apertura, cierre = _limites(ahora, inicio, fin)
+            filas.append({"franja": franja, "destinatarios": int(conteos[franja]), "desde": apertura, "hasta": cierre})
+    if conteos.get("", 0):
+        filas.append({"franja": SIN_HORARIO, "destinatarios": int(conteos[""]), "desde": ahora, "hasta": ahora})
+    return pd.DataFrame(filas, columns=["franja", "destinatarios", "desde", "hasta"])
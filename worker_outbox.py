@@ -0,0 +1,44 @@
+"""
+Worker del outbox de campañas: despacha en segundo plano los mensajes encolados desde la UI
+
+Uso:
+    python worker_outbox.py            # Ejecuta indefinidamente
+    python worker_outbox.py --una-vez  # Vacía la cola y termina
+"""
+import argparse
+import time
+
+from modules.log_segmentos import compactar
+from modules.notificaciones import NOTIFICACIONES_LOG
+from modules.outbox import procesar_lote, proxima_liberacion, recuperar_abandonados, TAMANO_LOTE
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker del outbox de notificaciones")
+    parser.add_argument("--una-vez", action="store_true", help="Procesa la cola pendiente y termina")
+    parser.add_argument("--intervalo", type=float, default=2.0, help="Segundos de espera cuando la cola está vacía")
+    parser.add_argument("--lote", type=int, default=TAMANO_LOTE, help="Mensajes reclamados por lote")
+    args = parser.parse_args()
+
+    recuperados = recuperar_abandonados()
+    if recuperados:
+        print(f"♻️ {recuperados} mensaje(s) recuperados de una ejecución interrumpida")
+    # Segmentos del log que un proceso anterior rotó pero no alcanzó a compactar
+    compactadas = compactar(NOTIFICACIONES_LOG)
+    if compactadas:
+        print(f"🗜️ {compactadas} entrada(s) del log compactadas")
+
+    while True:
+        procesados = procesar_lote(args.lote)
+        if procesados:
+            print(f"📤 {procesados} mensaje(s) procesados")
+            continue
+        if args.una_vez:
+            break
+        recuperar_abandonados()
+        # Si una franja programada abre antes del próximo sondeo, despertar justo a tiempo
+        proxima = proxima_liberacion()
+        espera = args.intervalo if proxima is None else min(args.intervalo, max(0.0, proxima - time.time()))
+        time.sleep(espera)
+
+if __name__ == "__main__":
+    main()